@@ -0,0 +1,413 @@
+"""Simulations that stop once the answer is known well enough.
+
+Instead of a number of games, give the precision wanted: games are played
+over a process pool a chunk at a time, and the run stops as soon as the
+confidence interval of every metric asked for is that narrow (estimate),
+or as soon as two rule variants are told apart (compare).
+
+Games are counted in game order, and the looks at the results fall on
+fixed game counts (each GROWTH times the last one), so a run stops after
+the same games with any number of workers.  The intervals are normal
+approximations: a metric's half width hardly depends on the games but
+through their number, so stopping on it leaves the confidence as asked
+(split over the metrics, so that they hold together).  A comparison
+stops on the data themselves, so each look spends a part alpha/(k(k+1))
+of the error allowed: whatever look stops it, the chance of a difference
+found where there is none stays within 1 - confidence.
+
+Both sides of a comparison play the same deals (the same game seeds),
+which makes their results alike; their difference is still rated as if
+independent, which only errs on the wide side.
+
+    python adaptive.py estimate -p 4 -c 3 -r 2 --precision 0.005
+    python adaptive.py estimate -p 3 --metric win:1,turns --precision 0.01,1
+    python adaptive.py compare standard variant.json --policy greedy
+"""
+import argparse
+import concurrent.futures
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+import engine
+import policies
+import simulate
+import variants
+
+
+CHUNK = 500  # Games handed to a worker at once; results do not depend on it
+AHEAD = 2  # Chunks queued per worker while waiting for the next one
+MIN_GAMES = 1000  # Games of the first look
+GROWTH = 1.25  # Games of a look over those of the last one, at least
+MAX_GAMES = 10000000  # Default most games of a run
+CONFIDENCE = 0.95  # Default confidence of the intervals
+PRECISION = 0.01  # Default half width wanted: 1 point of a win rate
+STANDARD = 'standard'  # Side of a comparison playing the usual effects
+TURNS = 'turns'
+
+
+def parse_metrics(text, players):
+    """Metrics of a command line flag.
+
+    Args:
+        text: Comma separated 'win:SEAT' (seats from 1), 'win' for every
+            seat or 'turns' (game length).
+        players: Number of seats.
+
+    Returns:
+        List of metrics: a seat index for its win rate, or TURNS.
+
+    Raises:
+        ValueError: unknown metric.
+    """
+    metrics = []
+    for name in text.split(','):
+        name = name.strip()
+        if name == TURNS:
+            metrics.append(TURNS)
+        elif name == 'win':
+            metrics.extend(range(players))
+        elif name.startswith('win:') and name[4:].isdigit() and (
+                1 <= int(name[4:]) <= players):
+            metrics.append(int(name[4:]) - 1)
+        else:
+            raise ValueError(f'Unknown metric {name!r}; choose from win,'
+                             f' win:1 to win:{players} and {TURNS}')
+    return metrics
+
+
+def label(metric):
+    """Name of a metric in reports.
+    """
+    return 'Turns' if metric == TURNS else f'Seat {metric+1} wins'
+
+
+def measure(stats, metric):
+    """Mean and variance per game of a metric.
+
+    Args:
+        stats: simulate.Stats of the games.
+        metric: Seat, or TURNS.
+
+    Returns:
+        (mean, variance) of the metric over the games.
+    """
+    games = stats.games or 1
+    if metric != TURNS:
+        rate = stats.wins[metric] / games
+        return rate, rate * (1 - rate)
+    mean = sum(turns * count for turns, count in stats.turns.items()) / games
+    variance = sum((turns - mean) ** 2 * count
+                   for turns, count in stats.turns.items()) / games
+    return mean, variance
+
+
+def show(metric, value):
+    """A value of a metric, or of a difference of it, for reports.
+    """
+    return f'{value:.2f}' if metric == TURNS else f'{value:.2%}'
+
+
+def z_score(alpha):
+    """Half width of a two-sided interval of error alpha, in deviations.
+    """
+    return statistics.NormalDist().inv_cdf(1 - alpha / 2)
+
+
+def looks(max_games):
+    """Game counts at which a run looks at its results.
+
+    Args:
+        max_games: Most games of the run.
+
+    Yields:
+        Increasing game counts, multiples of CHUNK up to max_games.
+    """
+    games = 0
+    max_games -= max_games % CHUNK
+    while games < max_games:
+        games = min(max_games, max(games + CHUNK, math.ceil(
+            max(MIN_GAMES, games * GROWTH) / CHUNK) * CHUNK))
+        yield games
+
+
+def _now(function, *args):
+    """Future of a call made at once, when there is no pool.
+    """
+    future = concurrent.futures.Future()
+    future.set_result(function(*args))
+    return future
+
+
+class Runner:
+    """Games of one side of a run, counted in game order.
+    """
+    def __init__(self, config, names, seed, pool=None, workers=1,
+                 variant=None, options=None):
+        """Create a runner that has played no games.
+
+        Args:
+            config: simulate.Config of the games.
+            names: Policy name per seat.
+            seed: Seed of the run; game seeds derive from it.
+            pool: concurrent.futures.Executor, or None to play in this
+                process.
+            workers: Number of processes of the pool.
+            variant: Name of a variant file to play, if any.
+            options: Dict of policy settings, see policies.seat_policies().
+        """
+        self.config = config
+        self.names = names
+        self.seed = seed
+        self.submit = pool.submit if pool else _now
+        self.ahead = AHEAD * workers * CHUNK if pool else 0
+        self.variant = variant
+        self.options = options
+        self.stats = simulate.Stats(config.players)
+        self.queued = 0  # Games handed to the pool
+        self.futures = []  # Chunks not counted yet, in game order
+
+    def queue(self, games):
+        """Hand the pool the games before a game number, and some ahead.
+
+        Args:
+            games: Multiple of CHUNK.
+        """
+        while self.queued < games + self.ahead:
+            self.futures.append(self.submit(
+                simulate.run_chunk, self.config, self.names, self.seed,
+                self.queued, self.queued + CHUNK, False, self.options, None,
+                None, False, None, self.variant))
+            self.queued += CHUNK
+
+    def advance(self, games):
+        """Play and count the games before a game number.
+
+        Args:
+            games: Multiple of CHUNK.
+
+        Returns:
+            simulate.Stats of the games counted so far.
+        """
+        self.queue(games)
+        while self.stats.games < games:
+            self.stats.merge(self.futures.pop(0).result())
+        return self.stats
+
+
+def estimate(runner, metrics, precisions, confidence=CONFIDENCE,
+             max_games=MAX_GAMES, out=sys.stdout):
+    """Play until the interval of every metric is narrow enough.
+
+    Args:
+        runner: Runner of the games.
+        metrics: Metrics, see parse_metrics().
+        precisions: Half width wanted of each metric.
+        confidence: Chance that the intervals all hold.
+        max_games: Give up after this many games.
+        out: Text file to print the looks on.
+
+    Returns:
+        (stats, whether the precision was reached, intervals): intervals
+        is a list of (mean, half width) by metric.
+    """
+    z = z_score((1 - confidence) / len(metrics))
+    print(f'{"Games":>9}  ' + '  '.join(
+        f'{label(metric):>22}' for metric in metrics), file=out)
+    for games in looks(max_games):
+        stats = runner.advance(games)
+        intervals = []
+        for metric in metrics:
+            mean, variance = measure(stats, metric)
+            intervals.append((mean, z * math.sqrt(variance / stats.games)))
+        print(f'{stats.games:>9}  ' + '  '.join(
+            f'{show(metric, mean):>10} ± {show(metric, half):<9}'
+            for metric, (mean, half) in zip(metrics, intervals)),
+              file=out, flush=True)
+        if all(half <= precision for (_, half), precision
+               in zip(intervals, precisions)):
+            return stats, True, intervals
+    return stats, False, intervals
+
+
+def compare(first, second, metric, precision, confidence=CONFIDENCE,
+            max_games=MAX_GAMES, out=sys.stdout):
+    """Play two sides until a metric tells them apart, or cannot.
+
+    Args:
+        first: Runner of one side.
+        second: Runner of the other, playing the same game seeds.
+        metric: Metric compared, see parse_metrics().
+        precision: Differences this small do not matter: the run stops
+            once the difference is known to be within it.
+        confidence: Chance of not finding a difference where there is
+            none, over every look.
+        max_games: Give up after this many games of each side.
+        out: Text file to print the looks on.
+
+    Returns:
+        (verdict, difference, half width, games of each side): verdict
+        is 'different', 'same' (within precision) or 'undecided'.
+    """
+    alpha = 1 - confidence
+    print(f'{"Games":>9}  {"First":>11} {"Second":>11}'
+          f'  {label(metric) + " difference":>22}', file=out)
+    for look, games in enumerate(looks(max_games), 1):
+        second.queue(games)  # Keep the pool busy with both sides
+        ones = first.advance(games)
+        others = second.advance(games)
+        mean, variance = measure(ones, metric)
+        other, other_variance = measure(others, metric)
+        difference = mean - other
+        half = z_score(alpha / (look * (look + 1))) * math.sqrt(
+            (variance + other_variance) / games)
+        print(f'{games:>9}  {show(metric, mean):>11}'
+              f' {show(metric, other):>11}'
+              f'  {show(metric, difference):>10} ± {show(metric, half):<9}',
+              file=out, flush=True)
+        if abs(difference) > half:
+            return 'different', difference, half, games
+        if abs(difference) + half <= precision:
+            return 'same', difference, half, games
+    return 'undecided', difference, half, games
+
+
+def main(argv=None):
+    """Estimate metrics of a configuration, or compare two variants.
+
+    Args:
+        argv: Command line arguments; sys.argv if None.
+
+    Returns:
+        Exit status.
+    """
+    parser = argparse.ArgumentParser(
+        description='Grackle simulations that stop at a precision')
+    commands = parser.add_subparsers(dest='command', required=True)
+    estimating = commands.add_parser(
+        'estimate', help='Play until the metrics are known to a precision.')
+    comparing = commands.add_parser(
+        'compare', help='Play two rule variants until a metric tells them'
+                        ' apart.')
+    comparing.add_argument(
+        'first', help=f'Variant file (see variants.py), or {STANDARD}.')
+    comparing.add_argument(
+        'second', help=f'Variant file to compare with, or {STANDARD}.')
+    for command in (estimating, comparing):
+        command.add_argument('-p', '--players', default=engine.PLAYER_MIN,
+                             type=int, help='Number of players.')
+        command.add_argument('-c', '--coins', default=engine.HAND_MIN,
+                             type=int, help='Number of coins in each hand.')
+        command.add_argument('-r', '--remove', default=0, type=int,
+                             help='Number of coins removed before the'
+                                  ' game.')
+        command.add_argument('-f', '--future', action='store_true',
+                             help='Hand padding.')
+        command.add_argument('--policy', default='random',
+                             help='One policy for every seat or comma'
+                                  ' separated policies per seat.')
+        command.add_argument('--confidence', default=CONFIDENCE,
+                             type=float, help='Confidence of the result'
+                             f' (default: {CONFIDENCE}).')
+        command.add_argument('--max-games', default=MAX_GAMES, type=int,
+                             help='Give up after this many games'
+                                  f' (default: {MAX_GAMES}).')
+        command.add_argument('--seed', default=None, type=int,
+                             help='Seed of the run (random if not given).')
+        command.add_argument('--workers', default=os.cpu_count(), type=int,
+                             help='Number of processes.')
+    estimating.add_argument(
+        '--variant', default=None, metavar='FILE',
+        help='Variant file to play (see variants.py).')
+    estimating.add_argument(
+        '--metric', default='win',
+        help='Comma separated metrics: win (every seat), win:SEAT or'
+             f' {TURNS} (default: win).')
+    estimating.add_argument(
+        '--precision', default=str(PRECISION),
+        help='Half width wanted of the intervals, one for every metric or'
+             f' comma separated by metric (default: {PRECISION}).')
+    comparing.add_argument(
+        '--metric', default='win:1',
+        help=f'Metric compared: win:SEAT or {TURNS} (default: win:1).')
+    comparing.add_argument(
+        '--precision', default=PRECISION, type=float,
+        help='Stop once the difference is known to be smaller than this'
+             f' (default: {PRECISION}).')
+    args = parser.parse_args(argv)
+    if not 0 < args.confidence < 1:
+        parser.error('--confidence must be between 0 and 1')
+    if args.max_games < CHUNK:
+        parser.error(f'--max-games must be at least {CHUNK}')
+    config = simulate.Config(args.players, args.coins, args.remove,
+                             args.future)
+    try:
+        names = [policy.name for policy in
+                 policies.seat_policies(args.policy, config.players)]
+        metrics = parse_metrics(args.metric, config.players)
+        if args.command == 'estimate':
+            sides = [args.variant]
+            precisions = [float(value)
+                          for value in args.precision.split(',')]
+            if len(precisions) == 1:
+                precisions *= len(metrics)
+            if len(precisions) != len(metrics):
+                raise ValueError(f'{len(precisions)} precisions for'
+                                 f' {len(metrics)} metrics')
+        else:
+            sides = [None if side == STANDARD else side
+                     for side in (args.first, args.second)]
+            if len(metrics) != 1:
+                raise ValueError('Compare one metric at a time')
+        for side in sides:
+            if side:  # Fail before starting the workers
+                variants.load(side)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    seed = args.seed if args.seed is not None else random.getrandbits(32)
+    print(f'Playing {config} with seed {seed}...')
+    workers = max(1, args.workers)
+    pool = (concurrent.futures.ProcessPoolExecutor(workers) if workers > 1
+            else None)
+    runners = [Runner(config, names, seed, pool, workers, side)
+               for side in sides]
+    began = time.perf_counter()
+    try:
+        if args.command == 'estimate':
+            stats, decided, _ = estimate(runners[0], metrics, precisions,
+                                         args.confidence, args.max_games)
+            played = stats.games
+            outcome = ('Precision reached' if decided
+                       else 'Precision not reached')
+        else:
+            verdict, difference, half, played = compare(
+                *runners, metrics[0], args.precision, args.confidence,
+                args.max_games)
+            decided = verdict != 'undecided'
+            outcome = {
+                'different': f'{args.first} and {args.second} differ',
+                'same': f'{args.first} and {args.second} are within'
+                        f' {show(metrics[0], args.precision)}',
+                'undecided': 'No verdict'}[verdict]
+            played *= 2
+    except KeyboardInterrupt:
+        print('Stopped.', file=sys.stderr)
+        return 130
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - began
+    print(f'{outcome} after {played} games in {elapsed:.1f}s'
+          f' ({played/elapsed:,.0f} games/s)')
+    if args.command == 'compare':
+        print(f'Difference {show(metrics[0], difference)}'
+              f' ± {show(metrics[0], half)}'
+              f' ({args.confidence:.0%} over every look)')
+    return 0 if decided else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
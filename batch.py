@@ -0,0 +1,643 @@
+"""NumPy lockstep simulator for balance studies.
+
+Thousands of games advance together, one turn per step, as arrays:
+
+- pile: (games, 16) circular buffers (head, length), top at head
+- hands: (games, players, HAND_SLOTS) coin ids in the order received
+- in_play: (games, 16) coin ids in the order played
+- larders, shields: (games, players)
+
+Each coin type's effect is applied as array operations over every game
+where that coin is being played.  Only the policies that can be written
+as array operations are supported: random, first and greedy (see
+policies.py), which decide inline as the effects need answers.  Rules are
+the engine's; the random streams are not, so results match the scalar
+simulation statistically, not game for game.  compare() checks that on
+deals shared with the scalar engine.
+
+    python grackle.py --simulate 1000000 --batch
+    python batch.py --games 20000 -p 3 -c 3 --policy greedy,random
+
+Requires NumPy.
+"""
+import argparse
+import concurrent.futures
+import math
+import os
+import random
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:  # Only needed when actually simulating
+    np = None
+
+import engine
+import policies
+import results
+import simulate
+from engine import (
+    CHEST, KEY, ARROW, BOOTS, COIN_PURSE, HAM_HOCK, KNIFE, LANTERN, MIRROR,
+    RAVEN, ROPE, SHIELD, SHOVEL, SICKLE, WIND)
+
+
+POLICY_CODES = {'random': 0, 'first': 1, 'greedy': 2}
+RANDOM, FIRST, GREEDY = 0, 1, 2
+HAND_SLOTS = engine.HAND_MAX + 1  # One spare so removal can shift left
+SLOTS = 16  # Pile buffer and field width; >= number of coins, power of 2
+WRAP = SLOTS - 1
+BATCH_SIZE = 4096
+
+
+def _require_numpy():
+    """Fail clearly without NumPy.
+    """
+    if np is None:
+        raise RuntimeError('The batch simulator requires NumPy')
+
+
+def policy_codes(names):
+    """Array codes of policy names.
+
+    Raises:
+        ValueError: a policy cannot run in the batch simulator.
+    """
+    try:
+        return [POLICY_CODES[name] for name in names]
+    except KeyError as error:
+        raise ValueError(f'Policy {error} is not supported by the batch'
+                         f' simulator; choose from {sorted(POLICY_CODES)}'
+                         ) from None
+
+
+class Batch:
+    """A batch of games played in lockstep.
+    """
+    def __init__(self, config, codes, rng, size):
+        """Create an empty batch; deal() or load() fills it.
+
+        Args:
+            config: simulate.Config of all games.
+            codes: Policy code per seat.
+            rng: numpy.random.Generator.
+            size: Number of games.
+        """
+        _require_numpy()
+        players = config.players
+        self.config = config
+        self.codes = np.asarray(codes)
+        self.rng = rng
+        self.size = size
+        self.seats = np.arange(players)
+        self.hand = np.full((size, players, HAND_SLOTS), -1, np.int64)
+        self.count = np.zeros((size, players), np.int64)
+        self.pile = np.full((size, SLOTS), -1, np.int64)
+        self.head = np.zeros(size, np.int64)
+        self.length = np.zeros(size, np.int64)
+        self.in_play = np.full((size, SLOTS), -1, np.int64)
+        self.played = np.zeros(size, np.int64)
+        self.larder = np.full((size, players), -1, np.int64)
+        self.shield = np.zeros((size, players), bool)
+        self.current = np.full(size, players - 1, np.int64)
+        self.again = np.zeros(size, bool)
+        self.active = np.ones(size, bool)
+        self.winner = np.full(size, engine.NONE, np.int64)
+        self.turns = np.zeros(size, np.int64)
+        self.plays = np.zeros((size, len(engine.COIN_NAMES)), np.int64)
+        self.removed = np.zeros((size, len(engine.COIN_NAMES)), bool)
+
+    # Setting up
+
+    def deal(self):
+        """Remove coins, shuffle and deal, like engine.new_table().
+        """
+        config, size = self.config, self.size
+        others = len(engine.COIN_NAMES) - 2
+        remove = min(config.remove,
+                     max(0, others - config.coins * config.players))
+        order = np.argsort(self.rng.random((size, others)), axis=1) + 2
+        rows = np.arange(size)[:, None]
+        self.removed[rows, order[:, :remove]] = True
+        coins = np.concatenate(
+            [np.tile([CHEST, KEY], (size, 1)), order[:, remove:]], axis=1)
+        shuffle = np.argsort(self.rng.random(coins.shape), axis=1)
+        coins = np.take_along_axis(coins, shuffle, axis=1)
+        self.pile[:, :coins.shape[1]] = coins
+        self.length[:] = coins.shape[1]
+        for _ in range(1, config.coins):  # take into account drawn coin
+            for player in range(config.players):
+                games = np.arange(size)
+                self.give(games, np.full(size, player), self.pop_top(games))
+
+    def load(self, tables):
+        """Start from the deals of scalar games instead of dealing.
+
+        Args:
+            tables: engine.Table per game, as returned by new_table().
+        """
+        for game, table in enumerate(tables):
+            state = table.freeze()
+            hands = [list(hand) for hand in state.hands]
+            pile = list(state.pile)
+            for event in table.events:  # undo the first draw of seat 0
+                if event.kind == engine.DREW:
+                    hands[event.player].remove(event.coin)
+                    pile.insert(0, event.coin)
+            for seat, hand in enumerate(hands):
+                self.hand[game, seat, :len(hand)] = hand
+                self.count[game, seat] = len(hand)
+            self.pile[game, :len(pile)] = pile
+            self.length[game] = len(pile)
+            self.removed[game, list(state.removed)] = True
+
+    # Array primitives; `games` index arrays never repeat a game
+
+    def top(self, games, depth=0):
+        """Coin at a depth from the top of the pile.
+        """
+        return self.pile[games, (self.head[games] + depth) & WRAP]
+
+    def pop_top(self, games):
+        """Take the top coin of non-empty piles.
+        """
+        coins = self.top(games)
+        self.head[games] = (self.head[games] + 1) & WRAP
+        self.length[games] -= 1
+        return coins
+
+    def push_top(self, games, coins):
+        """Put coins on top of the piles.
+        """
+        self.head[games] = (self.head[games] - 1) & WRAP
+        self.pile[games, self.head[games]] = coins
+        self.length[games] += 1
+
+    def push_bottom(self, games, coins):
+        """Bury coins at the bottom of the piles.
+        """
+        self.pile[games, (self.head[games] + self.length[games]) & WRAP] = (
+            coins)
+        self.length[games] += 1
+
+    def pop_bottom(self, games):
+        """Take the bottom coin of non-empty piles.
+        """
+        self.length[games] -= 1
+        return self.pile[games, (self.head[games] + self.length[games])
+                         & WRAP]
+
+    def give(self, games, seats, coins):
+        """Add coins to the end of hands.
+        """
+        self.hand[games, seats, self.count[games, seats]] = coins
+        self.count[games, seats] += 1
+
+    def take(self, games, seats, index):
+        """Remove coins from hands by index, keeping the order.
+
+        Returns:
+            Coins removed.
+        """
+        hand = self.hand
+        coins = hand[games, seats, index]
+        for slot in range(HAND_SLOTS - 1):
+            hand[games, seats, slot] = np.where(
+                slot >= index, hand[games, seats, slot + 1],
+                hand[games, seats, slot])
+        hand[games, seats, HAND_SLOTS - 1] = -1
+        self.count[games, seats] -= 1
+        return coins
+
+    def put_in_play(self, games, coins):
+        """Add coins to the end of the field.
+        """
+        self.in_play[games, self.played[games]] = coins
+        self.played[games] += 1
+
+    def take_from_play(self, games, index):
+        """Remove coins from the field by index, keeping the order.
+
+        Returns:
+            Coins removed.
+        """
+        field = self.in_play
+        coins = field[games, index]
+        for slot in range(SLOTS - 1):
+            field[games, slot] = np.where(slot >= index,
+                                          field[games, slot + 1],
+                                          field[games, slot])
+        field[games, SLOTS - 1] = -1
+        self.played[games] -= 1
+        return coins
+
+    def has_in_play(self, games, coin):
+        """Whether a coin is in play, per game.
+        """
+        return (self.in_play[games] == coin).any(axis=1)
+
+    # Decisions
+
+    def pick(self, games, valid, bonus=None):
+        """Answer a decision for the current player of each game.
+
+        Candidates are columns, in the order of engine.legal_actions();
+        random picks uniformly, first picks the first valid column and
+        greedy the valid column with the highest bonus (ties at random).
+
+        Args:
+            games: Game indexes.
+            valid: (games, candidates) bool; every row has a True.
+            bonus: Optional (games, candidates) preference for greedy.
+
+        Returns:
+            Column index per game.
+        """
+        codes = self.codes[self.current[games]][:, None]
+        score = self.rng.random(valid.shape)
+        if bonus is not None:
+            score = score + np.where(codes == GREEDY, bonus, 0)
+        columns = valid.shape[1] - np.arange(valid.shape[1])
+        score = np.where(codes == FIRST, columns, score)
+        return np.argmax(np.where(valid, score, -1.0), axis=1)
+
+    def pick_coin(self, games, seats, keep=False):
+        """Pick a coin from the hands of seats; greedy keeps chest and key.
+
+        Returns:
+            Index into each hand.
+        """
+        valid = np.arange(HAND_SLOTS) < self.count[games, seats][:, None]
+        bonus = None
+        if keep:
+            coins = self.hand[games, seats]
+            bonus = np.where((coins != CHEST) & (coins != KEY), 10, 0)
+        return self.pick(games, valid, bonus)
+
+    def pick_in_play(self, games, bonus=None):
+        """Pick a coin in play other than the one just played (last).
+
+        Returns:
+            Index into the field.
+        """
+        valid = np.arange(SLOTS) < self.played[games][:, None] - 1
+        return self.pick(games, valid, bonus)
+
+    # Turns and effects
+
+    def step(self):
+        """Play one turn of every game still running.
+
+        Returns:
+            Number of games that were running.
+        """
+        config = self.config
+        games = np.flatnonzero(self.active)
+        if not len(games):
+            return 0
+        current = np.where(self.again[games], self.current[games],
+                           (self.current[games] + 1) % config.players)
+        self.current[games] = current
+        self.again[games] = False
+        self.turns[games] += 1
+        if config.future:
+            pad = ((self.count[games, current] < config.coins - 1)
+                   & (self.length[games] > 0))
+            self.give(games[pad], current[pad], self.pop_top(games[pad]))
+        draw = (self.larder[games, current] < 0) & (self.length[games] > 0)
+        self.give(games[draw], current[draw], self.pop_top(games[draw]))
+        # Which coin to play: the larder, a coin from the hand or nothing
+        coin = np.full(self.size, -1, np.int64)
+        larder = self.larder[games, current]
+        stored = larder >= 0
+        coin[games[stored]] = larder[stored]
+        self.larder[games[stored], current[stored]] = -1
+        hand = ~stored & (self.count[games, current] > 0)
+        chooser, seats = games[hand], current[hand]
+        coins = self.hand[chooser, seats]
+        key = self.has_in_play(chooser, KEY)[:, None]
+        chest = self.has_in_play(chooser, CHEST)[:, None]
+        bonus = np.where(((coins == CHEST) & key) | ((coins == KEY) & chest),
+                         100, np.where((coins != CHEST) & (coins != KEY),
+                                       10, 0))
+        valid = np.arange(HAND_SLOTS) < self.count[chooser, seats][:, None]
+        index = self.pick(chooser, valid, bonus)
+        coin[chooser] = self.take(chooser, seats, index)
+        # Resolve chains of coins (boots, mirror) a link per round
+        while True:
+            live = np.flatnonzero(coin >= 0)
+            if not len(live):
+                break
+            following = np.full(self.size, -1, np.int64)
+            playing = coin[live]
+            for kind in np.unique(playing):
+                chosen = live[playing == kind]
+                self.plays[chosen, kind] += 1
+                self.put_in_play(chosen, kind)
+                self.effect(int(kind), chosen, following)
+            coin = following
+        won = self.has_in_play(games, CHEST) & self.has_in_play(games, KEY)
+        self.winner[games[won]] = self.current[games[won]]
+        self.active[games[won]] = False
+        self.active[games[self.turns[games] > simulate.MAX_TURNS]] = False
+        return len(games)
+
+    def effect(self, coin, games, following):
+        """Resolve the effect of a coin just put in play.
+
+        Args:
+            coin: Coin id.
+            games: Games where it is being played.
+            following: Coin to resolve next per game (boots, mirror).
+        """
+        current = self.current[games]
+        if coin == CHEST:
+            self.again[games] = True
+        elif coin in (ARROW, KNIFE, RAVEN, SICKLE):
+            self.targeted(coin, games, current)
+        elif coin == BOOTS:
+            games = games[self.length[games] > 0]
+            following[games] = self.pop_top(games)
+        elif coin == COIN_PURSE:
+            draw = self.length[games] > 0
+            self.give(games[draw], current[draw], self.pop_top(games[draw]))
+            back = self.count[games, current] > 0
+            games, current = games[back], current[back]
+            index = self.pick_coin(games, current, keep=True)
+            self.push_top(games, self.take(games, current, index))
+        elif coin == HAM_HOCK:
+            store = (self.length[games] > 0) & (
+                self.larder[games, current] < 0)
+            games, current = games[store], current[store]
+            self.larder[games, current] = self.pop_top(games)
+        elif coin == LANTERN:
+            games = games[self.length[games] > 1]
+            swap = self.pick(games, np.ones((len(games), 2), bool)) == 1
+            games = games[swap]
+            first = self.head[games]
+            second = (first + 1) & WRAP
+            top = self.pile[games, first]
+            self.pile[games, first] = self.pile[games, second]
+            self.pile[games, second] = top
+        elif coin == MIRROR:
+            games = games[self.played[games] > 1]
+            following[games] = self.take_from_play(
+                games, self.pick_in_play(games))
+        elif coin == ROPE:
+            games = games[self.length[games] > 1]
+            move = self.pick(games, np.ones((len(games), 2), bool)) == 1
+            games = games[move]
+            self.push_top(games, self.pop_bottom(games))
+        elif coin == SHIELD:
+            self.shield[games, current] = True
+        elif coin == SHOVEL:
+            games = games[self.played[games] > 1]
+            field = self.in_play[games]
+            bonus = np.where(field == CHEST, 100,
+                             np.where(field == KEY, 50, 0))
+            buried = self.take_from_play(games,
+                                         self.pick_in_play(games, bonus))
+            self.push_bottom(games, buried)
+            self.shield[games[buried == SHIELD]] = False
+        elif coin == WIND:
+            self.wind(games)
+
+    def targeted(self, coin, games, current):
+        """Arrow, knife, raven and sickle.
+        """
+        players = self.config.players
+        others = np.arange(players - 1)[None, :]
+        choices = others + (others >= current[:, None])
+        target = choices[np.arange(len(games)),
+                         self.pick(games, np.ones(choices.shape, bool))]
+        open_ = ~self.shield[games, target]
+        games, current, target = games[open_], current[open_], target[open_]
+        if coin == KNIFE:
+            given = np.full(len(games), -1, np.int64)
+            has = self.count[games, current] > 0
+            given[has] = self.pick_coin(games[has], current[has], keep=True)
+        has = self.count[games, target] > 0
+        index = np.full(len(games), -1, np.int64)
+        index[has] = self.pick_coin(games[has], target[has])
+        if coin == KNIFE:
+            taken = np.full(len(games), -1, np.int64)
+            taken[has] = self.take(games[has], target[has], index[has])
+            gives = given >= 0
+            given[gives] = self.take(games[gives], current[gives],
+                                     given[gives])
+            self.give(games[has], current[has], taken[has])
+            self.give(games[gives], target[gives], given[gives])
+            return
+        games, target, index = games[has], target[has], index[has]
+        if coin == ARROW:
+            self.push_bottom(games, self.take(games, target, index))
+        elif coin == SICKLE:
+            self.put_in_play(games, self.take(games, target, index))
+        else:  # RAVEN only looks
+            return
+        draw = self.length[games] > 0
+        self.give(games[draw], target[draw], self.pop_top(games[draw]))
+
+    def wind(self, games):
+        """Shuffle the coins in play, except the wind, into the pile.
+        """
+        slots = np.arange(SLOTS)[None, :]
+        pile = self.pile[games[:, None], (self.head[games][:, None] + slots)
+                         & WRAP]
+        in_pile = slots < self.length[games][:, None]
+        in_play = slots < self.played[games][:, None] - 1  # wind is last
+        coins = np.concatenate([pile, self.in_play[games]], axis=1)
+        valid = np.concatenate([in_pile, in_play], axis=1)
+        keys = np.where(valid, self.rng.random(valid.shape), 2.0)
+        order = np.argsort(keys, axis=1)
+        self.pile[games] = np.take_along_axis(coins, order, axis=1)[:, :SLOTS]
+        self.head[games] = 0
+        self.length[games] = valid.sum(axis=1)
+        self.in_play[games] = -1
+        self.in_play[games, 0] = WIND
+        self.played[games] = 1
+        self.shield[games] = False
+
+    def play(self):
+        """Play every game to the end (or the turn limit).
+        """
+        while self.step():
+            pass
+
+    def stats(self):
+        """simulate.Stats of the finished batch.
+        """
+        stats = simulate.Stats(self.config.players)
+        stats.games = self.size
+        finished = self.winner >= 0
+        stats.wins = np.bincount(self.winner[finished],
+                                 minlength=self.config.players).tolist()
+        stats.unfinished = int(self.size - finished.sum())
+        turns, counts = np.unique(self.turns, return_counts=True)
+        stats.turns.update(dict(zip(turns.tolist(), counts.tolist())))
+        stats.plays = self.plays.sum(axis=0).tolist()
+        return stats
+
+    def columns(self, seed):
+        """results.columns() of the finished batch.
+
+        Args:
+            seed: Seed of the batch, stored as the seed of every game.
+        """
+        bits = 1 << np.arange(len(engine.COIN_NAMES))
+        rows = {name: np.full(self.size, value)
+                for name, value in zip(('players', 'coins', 'remove',
+                                        'future'), self.config)}
+        rows.update(seed=np.full(self.size, seed, np.uint64),
+                    winner=self.winner, turns=self.turns,
+                    decisions=np.zeros(self.size),  # Not counted
+                    removed=self.removed @ bits,
+                    plays=self.plays)
+        return rows
+
+
+def run_chunk(config, codes, seed, size, keep=False):
+    """Play one batch; executed by pool workers.
+
+    Returns:
+        simulate.Stats of the batch, with its rows if `keep` is on.
+    """
+    batch = Batch(config, codes, np.random.default_rng(seed), size)
+    batch.deal()
+    batch.play()
+    stats = batch.stats()
+    if keep:
+        stats.rows = batch.columns(seed)
+    return stats
+
+
+def run(config, names, games, seed, workers=None, size=BATCH_SIZE,
+        progress=None, store=None):
+    """Simulate games in batches over a process pool.
+
+    Args:
+        config: simulate.Config of the games.
+        names: Policy name per seat; see POLICY_CODES.
+        games: Number of games.
+        seed: Seed of the whole run.
+        workers: Number of processes; 1 runs in this process.
+        size: Games per batch.
+        progress: File to show live throughput on, or None.
+        store: Directory of a results.Store to append every game to.
+
+    Returns:
+        simulate.Stats of all games.
+    """
+    _require_numpy()
+    codes = policy_codes(names)
+    workers = workers or os.cpu_count() or 1
+    sizes = [min(size, games - start) for start in range(0, games, size)]
+    seeds = [simulate.derive(seed, 'batch', index)
+             for index in range(len(sizes))]
+    stats = simulate.Stats(config.players)
+    saved = results.Store(store, create=True) if store else None
+    began = time.perf_counter()
+
+    def done(batch_stats):
+        if saved is not None:
+            saved.append(batch_stats.rows)
+        stats.merge(batch_stats)
+        if progress:
+            rate = stats.games / (time.perf_counter() - began)
+            print(f'\r{stats.games}/{games} games, {rate:,.0f} games/s ',
+                  end='', file=progress, flush=True)
+
+    if workers == 1:
+        for batch_seed, batch_size in zip(seeds, sizes):
+            done(run_chunk(config, codes, batch_seed, batch_size,
+                           bool(store)))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(run_chunk, config, codes, batch_seed,
+                                   batch_size, bool(store))
+                       for batch_seed, batch_size in zip(seeds, sizes)]
+            for future in concurrent.futures.as_completed(futures):
+                done(future.result())
+    if progress:
+        print(file=progress)
+    return stats
+
+
+def compare(config, names, games, seed, out=sys.stdout):
+    """Check the batch rules against the scalar engine on the same deals.
+
+    Both simulators play the deals of the scalar games seeded from `seed`;
+    win rates by seat, mean game length and plays per game of each coin
+    are compared with z scores.
+
+    Args:
+        config: simulate.Config of the games.
+        names: Policy name per seat; see POLICY_CODES.
+        games: Number of deals.
+        seed: Seed of the deal corpus.
+        out: File to print the comparison to.
+
+    Returns:
+        Largest absolute z score.
+    """
+    _require_numpy()
+    seeds = [simulate.derive(seed, 'game', index) for index in range(games)]
+    seats = [policies.make(name) for name in names]
+    scalar = simulate.Stats(config.players)
+    turns = []
+    for game_seed in seeds:
+        result = simulate.play_game(config, seats, game_seed)
+        scalar.add(result)
+        turns.append(result.turns)
+    batch = Batch(config, policy_codes(names),
+                  np.random.default_rng(simulate.derive(seed, 'batch')),
+                  games)
+    batch.load([engine.new_table(*config, seed=game_seed)
+                for game_seed in seeds])
+    batch.play()
+    vector = batch.stats()
+    rows = []
+    for seat in range(config.players):
+        a, b = scalar.wins[seat] / games, vector.wins[seat] / games
+        pooled = (a + b) / 2
+        error = math.sqrt(max(pooled * (1 - pooled), 1e-12) * 2 / games)
+        rows.append((f'seat {seat+1} win rate', a, b, (a - b) / error))
+    a, b = np.mean(turns), batch.turns.mean()
+    error = math.sqrt((np.var(turns) + batch.turns.var()) / games) or 1
+    rows.append(('turns per game', a, b, (a - b) / error))
+    for coin, name in enumerate(engine.COIN_NAMES):
+        a, b = scalar.plays[coin] / games, vector.plays[coin] / games
+        error = math.sqrt(max(a + b, 1e-12) / games)  # Poisson-ish counts
+        rows.append((f'{name} plays', a, b, (a - b) / error))
+    print(f'{"":<24} {"scalar":>8} {"batch":>8} {"z":>6}', file=out)
+    for label, a, b, z in rows:
+        print(f'{label:<24} {a:>8.3f} {b:>8.3f} {z:>6.2f}', file=out)
+    return max(abs(row[3]) for row in rows)
+
+
+def main():
+    """Compare the batch simulator with the scalar engine.
+    """
+    parser = argparse.ArgumentParser(
+        description='Check the NumPy batch simulator against the engine',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p', '--players', default=engine.PLAYER_MIN,
+                        type=int)
+    parser.add_argument('-c', '--coins', default=engine.HAND_MIN, type=int)
+    parser.add_argument('-r', '--remove', default=0, type=int)
+    parser.add_argument('-f', '--future', action='store_true')
+    parser.add_argument('--policy', default='random')
+    parser.add_argument('--games', default=20000, type=int)
+    parser.add_argument('--seed', default=random.getrandbits(32), type=int)
+    args = parser.parse_args()
+    config = simulate.Config.from_args(args)
+    names = [policy.name for policy in
+             policies.seat_policies(args.policy, config.players)]
+    print(f'{args.games} deals ({config}), seed {args.seed}')
+    worst = compare(config, names, args.games, args.seed)
+    print(f'Largest |z|: {worst:.2f}'
+          + (' (suspicious)' if worst > 4 else ''))
+
+
+if __name__ == '__main__':
+    main()
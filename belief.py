@@ -0,0 +1,540 @@
+"""What one seat can know about the coins it cannot see.
+
+A Belief keeps, for every place a coin can be in (each coin of each hand,
+each larder, each position of the pile, each coin removed from the game), a
+bitset of the coins that could be there: a cell.  Coin c is bit 1 << c.
+Events update the cells in place as they come, with only what the seat
+sees of them (stream.sees()): a coin seen is a cell of one bit, a coin that
+moved unseen carries its cell along, and a coin taken unseen from a hand of
+several cells leaves every cell there as the union of them all.  Every
+coin is in exactly one cell, so after each step
+
+- a coin known to be somewhere is taken out of every other cell,
+- a coin only one cell could hold is in that cell, and
+- n cells that can only hold the same n coins hold them between them,
+  e.g. the pile after the wind, which holds the coins that were in play.
+
+The cells are never more certain than the seat can be; they may be less,
+as a cell only holds which coins, not how likely they are.  Taking every
+world the cells allow as likely, plan() counts them once per step, by
+groups of cells that could hold the same coins; then chance() is exact and
+a few lookups, and sample() deals a world without ever backing out.
+
+    belief = Belief(seat, state.players)
+    belief.observe(events)  # After every step
+    belief.chance(KEY, opponent)  # Probability opponent has the key
+    world = belief.sample(state, rng)  # engine.GameState to search
+"""
+from typing import NamedTuple
+
+import engine
+import stream
+from engine import NONE, BOOTS, WIND
+
+
+COINS = len(engine.COIN_NAMES)
+ALL = (1 << COINS) - 1  # A cell that could hold any coin
+
+
+class Plan(NamedTuple):
+    """The worlds the cells of a Belief allow, counted by Belief.plan().
+    """
+    dealt: list  # Coin id of the cells of one coin, else NONE, by cell
+    masks: tuple  # Coins each group of cells could hold
+    places: tuple  # Cells of each group, as indexes into cells()
+    coins: list  # Coins left to deal, lowest first
+    homes: list  # Groups that could hold each coin
+    start: tuple  # Cells in each group: the room before dealing
+    before: list  # Per coin, dict of room: ways of dealing the ones before
+    rest: list  # Per coin, dict of room: ways of dealing it and the rest
+    held: tuple  # Coins of each group, if no coin could be in two groups
+
+
+def coins_of(cell):
+    """Coins a cell can hold.
+
+    Args:
+        cell: Bitset of coin ids.
+
+    Returns:
+        List of coin ids, lowest first.
+    """
+    coins = []
+    while cell:
+        low = cell & -cell
+        coins.append(low.bit_length() - 1)
+        cell ^= low
+    return coins
+
+
+def _take(cells, coin=NONE):
+    """Take the cell of a coin out of a hand.
+
+    Args:
+        cells: List of cells of the hand, changed in place.
+        coin: Coin id taken, or NONE if the seat did not see which.
+
+    Returns:
+        Cell of the coin taken.
+    """
+    if not cells:
+        return 1 << coin if coin != NONE else ALL
+    if coin == NONE:
+        union = 0
+        for cell in cells:
+            union |= cell
+        if cells.count(union) != len(cells):  # Which one left is unknown
+            cells[:] = [union] * len(cells)
+        cells.pop()
+        return union
+    bit = 1 << coin
+    if bit in cells:
+        cells.remove(bit)
+        return bit
+    could = [index for index, cell in enumerate(cells) if cell & bit]
+    if not could:  # Not to be: forget what the hand held
+        cells[:] = [ALL] * (len(cells) - 1)
+        return bit
+    union = 0
+    for index in could:
+        union |= cells[index]
+    if any(cells[index] != union for index in could):
+        for index in could:
+            cells[index] = union
+    del cells[could[-1]]
+    return bit
+
+
+class Belief:
+    """Where the coins could be, as one seat knows it.
+
+    Cells of the hands, larders (0 for none), the pile (top first) and the
+    coins removed are lists of ints; in_play is the bitset of the coins in
+    play, which everyone sees.
+    """
+    def __init__(self, seat, players):
+        """Know nothing yet, before the coins are removed and dealt.
+
+        Args:
+            seat: Seat whose belief this is.
+            players: Number of seats.
+        """
+        self.seat = seat
+        self.hands = [[] for _ in range(players)]
+        self.larders = [0] * players
+        self.pile = [ALL] * COINS
+        self.removed = []
+        self.in_play = 0
+        self.planned = self.counted = None  # Kept until the next event
+        self.fitted = None  # State sample() last found the cells fit
+
+    def reset(self, state):
+        """Know only what the seat sees of a state, e.g. on joining late.
+
+        Args:
+            state: engine.GameState or engine.Table.
+        """
+        seat = self.seat
+        self.in_play = 0
+        for coin in state.in_play:
+            self.in_play |= 1 << coin
+        self.hands = [[1 << coin for coin in hand] if other == seat
+                      else [ALL] * len(hand)
+                      for other, hand in enumerate(state.hands)]
+        self.larders = [0 if larder == NONE
+                        else 1 << larder if other == seat else ALL
+                        for other, larder in enumerate(state.larders)]
+        self.pile = [ALL] * len(state.pile)
+        self.removed = [ALL] * len(state.removed)
+        self.settle()
+
+    def observe(self, events):
+        """Update the cells with the events of one step.
+
+        Args:
+            events: Sequence of engine.Event.
+        """
+        seat, hands, pile = self.seat, self.hands, self.pile
+        previous = None
+        for event in events:
+            kind, player, coin = event.kind, event.player, event.coin
+            seen = stream.sees(event, seat)
+            if kind == engine.REMOVED:
+                self.removed.append(pile.pop())
+            elif kind in (engine.DEALT, engine.DREW, engine.PADDED):
+                cell = pile.pop(0)
+                hands[player].append(1 << coin if seen else cell)
+            elif kind == engine.STORED:
+                cell = pile.pop(0)
+                self.larders[player] = 1 << coin if seen else cell
+            elif kind == engine.LARDER_USED:
+                self.larders[player] = 0
+            elif kind == engine.PLAYED:
+                bit = 1 << coin
+                if self.in_play & bit:  # Copied by the mirror
+                    pass
+                elif previous == engine.LARDER_USED:
+                    pass
+                elif previous == BOOTS:  # The top coin of the pile
+                    pile.pop(0)
+                else:
+                    _take(hands[player], coin)
+                self.in_play |= bit
+            elif kind == engine.SAW and seen:
+                if event.target == NONE:
+                    pile[event.other] = 1 << coin
+                else:
+                    self.saw(hands[event.target], coin)
+            elif kind == engine.TRADED:
+                self.traded(player, event.target, seen, coin, event.other)
+            elif kind == engine.BURIED and event.target == NONE:  # Shovel
+                self.in_play &= ~(1 << coin)
+                pile.append(1 << coin)
+            elif kind == engine.BURIED:  # Arrow: only its target sees which
+                pile.append(_take(hands[event.target],
+                                  coin if seen else NONE))
+            elif kind == engine.KILLED:
+                _take(hands[event.target], coin)
+                self.in_play |= 1 << coin
+            elif kind == engine.PUT_BACK:
+                pile.insert(0, _take(hands[player], coin if seen else NONE))
+            elif kind == engine.REORDERED:
+                if not seen:
+                    pile[0] = pile[1] = pile[0] | pile[1]
+                elif pile[1] == 1 << coin:
+                    pile[0], pile[1] = pile[1], pile[0]
+            elif kind == engine.ROPED:
+                pile.insert(0, pile.pop())
+            elif kind == engine.SHUFFLED:
+                mixed = self.in_play & ~(1 << WIND)
+                union = mixed
+                for cell in pile:
+                    union |= cell
+                pile[:] = [union] * (len(pile) + mixed.bit_count())
+                self.in_play &= 1 << WIND
+            if kind == engine.PLAYED:
+                previous = coin
+            elif kind == engine.LARDER_USED:
+                previous = kind
+            else:
+                previous = None
+        self.settle()
+
+    def saw(self, cells, coin):
+        """One coin of a hand was seen, not where in the hand.
+        """
+        bit = 1 << coin
+        if bit in cells:
+            return
+        could = [index for index, cell in enumerate(cells) if cell & bit]
+        if not could:  # Not to be: forget what the hand held
+            cells[:] = [ALL] * len(cells)
+            could = [0]
+        union = 0
+        for index in could:
+            union |= cells[index]
+        for index in could:
+            cells[index] = union
+        cells[could[0]] = bit
+
+    def traded(self, player, opponent, seen, given, taken):
+        """Follow the coins of a knife trade.
+
+        Args:
+            player: Seat playing the knife.
+            opponent: Seat traded with.
+            seen: Whether the seat saw the coins traded.
+            given: Coin the player gave; NONE if none or not seen.
+            taken: Coin the player took; NONE if none or not seen.
+        """
+        hands = self.hands
+        if seen:
+            out = _take(hands[player], given) if given != NONE else 0
+            back = _take(hands[opponent], taken) if taken != NONE else 0
+        else:  # A coin changes hands iff the hand it leaves has one
+            out = _take(hands[player]) if hands[player] else 0
+            back = _take(hands[opponent]) if hands[opponent] else 0
+        if back:
+            hands[player].append(back)
+        if out:
+            hands[opponent].append(out)
+
+    def cells(self):
+        """Every cell but the coins in play, in a fixed order.
+
+        Returns:
+            List of cells: the hands by seat, the larders held, the pile
+            top first and the coins removed.
+        """
+        cells = []
+        for hand in self.hands:
+            cells += hand
+        cells += [larder for larder in self.larders if larder]
+        cells += self.pile
+        cells += self.removed
+        return cells
+
+    def settle(self):
+        """Narrow the cells down by the rules above, until none changes.
+        """
+        self.planned = self.counted = self.fitted = None
+        places = list(self.hands)
+        places += [self.larders, self.pile, self.removed]
+        while True:
+            known = self.in_play
+            once = twice = 0
+            groups = {}
+            for cells in places:
+                for cell in cells:
+                    if not cell & (cell - 1):
+                        known |= cell
+                    else:
+                        twice |= once & cell
+                        once |= cell
+                        groups[cell] = groups.get(cell, 0) + 1
+            only = once & ~twice & ~known  # Coins only one cell can hold
+            closed = 0  # Coins held by the cells that can only hold them
+            for mask in groups:
+                count = sum(number for cell, number in groups.items()
+                            if not cell & ~mask)
+                if count == mask.bit_count():
+                    closed |= mask
+            changed = False
+            for cells in places:
+                for index, cell in enumerate(cells):
+                    if not cell & (cell - 1):
+                        continue
+                    new = cell & only
+                    if new:
+                        new &= -new
+                    elif cell & ~closed:
+                        new = cell & ~known & ~closed
+                    else:
+                        new = cell & ~known
+                    if new != cell and new:
+                        cells[index] = new
+                        changed = True
+            if not changed:
+                return
+
+    def plan(self):
+        """Count the worlds the cells allow, for deal() and chance().
+
+        Cells that could hold the same coins are a group, dealt alike; the
+        worlds are counted by how many coins each group still takes as the
+        coins are dealt one after the other.
+
+        Returns:
+            Plan, kept until the next event.
+
+        Raises:
+            ValueError: no world fits the cells, e.g. the events did not
+                start at the beginning of the game.
+        """
+        if self.planned is not None:
+            return self.planned
+        cells = self.cells()
+        dealt = [NONE] * len(cells)
+        groups = {}
+        for index, cell in enumerate(cells):
+            if cell & (cell - 1):
+                groups.setdefault(cell, []).append(index)
+            else:
+                dealt[index] = cell.bit_length() - 1
+        masks = tuple(groups)
+        unseen = 0
+        for mask in masks:
+            unseen |= mask
+        coins = coins_of(unseen)
+        homes = [tuple(group for group, mask in enumerate(masks)
+                       if mask >> coin & 1) for coin in coins]
+        start = tuple(len(groups[mask]) for mask in masks)
+        before = [{start: 1}]  # Ways of dealing the coins before, by room
+        for home in homes:
+            after = {}
+            for room, ways in before[-1].items():
+                for group in home:
+                    if room[group]:
+                        left = room[:group] + (room[group] - 1,) + (
+                            room[group + 1:])
+                        after[left] = after.get(left, 0) + ways
+            before.append(after)
+        rest = [{room: 1 for room in before[-1] if not any(room)}]
+        for index in range(len(homes) - 1, -1, -1):
+            home, after, ways = homes[index], rest[0], {}
+            for room in before[index]:
+                total = 0
+                for group in home:
+                    if room[group]:
+                        total += after.get(room[:group] + (
+                            room[group] - 1,) + room[group + 1:], 0)
+                if total:
+                    ways[room] = total
+            rest.insert(0, ways)
+        if not rest[0]:
+            raise ValueError('No world fits what the seat saw')
+        held = None
+        if all(len(home) == 1 for home in homes):
+            held = tuple([coin for coin, home in zip(coins, homes)
+                          if home[0] == group]
+                         for group in range(len(masks)))
+        self.planned = Plan(dealt, masks, tuple(groups.values()), coins,
+                            homes, start, before, rest, held)
+        return self.planned
+
+    def deal(self, rng):
+        """Deal a coin to every cell, each world the cells allow as likely.
+
+        Args:
+            rng: random.Random.
+
+        Returns:
+            List of coin ids, one per cell of cells().
+
+        Raises:
+            ValueError: no world fits the cells.
+        """
+        plan = self.plan()
+        dealt = list(plan.dealt)
+        if plan.held is not None:  # Only which cell of the group is left
+            for coins, places in zip(plan.held, plan.places):
+                coins = list(coins)
+                rng.shuffle(coins)
+                for place, coin in zip(places, coins):
+                    dealt[place] = coin
+            return dealt
+        room = plan.start
+        held = [[] for _ in plan.masks]
+        rest = plan.rest
+        for index, coin in enumerate(plan.coins):
+            home = plan.homes[index]
+            group = home[0]
+            if len(home) > 1:
+                after = rest[index + 1]
+                pick = rng.random() * rest[index][room]
+                for group in home:
+                    if room[group]:
+                        pick -= after.get(room[:group] + (
+                            room[group] - 1,) + room[group + 1:], 0)
+                        if pick < 0:
+                            break
+            held[group].append(coin)
+            room = room[:group] + (room[group] - 1,) + room[group + 1:]
+        for coins, places in zip(held, plan.places):
+            rng.shuffle(coins)
+            for place, coin in zip(places, coins):
+                dealt[place] = coin
+        return dealt
+
+    def odds(self):
+        """Chance of every coin in one cell of each group.
+
+        Returns:
+            Dict of cell: list of floats per coin id.
+
+        Raises:
+            ValueError: no world fits the cells.
+        """
+        if self.counted is not None:
+            return self.counted
+        plan = self.plan()
+        rest = plan.rest
+        total = rest[0][plan.start]
+        odds = {mask: [0.0] * COINS for mask in plan.masks}
+        for index, coin in enumerate(plan.coins):
+            after = rest[index + 1]
+            for group in plan.homes[index]:
+                ways = 0
+                for room, before in plan.before[index].items():
+                    if room[group]:
+                        ways += before * after.get(room[:group] + (
+                            room[group] - 1,) + room[group + 1:], 0)
+                odds[plan.masks[group]][coin] = ways / (
+                    total * plan.start[group])
+        self.counted = odds
+        return odds
+
+    def chance(self, coin, seat):
+        """Probability a seat holds a coin, in its hand or larder.
+
+        Args:
+            coin: Coin id.
+            seat: Seat.
+
+        Returns:
+            Float from 0 to 1.
+
+        Raises:
+            ValueError: no world fits the cells.
+        """
+        odds = self.odds()
+        bit = 1 << coin
+        total = 0.0
+        for cell in self.hands[seat] + [self.larders[seat]]:
+            if cell == bit:
+                total += 1.0
+            elif cell & (cell - 1):
+                total += odds[cell][coin]
+        return min(total, 1.0)
+
+    def sample(self, state, rng):
+        """Deal the unseen coins at random: one world the seat could be in.
+
+        Args:
+            state: engine.GameState or engine.Table of the real game.
+            rng: random.Random to deal with.
+
+        Returns:
+            engine.GameState that agrees with everything the seat knows,
+            with a fresh wind seed.
+        """
+        seat = self.seat
+        if state is not self.fitted:
+            if not self.fits(state):  # Joined late: forget it
+                self.reset(state)
+            if isinstance(state, engine.GameState):  # Will not change
+                self.fitted = state
+        try:
+            dealt = self.deal(rng)
+        except ValueError:
+            self.reset(state)
+            dealt = self.deal(rng)
+        hands, larders = [], []
+        start = 0
+        for hand in self.hands:
+            hands.append(tuple(dealt[start:start + len(hand)]))
+            start += len(hand)
+        hands[seat] = tuple(state.hands[seat])
+        for larder in self.larders:
+            larders.append(dealt[start] if larder else NONE)
+            start += 1 if larder else 0
+        pile = tuple(dealt[start:start + len(self.pile)])
+        removed = tuple(dealt[start + len(self.pile):])
+        return engine.GameState(
+            state.players, state.hand_size, state.future, removed,
+            tuple(hands), tuple(larders), tuple(state.shields), pile,
+            tuple(state.in_play), state.current, state.pending,
+            state.go_again, state.turn, rng.getrandbits(64), state.winner)
+
+    def fits(self, state):
+        """Checks the cells have the shape of a state and its open coins.
+
+        Args:
+            state: engine.GameState or engine.Table.
+
+        Returns:
+            Boolean.
+        """
+        seat = self.seat
+        in_play = 0
+        for coin in state.in_play:
+            in_play |= 1 << coin
+        own = sorted(1 << coin for coin in state.hands[seat])
+        return (in_play == self.in_play
+                and len(state.pile) == len(self.pile)
+                and len(state.removed) == len(self.removed)
+                and sorted(self.hands[seat]) == own
+                and all(len(hand) == len(cells) for hand, cells
+                        in zip(state.hands, self.hands))
+                and all((larder != NONE) == bool(cell) for larder, cell
+                        in zip(state.larders, self.larders)))
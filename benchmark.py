@@ -0,0 +1,393 @@
+"""Benchmarks of the engine, with JSON baselines to compare against.
+
+Microbenchmarks time one coin effect (a PLAY step with that coin, up to the
+next decision), one pile operation of engine.Table, one way of copying a
+table (fork, restore, freeze and thaw, against copy.deepcopy), one
+validate_state() call, or waking up or hibernating one game of the server,
+on states prepared beforehand from seeded random games.
+Macrobenchmarks play whole scripted games (the deterministic first policy
+on fixed seeds) at every number of players and coins.  A result is the
+best time per operation over several repeats.
+
+    python benchmark.py run --out before.json
+    python benchmark.py run --out after.json
+    python benchmark.py compare before.json after.json
+
+compare exits with status 1 when a benchmark got slower by more than the
+noise threshold, so it can gate a release on throughput.
+"""
+import argparse
+import contextlib
+import copy
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, NamedTuple
+
+import engine
+import grackle
+import policies
+import server
+import simulate
+import slab
+from engine import IN_HAND
+
+
+FORMAT = 1  # Version of the results file
+REPEAT = 9  # Default timed repeats of every benchmark
+THRESHOLD = 0.10  # Default slowdown compare() flags as a regression
+SAMPLES = 64  # Prepared states per coin
+SEED = 'benchmark'  # Seed of the prepared states and scripted games
+
+
+class Benchmark(NamedTuple):
+    """One thing to time.
+    """
+    name: str
+    unit: str  # What one operation is, e.g. 'step' or 'game'
+    number: int  # Operations per repeat
+    prepare: Callable  # prepare(number) -> list of argument tuples
+    run: Callable  # run(*arguments) is timed, once per tuple
+
+
+def sample_states(players=engine.PLAYER_MIN, coins=engine.HAND_MIN,
+                  samples=SAMPLES):
+    """States waiting on a PLAY decision, by playable coin.
+
+    Args:
+        players: Number of players of the games.
+        coins: Number of coins in each hand.
+        samples: States wanted per coin.
+
+    Returns:
+        Dict of coin id: list of engine.GameState.
+    """
+    found = {coin: [] for coin in range(len(engine.COIN_NAMES))}
+    rng = random.Random(SEED)
+    game = 0
+    while min(map(len, found.values())) < samples and game < 100 * samples:
+        table = engine.new_table(players, coins,
+                                 seed=simulate.derive(SEED, 'game', game))
+        game += 1
+        while table.pending[0] != engine.DONE:
+            actions = table.legal_actions()
+            if table.pending[0] == engine.PLAY:
+                state = table.freeze()
+                for coin in actions:
+                    if coin != engine.NONE and len(found[coin]) < samples:
+                        found[coin].append(state)
+            table.step(rng.choice(actions))
+    return found
+
+
+def _cycle(states, number):
+    """number states, going round the list.
+    """
+    return [states[index % len(states)] for index in range(number)]
+
+
+def _hand_coin(state):
+    """Thawed table with a coin taken out of the hand of the current player.
+    """
+    table = engine.Table(state)
+    return table, table.hands[state.current].pop(), IN_HAND + state.current
+
+
+def _server(number, asleep):
+    """Server with games of 2 to 6 players, hibernated or not.
+
+    Returns:
+        List of (server, game number), `number` long.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        host = server.Server(slab=slab.Slab(os.path.join(folder, 'slab')),
+                             hot=number)
+    games = [host.create({'players': 2 + index % 5, 'seed': index})
+             for index in range(number)]
+    if asleep:
+        for game in games:
+            host.hibernate(game)
+        return [(host, game.number) for game in games]
+    return [(host, game) for game in games]
+
+
+def benchmarks():
+    """Every benchmark, micro first.
+
+    Returns:
+        List of Benchmark.
+    """
+    found = sample_states()
+    states = [state for coin_states in found.values()
+              for state in coin_states]
+    with_pile = [state for state in states if state.pile]
+    with_play = [state for state in states if state.in_play]
+    result = []
+    for coin, coin_states in found.items():
+        name = engine.COIN_NAMES[coin].strip('[]')
+
+        def prepare(number, coin=coin, coin_states=coin_states):
+            return [(engine.Table(state), coin)
+                    for state in _cycle(coin_states, number)]
+
+        result.append(Benchmark(f'effect.{name}', 'step', 2000, prepare,
+                                engine.Table.step))
+    result += [
+        Benchmark('pile.draw', 'coin', 5000,
+                  lambda number: [
+                      (engine.Table(state), state.current)
+                      for state in _cycle(with_pile, number)],
+                  engine.Table.draw),
+        Benchmark('pile.put_back', 'coin', 5000,
+                  lambda number: [_hand_coin(state)
+                                  for state in _cycle(states, number)],
+                  engine.Table.push_top),
+        Benchmark('pile.bury', 'coin', 5000,
+                  lambda number: [_hand_coin(state)
+                                  for state in _cycle(states, number)],
+                  engine.Table.push_bottom),
+        Benchmark('pile.shuffle', 'shuffle', 2000,
+                  lambda number: [(engine.Table(state),)
+                                  for state in _cycle(with_play, number)],
+                  engine.Table.shuffle),
+        Benchmark('state.thaw', 'state', 3000,
+                  lambda number: [(state,)
+                                  for state in _cycle(states, number)],
+                  engine.Table),
+        Benchmark('state.freeze', 'state', 3000,
+                  lambda number: [(engine.Table(state),)
+                                  for state in _cycle(states, number)],
+                  engine.Table.freeze),
+        Benchmark('state.fork', 'state', 3000,
+                  lambda number: [(engine.Table(state),)
+                                  for state in _cycle(states, number)],
+                  engine.Table.fork),
+        Benchmark('state.restore', 'state', 3000,
+                  lambda number: [(engine.Table(state), state)
+                                  for state in _cycle(states, number)],
+                  engine.Table.restore),
+        Benchmark('state.deepcopy', 'state', 300,
+                  lambda number: [(engine.Table(state),)
+                                  for state in _cycle(states, number)],
+                  copy.deepcopy),
+        Benchmark('server.wake', 'game', 2000,
+                  lambda number: _server(number, True), server.Server.game),
+        Benchmark('server.hibernate', 'game', 2000,
+                  lambda number: _server(number, False),
+                  server.Server.hibernate),
+        Benchmark('state.validate', 'state', 2000,
+                  lambda number: [(state,)
+                                  for state in _cycle(states, number)],
+                  grackle.validate_state),
+        ]
+    for players in range(engine.PLAYER_MIN, engine.PLAYER_MAX + 1):
+        for coins in range(engine.HAND_MIN, engine.HAND_MAX + 1):
+            config = simulate.Config(players, coins)
+            seats = policies.seat_policies('first', players)
+
+            def prepare(number, config=config, seats=seats):
+                return [(config, seats, simulate.derive(SEED, index))
+                        for index in range(number)]
+
+            result.append(Benchmark(f'game.p{players}c{coins}', 'game', 100,
+                                    prepare, simulate.play_game))
+    return result
+
+
+def measure(benchmark, number):
+    """Time one repeat of a benchmark.
+
+    The garbage collector is off while timing, as in timeit.
+
+    Args:
+        benchmark: Benchmark.
+        number: Number of operations.
+
+    Returns:
+        Seconds per operation.
+    """
+    cases = benchmark.prepare(number)
+    run = benchmark.run
+    collect = gc.isenabled()
+    gc.disable()
+    try:
+        began = time.perf_counter()
+        for case in cases:
+            run(*case)
+        elapsed = time.perf_counter() - began
+    finally:
+        if collect:
+            gc.enable()
+    return elapsed / number
+
+
+def run_all(selected=None, repeat=REPEAT, scale=1.0, out=sys.stdout):
+    """Run the benchmarks and report them.
+
+    Repeats go round all benchmarks in turn rather than repeating each one
+    back to back, so a slow spell of the machine hits one repeat of many
+    benchmarks instead of every repeat of one; the best repeat counts.
+    Output of the timed code (validate_state() prints) is discarded.
+
+    Args:
+        selected: Run only benchmarks whose name contains one of these.
+        repeat: Number of timed repeats.
+        scale: Factor on the number of operations per repeat.
+        out: Text file for the report.
+
+    Returns:
+        Results dict, as saved by the run command.
+    """
+    chosen = [benchmark for benchmark in benchmarks()
+              if not selected
+              or any(part in benchmark.name for part in selected)]
+    times = {benchmark.name: [] for benchmark in chosen}
+    with open(os.devnull, 'w') as sink:
+        for round_ in range(repeat):
+            print(f'Repeat {round_+1}/{repeat}...', end='\r', file=sys.stderr,
+                  flush=True)
+            for benchmark in chosen:
+                with contextlib.redirect_stdout(sink):
+                    times[benchmark.name].append(measure(
+                        benchmark, max(1, int(benchmark.number * scale))))
+    results = {}
+    print(f'{"Benchmark":<18} {"Best ns":>11} {"Median ns":>11}  Per',
+          file=out)
+    for benchmark in chosen:
+        best = min(times[benchmark.name]) * 1e9
+        median = statistics.median(times[benchmark.name]) * 1e9
+        results[benchmark.name] = {
+            'unit': benchmark.unit,
+            'number': max(1, int(benchmark.number * scale)),
+            'best': round(best, 1), 'median': round(median, 1)}
+        print(f'{benchmark.name:<18} {best:>11,.0f} {median:>11,.0f}'
+              f'  {benchmark.unit}', file=out)
+    return {
+        'format': FORMAT,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+        }
+
+
+def compare(base, new, threshold=THRESHOLD, out=sys.stdout):
+    """Compare the best times of two runs.
+
+    A benchmark got slower when its best time grew by more than the
+    threshold and is also above the median of the baseline, i.e. most
+    baseline repeats beat even the best new one; faster likewise.
+
+    Args:
+        base: Results dict of the baseline.
+        new: Results dict of the run to check.
+        threshold: Relative slowdown beyond the noise, e.g. 0.1 for 10%.
+        out: Text file for the report.
+
+    Returns:
+        List of names of the benchmarks that got slower than allowed.
+    """
+    slower = []
+    print(f'{"Benchmark":<18} {"Base ns":>11} {"New ns":>11} {"Change":>8}',
+          file=out)
+    for name, result in new['results'].items():
+        if name not in base['results']:
+            print(f'{name:<18} {"":>11} {result["best"]:>11,.0f}       new',
+                  file=out)
+            continue
+        old = base['results'][name]
+        before = old['best']
+        change = result['best'] / before - 1
+        flag = ''
+        if change > threshold and result['best'] > old['median']:
+            flag = '  SLOWER'
+            slower.append(name)
+        elif change < -threshold and result['median'] < before:
+            flag = '  faster'
+        print(f'{name:<18} {before:>11,.0f} {result["best"]:>11,.0f}'
+              f' {change:>+8.1%}{flag}', file=out)
+    for name in base['results']:
+        if name not in new['results']:
+            print(f'{name:<18} {"":>11} {"":>11}   missing', file=out)
+    if base.get('machine') != new.get('machine') or (
+            base.get('python') != new.get('python')):
+        print('Note: the runs were made on different machines or Pythons.',
+              file=out)
+    return slower
+
+
+def load(path):
+    """Read a results file.
+
+    Raises:
+        ValueError: not a results file of this version.
+    """
+    with open(path) as data:
+        results = json.load(data)
+    if not isinstance(results, dict) or results.get('format') != FORMAT:
+        raise ValueError(f'{path} is not a benchmark results file'
+                         f' of format {FORMAT}')
+    return results
+
+
+def main(argv=None):
+    """Run the benchmarks or compare two runs.
+
+    Args:
+        argv: Command line arguments; sys.argv if None.
+
+    Returns:
+        Exit status: 1 if compare found regressions.
+    """
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of the Grackle engine')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='Run the benchmarks.')
+    run.add_argument('names', nargs='*',
+                     help='Only run benchmarks whose name contains one of'
+                          ' these, e.g. effect pile.draw game.p2.')
+    run.add_argument('--out', default=None, metavar='FILE',
+                     help='Save the results as JSON to FILE.')
+    run.add_argument('--repeat', default=REPEAT, type=int,
+                     help=f'Timed repeats of every benchmark'
+                          f' (default: {REPEAT}).')
+    run.add_argument('--scale', default=1.0, type=float,
+                     help='Factor on the operations per repeat, e.g. 0.1'
+                          ' for a quick run (default: 1).')
+    check = commands.add_parser(
+        'compare', help='Compare a run against a baseline.')
+    check.add_argument('base', help='Results file of the baseline.')
+    check.add_argument('new', help='Results file to check.')
+    check.add_argument('--threshold', default=THRESHOLD, type=float,
+                       help=f'Slowdown flagged as a regression'
+                            f' (default: {THRESHOLD}).')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        results = run_all(args.names, args.repeat, args.scale)
+        if args.out:
+            with open(args.out, 'w') as out:
+                json.dump(results, out, indent=1)
+                out.write('\n')
+        return 0
+    try:
+        base, new = load(args.base), load(args.new)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    slower = compare(base, new, args.threshold)
+    if slower:
+        print(f'{len(slower)} regressions beyond {args.threshold:.0%}:'
+              f' {", ".join(slower)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
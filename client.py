@@ -0,0 +1,363 @@
+"""Load generator for the game server.
+
+Opens a few connections, creates many tables over them, joins every seat
+and answers each decision at random the moment it arrives, so every table
+always has one action in flight.  The latency of an action is the time
+from sending it to receiving the update of its step.
+
+With --spectators, as many more connections watch every table on a
+spectator channel; the run then also reports the updates they received
+and what fanning them out cost the server per step (see server.py).
+
+    python client.py --tables 1000,10000,50000
+    python client.py --tables 10,100 --spectators 1000
+
+Without --port, a server is started in another process for the run.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+import server
+
+
+CONNECTIONS = 8  # Default number of client connections
+CREATE_BATCH = 500  # Tables created before waiting for their answers
+
+
+def percentile(values, fraction):
+    """Value at a fraction of the sorted values, e.g. 0.99.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Load:
+    """Tables played over one connection.
+    """
+    def __init__(self, reader, writer, rng):
+        """Create the load of a connection.
+
+        Args:
+            reader: asyncio.StreamReader of the connection.
+            writer: asyncio.StreamWriter of the connection.
+            rng: random.Random choosing the actions.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.rng = rng
+        self.tokens = {}  # (table, seat): token
+        self.sent = {}  # table: (time the pending action was sent, seat)
+        self.latencies = []
+        self.playing = 0
+        self.outbox = []
+
+    def send(self, message):
+        """Queue a message to the server, written on the next flush().
+        """
+        self.outbox.append(json.dumps(message))
+
+    def flush(self):
+        """Write the queued messages.
+        """
+        if self.outbox:
+            self.outbox.append('')
+            self.writer.write('\n'.join(self.outbox).encode())
+            self.outbox = []
+
+    async def receive(self):
+        """Next message from the server.
+
+        Raises:
+            ConnectionError: the server closed the connection.
+        """
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError('Server closed the connection')
+        return json.loads(line)
+
+    async def create(self, tables, players):
+        """Create tables and join all their seats.
+
+        Args:
+            tables: Number of tables.
+            players: Seats per table.
+        """
+        while tables:
+            batch = min(tables, CREATE_BATCH)
+            for index in range(batch):
+                self.send({'op': 'create', 'players': players,
+                           'seed': self.rng.getrandbits(32), 'id': index})
+            self.flush()
+            await self.writer.drain()
+            created = 0
+            while created < batch:
+                message = await self.receive()
+                if message['op'] == 'error':
+                    raise RuntimeError(message['message'])
+                if message['op'] != 'created':
+                    self.answer(message)
+                    continue
+                created += 1
+                self.playing += 1
+                for seat, token in enumerate(message['tokens']):
+                    self.tokens[message['table'], seat] = token
+                    self.send({'op': 'join', 'token': token})
+            self.flush()
+            tables -= batch
+
+    def answer(self, message):
+        """Handle an update, acting when it asks for a decision.
+        """
+        if message['op'] != 'update':
+            if message['op'] == 'error':
+                raise RuntimeError(message['message'])
+            return
+        table, seat = message['table'], message['seat']
+        sent = self.sent.get(table)
+        if sent is not None and sent[1] == seat:
+            self.latencies.append(time.perf_counter() - sent[0])
+            del self.sent[table]
+        if 'winner' in message:
+            if seat == 0:
+                self.playing -= 1
+        elif 'actions' in message:
+            actions = message['actions']
+            self.send({'op': 'act', 'token': self.tokens[table, seat],
+                       'action': self.rng.choice(actions)})
+            self.sent[table] = (time.perf_counter(), seat)
+
+    async def play(self):
+        """Answer updates until every table of the connection is over.
+        """
+        self.flush()
+        await self.writer.drain()
+        rest = b''
+        while self.playing:
+            data = await self.reader.read(server.LIMIT)
+            if not data:
+                raise ConnectionError('Server closed the connection')
+            lines = (rest + data).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                self.answer(json.loads(line))
+            self.flush()
+            buffered = self.writer.transport.get_write_buffer_size()
+            if buffered > server.HIGH_WATER:
+                await self.writer.drain()
+        self.writer.close()
+
+
+class Spectator:
+    """Connection watching tables on one channel until they are over.
+    """
+    def __init__(self, reader, writer, channel):
+        """Create a spectator.
+
+        Args:
+            reader: asyncio.StreamReader of the connection.
+            writer: asyncio.StreamWriter of the connection.
+            channel: server.PUBLIC or server.DELAYED.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.channel = channel
+        self.open = set()  # Tables watched that are not over
+        self.answers = 0  # Watch requests not answered yet
+        self.updates = 0
+        self.syncs = 0
+
+    async def watch(self, tables):
+        """Watch tables; returns once the server took every request.
+
+        Args:
+            tables: Table numbers.
+        """
+        self.writer.write(''.join(
+            json.dumps({'op': 'watch', 'table': table,
+                        'channel': self.channel}) + '\n'
+            for table in tables).encode())
+        self.answers = len(tables)
+        while self.answers:
+            self.read(json.loads(await self.reader.readline()))
+
+    def read(self, message):
+        """Count a message from the server.
+        """
+        operation = message['op']
+        if operation in ('watching', 'error'):
+            self.answers -= 1
+            if operation == 'watching':
+                self.open.add(message['table'])
+            return
+        if operation == 'sync':
+            self.syncs += 1
+        else:
+            self.updates += 1
+        if 'winner' in message:
+            self.open.discard(message['table'])
+
+    async def run(self):
+        """Read updates until every table watched is over.
+        """
+        rest = b''
+        while self.open:
+            data = await self.reader.read(server.LIMIT)
+            if not data:
+                raise ConnectionError('Server closed the connection')
+            lines = (rest + data).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                self.read(json.loads(line))
+        self.writer.close()
+
+
+async def stats(host, port):
+    """Counters of a server, from its stats request.
+    """
+    reader, writer = await asyncio.open_connection(host, port,
+                                                   limit=server.LIMIT)
+    writer.write(b'{"op": "stats"}\n')
+    message = json.loads(await reader.readline())
+    writer.close()
+    return message
+
+
+async def drive(host, port, tables, players=2, connections=CONNECTIONS,
+                seed=None, spectators=0, channel=server.PUBLIC):
+    """Play tables on a server at random; measure action latency.
+
+    Args:
+        host: Server address.
+        port: Server port.
+        tables: Number of concurrent tables.
+        players: Seats per table.
+        connections: Number of connections to spread the tables over.
+        seed: Seed of the random actions.
+        spectators: Connections watching every table.
+        channel: Spectator channel watched.
+
+    Returns:
+        (sorted latencies in seconds, elapsed seconds, spectator counts):
+        the counts are a dict of the updates and syncs the spectators got
+        and the server's fan-out seconds and updates, if spectators.
+    """
+    rng = random.Random(seed)
+    loads = []
+    for index in range(connections):
+        reader, writer = await asyncio.open_connection(
+            host, port, limit=server.LIMIT)
+        loads.append(Load(reader, writer, random.Random(rng.getrandbits(64))))
+    watchers = []
+    for _ in range(spectators):
+        reader, writer = await asyncio.open_connection(
+            host, port, limit=server.LIMIT)
+        watchers.append(Spectator(reader, writer, channel))
+    before = await stats(host, port) if spectators else None
+    began = time.perf_counter()
+    await asyncio.gather(*(
+        load.create(tables // connections
+                    + (index < tables % connections), players)
+        for index, load in enumerate(loads)))
+    numbers = sorted({table for load in loads for table, _ in load.tokens})
+    await asyncio.gather(*(watcher.watch(numbers) for watcher in watchers))
+    await asyncio.gather(*(load.play() for load in loads),
+                         *(watcher.run() for watcher in watchers))
+    elapsed = time.perf_counter() - began
+    latencies = sorted(latency for load in loads
+                       for latency in load.latencies)
+    counts = None
+    if spectators:
+        after = await stats(host, port)
+        counts = {
+            'updates': sum(watcher.updates for watcher in watchers),
+            'syncs': sum(watcher.syncs for watcher in watchers),
+            'actions': after['actions'] - before['actions'],
+            'fanout': after['fanout'] - before['fanout'],
+            'fanned': after['watch_updates'] - before['watch_updates']}
+    return latencies, elapsed, counts
+
+
+def _serve(host, port):
+    """Server process of a run without --port.
+    """
+    try:
+        asyncio.run(server.Server().serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    """Run load levels against a server and print latency percentiles.
+
+    Args:
+        argv: Command line arguments; sys.argv if None.
+    """
+    parser = argparse.ArgumentParser(
+        description='Load generator for the Grackle game server',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--tables', default='1000,10000,50000',
+        help='Comma separated numbers of concurrent tables, one run each.')
+    parser.add_argument(
+        '-p', '--players', default=2, type=int, help='Seats per table.')
+    parser.add_argument(
+        '--connections', default=CONNECTIONS, type=int,
+        help='Client connections to spread the tables over.')
+    parser.add_argument(
+        '--host', default=server.HOST, help='Server address.')
+    parser.add_argument(
+        '--port', default=None, type=int,
+        help='Server port; start a local server if not given.')
+    parser.add_argument(
+        '--seed', default=None, type=int, help='Seed of the actions.')
+    parser.add_argument(
+        '--spectators', default=0, type=int,
+        help='Connections watching every table.')
+    parser.add_argument(
+        '--channel', default=server.PUBLIC,
+        choices=(server.PUBLIC, server.DELAYED),
+        help='Channel the --spectators watch.')
+    args = parser.parse_args(argv)
+    process = None
+    port = args.port
+    if port is None:
+        port = 7000 + random.randrange(2000)
+        process = multiprocessing.Process(target=_serve,
+                                          args=(args.host, port), daemon=True)
+        process.start()
+        time.sleep(1.0)
+    print('  Tables   Actions   Actions/s   p50 ms   p99 ms   max ms'
+          + ('   Watched/s   Syncs  Fan-out us/step  us/update'
+             if args.spectators else ''))
+    try:
+        for tables in (int(level) for level in args.tables.split(',')):
+            latencies, elapsed, counts = asyncio.run(drive(
+                args.host, port, tables, args.players, args.connections,
+                args.seed, args.spectators, args.channel))
+            watched = ''
+            if counts:
+                fanout = counts['fanout'] * 1e6
+                watched = (f' {counts["updates"]/elapsed:>11,.0f}'
+                           f' {counts["syncs"]:>7}'
+                           f' {fanout/max(1, counts["actions"]):>16.1f}'
+                           f' {fanout/max(1, counts["fanned"]):>10.2f}')
+            print(f'{tables:>8} {len(latencies):>9}'
+                  f' {len(latencies)/elapsed:>11,.0f}'
+                  f' {percentile(latencies, 0.5)*1000:>8.2f}'
+                  f' {percentile(latencies, 0.99)*1000:>8.2f}'
+                  f' {percentile(latencies, 1.0)*1000:>8.2f}{watched}',
+                  flush=True)
+    finally:
+        if process:
+            process.terminate()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
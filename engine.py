@@ -0,0 +1,1023 @@
+"""Headless Grackle rules engine.
+
+The rules live here, free of any terminal I/O, so that the interactive
+script, simulations and bots all share one implementation.
+
+A game is an immutable GameState.  Every state is waiting on exactly one
+decision of the current player (see `pending`); `legal_actions()` lists
+the answers to it and `apply()` returns the next state together with the
+events that happened on the way.  Decisions with a single possible answer
+inside a coin's effect (only one opponent, only one coin to pick, ...) are
+resolved automatically, just like select_from_list() does for people.
+Every turn starts with a PLAY decision, even when it is forced, so drivers
+get to see each turn begin.
+
+Coins are small integer ids: their index in COINS.  What a coin does is
+the Effect at that index of Table.effects.
+"""
+import random
+from collections import deque
+from typing import NamedTuple
+
+
+COINS = {  # Ordering is important!  These two are required at all times:
+    '[chest]': 'Take one more turn; hopefully you will get the key and win',
+    '[key]': 'No effect; hopefully you will win the game if you play this',
+    # Coins below can be removed prior to game play via -r flag
+    '[arrow]': "Bury an opponent's coin under the pile, if they have one",
+    '[boots]': 'Play this then the top coin from pile immediately',
+    '[coin_purse]': 'Draw new coin and put one in your hand on top of pile',
+    '[ham_hock]': 'Draw new coin and put it into your larder for one turn',
+    '[knife]': 'Trade coins with an opponent, if they have one',
+    '[lantern]': 'Look at top two coins in pile, returning them in any order',
+    '[mirror]': 'Re-use any coin in play, if there are any',
+    '[raven]': "Look at an opponent's coin, if they have one",
+    '[rope]': 'Look at bottom coin of pile and optionally move it to the top',
+    '[shield]': 'Protects player from effects of coins except wind, shovel',
+    '[shovel]': 'Bury a coin in play under pile, removing its effect',
+    '[sickle]': "Put an opponent's coin in play without any effect",
+    '[wind]': 'Shuffle all coins in play into the pile (except wind)',
+    }
+HAND_MIN = 2  # number of coins players can have: held coin + drawn coin
+HAND_MAX = 3  #   (not including larder, which is a separate thing)
+PLAYER_MIN = 2
+PLAYER_MAX = len(COINS) // HAND_MIN  # Does not take into account removal
+REMOVE_MAX = 5  # Does not take into account other parameters
+
+COIN_NAMES = tuple(COINS)
+COIN_IDS = {name: coin for coin, name in enumerate(COIN_NAMES)}
+CHEST = COIN_IDS['[chest]']
+KEY = COIN_IDS['[key]']
+ARROW = COIN_IDS['[arrow]']
+BOOTS = COIN_IDS['[boots]']
+COIN_PURSE = COIN_IDS['[coin_purse]']
+HAM_HOCK = COIN_IDS['[ham_hock]']
+KNIFE = COIN_IDS['[knife]']
+LANTERN = COIN_IDS['[lantern]']
+MIRROR = COIN_IDS['[mirror]']
+RAVEN = COIN_IDS['[raven]']
+ROPE = COIN_IDS['[rope]']
+SHIELD = COIN_IDS['[shield]']
+SHOVEL = COIN_IDS['[shovel]']
+SICKLE = COIN_IDS['[sickle]']
+WIND = COIN_IDS['[wind]']
+NONE = -1  # No coin/player; also the only PLAY answer when there is none
+
+# Decisions (first item of GameState.pending)
+PLAY = 'play'  # Which coin to play (coin id; NONE to skip an empty turn)
+TARGET = 'target'  # Which opponent the coin targets (seat)
+OPP_COIN = 'opp_coin'  # Which of the opponent's coins (index into hand)
+GIVE = 'give'  # Which coin to trade away with the knife (coin id)
+PURSE = 'purse'  # Which coin to put back on top of the pile (coin id)
+LANTERN_ORDER = 'lantern'  # Which of the top two coins ends on top (coin id)
+ROPE_MOVE = 'rope'  # Move the bottom coin to the top (1) or not (0)
+MIRROR_PICK = 'mirror'  # Which coin in play to copy (coin id)
+SHOVEL_PICK = 'shovel'  # Which coin in play to bury (coin id)
+DONE = 'done'  # Game over; there is nothing left to decide
+DECISIONS = (PLAY, TARGET, OPP_COIN, GIVE, PURSE, LANTERN_ORDER, ROPE_MOVE,
+             MIRROR_PICK, SHOVEL_PICK, DONE)
+
+# Events (first item of Event)
+TURN = 'turn'  # player starts a turn
+AGAIN = 'again'  # player starts the extra turn granted by the chest
+REMOVED = 'removed'  # coin taken out of the game before it started
+DEALT = 'dealt'  # player is dealt coin
+PADDED = 'padded'  # player pads their hand with coin (--future)
+DREW = 'drew'  # player draws coin
+LARDER_USED = 'larder_used'  # player has to play coin from their larder
+SKIPPED = 'skipped'  # player has no coins to play
+PLAYED = 'played'  # player plays coin
+SHIELDED = 'shielded'  # target is shielded from coin played by player
+BURIED = 'buried'  # player buries coin (of target, for the arrow)
+KILLED = 'killed'  # player puts coin of target in play (sickle)
+TRADED = 'traded'  # player trades coin for other coin of target
+SAW = 'saw'  # player sees coin (of target, or of the pile at other)
+PUT_BACK = 'put_back'  # player puts coin back on top of the pile
+STORED = 'stored'  # player puts coin into their larder
+REORDERED = 'reordered'  # player reordered the top of the pile; coin on top
+ROPED = 'roped'  # player moved the bottom coin to the top
+SHIELD_ON = 'shield_on'  # player is protected by the shield
+SHIELD_OFF = 'shield_off'  # player lost the protection of the shield
+SHUFFLED = 'shuffled'  # player shuffled the coins in play into the pile
+WON = 'won'  # player wins the game
+
+
+class Event(NamedTuple):
+    """Something that happened while applying an action.
+
+    Which fields are used depends on the kind; unused ones are NONE.
+    """
+    kind: str
+    player: int
+    coin: int = NONE
+    target: int = NONE
+    other: int = NONE
+
+
+class GameState(NamedTuple):
+    """Immutable snapshot of a game, waiting on one decision.
+    """
+    players: int  # Number of seats
+    hand_size: int  # Coins per hand (-c flag)
+    future: bool  # Hand padding (-f flag)
+    removed: tuple  # Coins removed from the game before it started
+    hands: tuple  # Per seat: tuple of coin ids, in the order received
+    larders: tuple  # Per seat: coin id or NONE
+    shields: tuple  # Per seat: bool
+    pile: tuple  # Coin ids, top of the pile first
+    in_play: tuple  # Coin ids on the field, in the order played
+    current: int  # Seat of the player making every decision
+    pending: tuple  # (decision, *context); see legal_actions()
+    go_again: bool  # The chest granted another turn
+    turn: int  # Number of turns started, extra turns included
+    seed: int  # Seeds the next shuffle by the wind
+    winner: int  # Seat of the winner, NONE until the game is over
+
+
+# Coin locations (Table.where)
+IN_HAND = 0  # + seat
+IN_LARDER = 8  # + seat
+IN_PLAY = 16
+IN_PILE = 17
+OUT = 18  # Removed before the game started
+
+_new = tuple.__new__  # Builds Event/GameState without argument parsing
+
+
+class InvariantError(RuntimeError):
+    """A coin is not where the rules put it: the engine has a bug.
+    """
+
+
+# Coin effects
+
+EFFECT_TYPES = {}
+
+
+def register(cls):
+    """Class decorator: make an effect available by its name.
+    """
+    EFFECT_TYPES[cls.name] = cls
+    return cls
+
+
+class Effect:
+    """What playing a coin does, looked up by coin id in Table.effects.
+
+    Handlers are stateless: everything they change lives on the table.
+    The metadata below describes an effect without playing it, for the
+    legal moves, bots and tools.  Subclasses override play(), and aim(),
+    hit() or pick() when they ask for a target or a coin in play.
+    """
+    name = None  # Registered name, used by variant files
+    targets = False  # Aimed at an opponent
+    shieldable = False  # The shield of the opponent stops it
+    chains = False  # Plays another coin (boots: the top of the pile)
+    copies = False  # Plays a coin in play again (mirror)
+    reveals = False  # Shows the player coins hidden from them
+    protects = False  # Shields its player while in play
+    decisions = ()  # Decisions it can ask of the player
+    settings = ('description',)  # Options a variant file can set
+
+    def __init__(self, coin, **options):
+        """Create the handler of a coin.
+
+        Args:
+            coin: Coin id it is played as.
+            options: Overrides of `settings`.
+
+        Raises:
+            ValueError: unknown option.
+        """
+        self.coin = coin
+        self.description = COINS[COIN_NAMES[coin]]
+        for key, value in options.items():
+            if key not in self.settings:
+                raise ValueError(f'{self.name} has no setting {key!r}')
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({COIN_NAMES[self.coin]})'
+
+    def play(self, table):
+        """Resolve the effect once the coin is in play, as far as possible.
+        """
+
+    def aim(self, table, opponent):
+        """Apply the effect to an opponent not protected by the shield.
+        """
+        table.choose_opponent_coin(self.coin, opponent)
+
+    def hit(self, table, opponent, index, given):
+        """Apply the effect to one coin of an opponent (see Table.hit).
+        """
+
+    def pick(self, table, picked):
+        """Apply the effect to a coin taken out of play (see Table.pick).
+        """
+
+
+@register
+class Chest(Effect):
+    name = 'chest'
+
+    def play(self, table):
+        table.go_again = True
+
+
+@register
+class Key(Effect):
+    name = 'key'  # No effect; also a blank for variants
+
+
+class Targeted(Effect):
+    """Effect aimed at one coin in the hand of an opponent.
+    """
+    targets = True
+    shieldable = True
+    decisions = (TARGET, OPP_COIN)
+    settings = Effect.settings + ('shieldable',)
+
+    def play(self, table):
+        player = table.current
+        opponents = [seat for seat in range(table.players) if seat != player]
+        if len(opponents) > 1:
+            table.pending = (TARGET, self.coin)
+        else:
+            table.target(self.coin, opponents[0])
+
+
+@register
+class Arrow(Targeted):
+    name = 'arrow'
+
+    def hit(self, table, opponent, index, given):
+        if index != NONE:
+            buried = table.hands[opponent].pop(index)
+            table.push_bottom(buried, IN_HAND + opponent)
+            table.emit(BURIED, table.current, buried, opponent)
+            table.draw_replacement(opponent)
+
+
+@register
+class Boots(Effect):
+    name = 'boots'
+    chains = True
+    plays = 1  # Coins played off the top of the pile
+    settings = Effect.settings + ('plays',)
+
+    def play(self, table):
+        for _ in range(self.plays):
+            if table.pile and table.pending is None:
+                table.play(table.pop_top(IN_PLAY), IN_PLAY)
+
+
+@register
+class CoinPurse(Effect):
+    name = 'coin_purse'
+    decisions = (PURSE,)
+
+    def play(self, table):
+        player = table.current
+        hand = table.hands[player]
+        if table.pile:
+            table.emit(DREW, player, table.draw(player))
+        if len(hand) > 1:
+            table.pending = (PURSE,)
+        elif hand:
+            table.put_back(hand[0])
+
+
+@register
+class HamHock(Effect):
+    name = 'ham_hock'
+
+    def play(self, table):
+        player = table.current
+        if table.pile and table.larders[player] == NONE:
+            stored = table.pop_top(IN_LARDER + player)
+            table.larders[player] = stored
+            table.emit(STORED, player, stored)
+
+
+@register
+class Knife(Targeted):
+    name = 'knife'
+    decisions = (TARGET, GIVE, OPP_COIN)
+
+    def aim(self, table, opponent):
+        given = table.hands[table.current]
+        if len(given) > 1:
+            table.pending = (GIVE, opponent)
+        else:
+            table.choose_opponent_coin(self.coin, opponent,
+                                       given[0] if given else NONE)
+
+    def hit(self, table, opponent, index, given):
+        player = table.current
+        hand = table.hands[opponent]
+        taken = hand.pop(index) if index != NONE else NONE
+        if given != NONE:
+            table.hands[player].remove(given)
+        if taken != NONE:
+            table.move(taken, IN_HAND + opponent, IN_HAND + player)
+            table.hands[player].append(taken)
+        if given != NONE:
+            table.move(given, IN_HAND + player, IN_HAND + opponent)
+            hand.append(given)
+        table.emit(TRADED, player, given, opponent, taken)
+
+
+@register
+class Lantern(Effect):
+    name = 'lantern'
+    reveals = True
+    decisions = (LANTERN_ORDER,)
+
+    def play(self, table):
+        pile = table.pile
+        for index in range(min(2, len(pile))):
+            table.emit(SAW, table.current, pile[index], NONE, index)
+        if len(pile) > 1:
+            table.pending = (LANTERN_ORDER,)
+
+
+class Picking(Effect):
+    """Effect on another coin in play, picked by the player.
+
+    The coins it can pick are those whose effect does not ask the same
+    decision, so the mirror can neither copy itself nor another mirror.
+    """
+    def play(self, table):
+        decision = self.decisions[0]
+        effects = table.effects
+        options = [other for other in table.in_play
+                   if decision not in effects[other].decisions]
+        if len(options) > 1:
+            table.pending = (decision,)
+        elif options:
+            table.pick(self.coin, options[0])
+
+
+@register
+class Mirror(Picking):
+    name = 'mirror'
+    copies = True
+    decisions = (MIRROR_PICK,)
+
+    def pick(self, table, picked):
+        table.play(picked, IN_PLAY)
+
+
+@register
+class Raven(Targeted):
+    name = 'raven'
+    reveals = True
+
+    def hit(self, table, opponent, index, given):
+        if index != NONE:
+            table.emit(SAW, table.current, table.hands[opponent][index],
+                       opponent)
+
+
+@register
+class Rope(Effect):
+    name = 'rope'
+    reveals = True
+    decisions = (ROPE_MOVE,)
+
+    def play(self, table):
+        pile = table.pile
+        if pile:
+            table.emit(SAW, table.current, pile[-1], NONE, len(pile) - 1)
+        if len(pile) > 1:
+            table.pending = (ROPE_MOVE,)
+
+
+@register
+class Shield(Effect):
+    name = 'shield'
+    protects = True
+
+    def play(self, table):
+        table.set_shield(table.current, True)
+
+
+@register
+class Shovel(Picking):
+    name = 'shovel'
+    decisions = (SHOVEL_PICK,)
+
+    def pick(self, table, picked):
+        table.push_bottom(picked, IN_PLAY)
+        table.emit(BURIED, table.current, picked)
+        if table.effects[picked].protects:
+            for seat in range(table.players):
+                table.set_shield(seat, False)
+
+
+@register
+class Sickle(Targeted):
+    name = 'sickle'
+
+    def hit(self, table, opponent, index, given):
+        if index != NONE:
+            killed = table.hands[opponent].pop(index)
+            table.to_play(killed, IN_HAND + opponent)
+            table.emit(KILLED, table.current, killed, opponent)
+            table.draw_replacement(opponent)
+
+
+@register
+class Wind(Effect):
+    name = 'wind'
+
+    def play(self, table):
+        table.shuffle(self.coin)
+        for seat in range(table.players):
+            table.set_shield(seat, False)
+
+
+EFFECTS = tuple(EFFECT_TYPES[name[1:-1]](coin)
+                for coin, name in enumerate(COIN_NAMES))  # By coin id
+
+
+class Table:
+    """Mutable game, played in place.
+
+    apply() copies a state into a Table, steps it once and freezes it again;
+    simulations can keep stepping one Table instead.  Searches branch by
+    fork(), or by restore() of a frozen state on a table they reuse.
+
+    The pile is a deque with the top on the left, so drawing, putting back,
+    burying and the rope are O(1).  Every coin move also goes through
+    move(), which keeps `where` (coin -> location) up to date.  With
+    `check` on, each move verifies the coin left the location the index has
+    for it and each step verifies the coin count, so coins can neither be
+    lost nor duplicated without an InvariantError, at O(1) per move.
+    """
+    __slots__ = ('players', 'hand_size', 'future', 'removed', 'hands',
+                 'larders', 'shields', 'pile', 'in_play', 'current',
+                 'pending', 'go_again', 'turn', 'seed', 'winner', 'events',
+                 'where', 'top', 'slot', 'check', 'count')
+    trusted = False  # Subclasses whose actions are always legal skip checks
+    effects = EFFECTS  # Effect by coin id; variants subclass with their own
+
+    def __init__(self, state, check=False):
+        """Thaw a state.
+
+        Args:
+            state: GameState to copy.
+            check: Verify every coin move against the location index.
+        """
+        self.check = check
+        self.restore(state)
+
+    def restore(self, state):
+        """Set the table back to a state, in place.
+
+        States are immutable, so the result of freeze() is a snapshot that
+        can be restored any number of times: to undo moves, or to try
+        several lines of play from one position on the same table.  Slots
+        added by subclasses are left as they are.
+
+        Args:
+            state: GameState to copy.
+        """
+        self.players = state.players
+        self.hand_size = state.hand_size
+        self.future = state.future
+        self.removed = state.removed
+        self.hands = [list(hand) for hand in state.hands]
+        self.larders = list(state.larders)
+        self.shields = list(state.shields)
+        self.pile = deque(state.pile)
+        self.in_play = list(state.in_play)
+        self.current = state.current
+        self.pending = state.pending
+        self.go_again = state.go_again
+        self.turn = state.turn
+        self.seed = state.seed
+        self.winner = state.winner
+        self.events = []
+        self.where = [OUT] * len(COIN_NAMES)
+        self.slot = [0] * len(COIN_NAMES)  # absolute pile position
+        self.top = 0  # absolute position of the top of the pile
+        self.count = len(COIN_NAMES) - len(state.removed)
+        if self.check:
+            self.index()
+
+    def fork(self):
+        """Independent copy of the table, to play on separately.
+
+        Cheaper than thawing freeze() again, let alone copy.deepcopy():
+        only the lists of the table are copied.  Slots added by subclasses
+        are shared with the copy.
+
+        Returns:
+            Table of the same class, in the same position.
+        """
+        fork = object.__new__(type(self))
+        fork.players = self.players
+        fork.hand_size = self.hand_size
+        fork.future = self.future
+        fork.removed = self.removed
+        fork.hands = [hand[:] for hand in self.hands]
+        fork.larders = self.larders[:]
+        fork.shields = self.shields[:]
+        fork.pile = self.pile.copy()
+        fork.in_play = self.in_play[:]
+        fork.current = self.current
+        fork.pending = self.pending
+        fork.go_again = self.go_again
+        fork.turn = self.turn
+        fork.seed = self.seed
+        fork.winner = self.winner
+        fork.events = self.events[:]
+        fork.where = self.where[:]
+        fork.slot = self.slot[:]
+        fork.top = self.top
+        fork.check = self.check
+        fork.count = self.count
+        for cls in type(self).__mro__:
+            if cls is Table:
+                break
+            for name in cls.__dict__.get('__slots__', ()):
+                if hasattr(self, name):
+                    setattr(fork, name, getattr(self, name))
+        return fork
+
+    def index(self):
+        """Rebuild the location index from scratch, checking it.
+
+        Raises:
+            InvariantError: a coin is missing or in two places.
+        """
+        where = [OUT] * len(COIN_NAMES)
+        places = [(coin, IN_HAND + seat)
+                  for seat, hand in enumerate(self.hands) for coin in hand]
+        places += [(coin, IN_LARDER + seat)
+                   for seat, coin in enumerate(self.larders) if coin != NONE]
+        places += [(coin, IN_PLAY) for coin in self.in_play]
+        places += [(coin, IN_PILE) for coin in self.pile]
+        for coin, place in places:
+            if where[coin] != OUT or coin in self.removed:
+                raise InvariantError(f'{COIN_NAMES[coin]} found twice')
+            where[coin] = place
+        if len(places) != self.count:
+            missing = [COIN_NAMES[coin] for coin, place in enumerate(where)
+                       if place == OUT and coin not in self.removed]
+            raise InvariantError(f'Coins not present: {missing}')
+        self.where = where
+        self.top = 0
+        for position, coin in enumerate(self.pile):
+            self.slot[coin] = position
+
+    def freeze(self):
+        """Freeze the table back into a state.
+
+        Returns:
+            GameState equivalent of the table.
+        """
+        return _new(GameState, (
+            self.players, self.hand_size, self.future, self.removed,
+            tuple(map(tuple, self.hands)), tuple(self.larders),
+            tuple(self.shields), tuple(self.pile), tuple(self.in_play),
+            self.current, self.pending, self.go_again, self.turn, self.seed,
+            self.winner))
+
+    def emit(self, kind, player, coin=NONE, target=NONE, other=NONE):
+        """Record an event.
+        """
+        self.events.append(_new(Event, (kind, player, coin, target, other)))
+
+    def locate(self, coin):
+        """Where a coin is.
+
+        Only reliable when the table was created with `check` on, since the
+        index is not built otherwise.
+
+        Args:
+            coin: Coin id.
+
+        Returns:
+            (location, detail): detail is the seat for IN_HAND/IN_LARDER,
+            the position from the top for IN_PILE and NONE otherwise.
+        """
+        place = self.where[coin]
+        if place == IN_PILE:
+            return IN_PILE, self.slot[coin] - self.top
+        if place < IN_PLAY:
+            return place & ~7, place & 7
+        return place, NONE
+
+    # Coin moves
+
+    def move(self, coin, source, destination):
+        """Record a coin moving between locations.
+
+        Args:
+            coin: Coin id.
+            source: Location the coin leaves.
+            destination: Location the coin enters.
+
+        Raises:
+            InvariantError: in check mode, if the coin was not at source.
+        """
+        if self.check and self.where[coin] != source:
+            raise InvariantError(
+                f'{COIN_NAMES[coin]} moved from {source}'
+                f' but was at {self.where[coin]}')
+        self.where[coin] = destination
+
+    def pop_top(self, destination):
+        """Take the top coin of the pile; the pile must not be empty.
+        """
+        coin = self.pile.popleft()
+        if self.check and self.slot[coin] != self.top:
+            raise InvariantError(f'{COIN_NAMES[coin]} was not on top')
+        self.top += 1
+        self.move(coin, IN_PILE, destination)
+        return coin
+
+    def push_top(self, coin, source):
+        """Put a coin on top of the pile.
+        """
+        self.move(coin, source, IN_PILE)
+        self.top -= 1
+        self.slot[coin] = self.top
+        self.pile.appendleft(coin)
+
+    def push_bottom(self, coin, source):
+        """Bury a coin at the bottom of the pile.
+        """
+        self.move(coin, source, IN_PILE)
+        self.slot[coin] = self.top + len(self.pile)
+        self.pile.append(coin)
+
+    def to_play(self, coin, source):
+        """Put a coin in play.
+        """
+        self.move(coin, source, IN_PLAY)
+        self.in_play.append(coin)
+
+    def draw(self, seat):
+        """Top coin of the pile goes to a player.
+        """
+        coin = self.pop_top(IN_HAND + seat)
+        self.hands[seat].append(coin)
+        return coin
+
+    # Turn structure
+
+    def step(self, action):
+        """Answer the pending decision and play on until the next one.
+
+        Args:
+            action: One of legal_actions() for the table.
+
+        Returns:
+            List of Event that happened.
+
+        Raises:
+            ValueError: the action is not legal.
+            InvariantError: in check mode, a coin went astray.
+        """
+        self.events = []
+        self.decide(action)
+        if self.check:
+            count = len(self.pile) + len(self.in_play) + sum(
+                map(len, self.hands)) + self.players - self.larders.count(
+                    NONE)
+            if count != self.count:
+                raise InvariantError(f'{count} coins instead of {self.count}')
+        return self.events
+
+    def settle(self):
+        """Move the game forward until a decision is needed.
+        """
+        while self.pending is None:
+            if CHEST in self.in_play and KEY in self.in_play:
+                self.winner = self.current
+                self.pending = (DONE,)
+                self.emit(WON, self.current)
+            elif self.go_again:
+                self.go_again = False
+                self.start_turn(AGAIN)
+            else:
+                self.current = (self.current + 1) % self.players
+                self.start_turn(TURN)
+
+    def start_turn(self, kind):
+        """Start a turn: pad the hand, draw and ask which coin to play.
+
+        Args:
+            kind: TURN for a new turn, AGAIN for one granted by the chest.
+        """
+        player = self.current
+        self.turn += 1
+        self.emit(kind, player)
+        if (self.future and len(self.hands[player]) < self.hand_size - 1
+                and self.pile):
+            self.emit(PADDED, player, self.draw(player))
+        if self.larders[player] == NONE and self.pile:
+            self.emit(DREW, player, self.draw(player))
+        self.pending = (PLAY,)
+
+    def draw_replacement(self, player):
+        """Target of the arrow or sickle draws a new coin, if there is one.
+        """
+        if self.pile:
+            self.emit(DREW, player, self.draw(player))
+
+    def set_shield(self, player, shield):
+        """Turn the shield of a player on or off.
+        """
+        if self.shields[player] != shield:
+            self.shields[player] = shield
+            self.emit(SHIELD_ON if shield else SHIELD_OFF, player)
+
+    # Coin effects
+
+    def play(self, coin, source):
+        """Put a coin in play and resolve its effect, as far as possible.
+
+        Args:
+            coin: Coin id being played by the current player.
+            source: Location the coin is played from.
+        """
+        self.emit(PLAYED, self.current, coin)
+        self.to_play(coin, source)
+        self.effects[coin].play(self)
+
+    def shuffle(self, kept=WIND):
+        """Shuffle the coins in play, except the wind, into the pile.
+
+        Args:
+            kept: Coin that stays in play: the one shuffling.
+        """
+        for coin in self.in_play:
+            if coin != kept:
+                self.move(coin, IN_PLAY, IN_PILE)
+        coins = list(self.pile)
+        coins += [coin for coin in self.in_play if coin != kept]
+        self.in_play = [kept]
+        self.mix(coins)
+        self.pile = deque(coins)
+        self.top = 0
+        for position, coin in enumerate(coins):
+            self.slot[coin] = position
+        self.emit(SHUFFLED, self.current)
+
+    def mix(self, coins):
+        """Shuffle the new pile in place; the chance part of the wind.
+
+        Args:
+            coins: List of coin ids, the pile first, then the coins in play.
+        """
+        rng = random.Random(self.seed)
+        rng.shuffle(coins)
+        self.seed = rng.getrandbits(64)
+
+    def target(self, coin, opponent):
+        """Aim a targeting coin at an opponent.
+
+        Args:
+            coin: Coin whose effect targets, e.g. ARROW.
+            opponent: Seat of the opponent.
+        """
+        effect = self.effects[coin]
+        if self.shields[opponent] and effect.shieldable:
+            self.emit(SHIELDED, self.current, coin, opponent)
+        else:
+            effect.aim(self, opponent)
+
+    def choose_opponent_coin(self, coin, opponent, given=NONE):
+        """Pick the opponent's coin, asking only if there is a choice.
+
+        Args:
+            coin: Coin being played.
+            opponent: Seat of the opponent.
+            given: Coin the knife trades away, if any.
+        """
+        count = len(self.hands[opponent])
+        if count > 1:
+            self.pending = (OPP_COIN, coin, opponent, given)
+        else:
+            self.hit(coin, opponent, 0 if count else NONE, given)
+
+    def hit(self, coin, opponent, index, given=NONE):
+        """Apply a targeting coin to one coin of an opponent.
+
+        Args:
+            coin: Coin being played.
+            opponent: Seat of the opponent.
+            index: Index into the opponent's hand, or NONE if it is empty.
+            given: Coin the knife trades away, if any.
+        """
+        self.effects[coin].hit(self, opponent, index, given)
+
+    def put_back(self, coin):
+        """Put a coin from the hand back on top of the pile (coin purse).
+        """
+        self.hands[self.current].remove(coin)
+        self.push_top(coin, IN_HAND + self.current)
+        self.emit(PUT_BACK, self.current, coin)
+
+    def pick(self, coin, picked):
+        """Resolve the mirror or shovel once the coin in play is known.
+
+        Args:
+            coin: Coin whose effect picks, e.g. MIRROR.
+            picked: Coin in play being copied or buried.
+        """
+        self.in_play.remove(picked)
+        self.effects[coin].pick(self, picked)
+
+    # Decisions
+
+    def decide(self, action):
+        """Answer the pending decision and settle.
+
+        Args:
+            action: One of legal_actions() for the table.
+
+        Raises:
+            ValueError: the action is not legal.
+        """
+        pending = self.pending
+        if not self.trusted and action not in _legal_actions(self, pending):
+            raise ValueError(f'Illegal action {action!r} for {pending!r}')
+        self.pending = None
+        decision = pending[0]
+        player = self.current
+        if decision == PLAY:
+            if self.larders[player] != NONE:
+                self.larders[player] = NONE
+                self.emit(LARDER_USED, player, action)
+                self.play(action, IN_LARDER + player)
+            elif action == NONE:
+                self.emit(SKIPPED, player)
+            else:
+                self.hands[player].remove(action)
+                self.play(action, IN_HAND + player)
+        elif decision == TARGET:
+            self.target(pending[1], action)
+        elif decision == OPP_COIN:
+            self.hit(pending[1], pending[2], action, pending[3])
+        elif decision == GIVE:  # The coin asking is the last one played
+            self.choose_opponent_coin(self.in_play[-1], pending[1], action)
+        elif decision == PURSE:
+            self.put_back(action)
+        elif decision == LANTERN_ORDER:
+            pile = self.pile
+            if action != pile[0]:
+                slot = self.slot
+                slot[pile[0]], slot[pile[1]] = slot[pile[1]], slot[pile[0]]
+                pile[0], pile[1] = pile[1], pile[0]
+            self.emit(REORDERED, player, pile[0])
+        elif decision == ROPE_MOVE:
+            if action:
+                self.push_top(self.pile.pop(), IN_PILE)
+                self.emit(ROPED, player)
+        else:  # MIRROR_PICK, SHOVEL_PICK
+            self.pick(self.in_play[-1], action)
+        self.settle()
+
+    def legal_actions(self):
+        """legal_actions() of the table.
+        """
+        return _legal_actions(self, self.pending)
+
+
+def _legal_actions(state, pending):
+    """legal_actions() for a state or table.
+    """
+    decision = pending[0]
+    player = state.current
+    if decision == PLAY:
+        larder = state.larders[player]
+        if larder != NONE:
+            actions = (larder,)
+        else:
+            actions = tuple(state.hands[player]) or (NONE,)
+    elif decision == TARGET:
+        actions = tuple(seat for seat in range(state.players)
+                        if seat != player)
+    elif decision == OPP_COIN:
+        actions = tuple(range(len(state.hands[pending[2]])))
+    elif decision in (GIVE, PURSE):
+        actions = tuple(state.hands[player])
+    elif decision == LANTERN_ORDER:
+        actions = (state.pile[0], state.pile[1])
+    elif decision == ROPE_MOVE:
+        actions = (0, 1)
+    elif decision == MIRROR_PICK or decision == SHOVEL_PICK:
+        effects = getattr(state, 'effects', EFFECTS)
+        actions = tuple(coin for coin in state.in_play
+                        if decision not in effects[coin].decisions)
+    else:  # DONE
+        actions = ()
+    return actions
+
+
+def legal_actions(state):
+    """List the possible answers to the pending decision.
+
+    PLAY: coin ids in hand (only the larder coin if there is one, NONE if
+    there is nothing to play); TARGET: opponent seats; OPP_COIN: indexes
+    into the opponent's hand (the choice is blind); GIVE, PURSE: coin ids in
+    hand; LANTERN_ORDER: the top two coins, naming the one to end on top;
+    ROPE_MOVE: 0 or 1; MIRROR_PICK, SHOVEL_PICK: coin ids in play whose
+    effect does not ask the same decision (see Effect.decisions).
+
+    Args:
+        state: GameState or Table.
+
+    Returns:
+        Tuple of actions; empty once the game is over.
+    """
+    return _legal_actions(state, state.pending)
+
+
+def apply(state, action, check=False, table_class=Table):
+    """Answer the pending decision and play on until the next one.
+
+    The state passed in is left untouched.
+
+    Args:
+        state: GameState.
+        action: One of legal_actions(state).
+        check: Verify every coin move (see Table).
+        table_class: Table or a subclass to play the step on.
+
+    Returns:
+        (GameState, tuple of Event) after the action.
+
+    Raises:
+        ValueError: the action is not legal.
+        InvariantError: in check mode, a coin went astray.
+    """
+    table = table_class(state, check)
+    events = table.step(action)
+    return table.freeze(), tuple(events)
+
+
+def new_table(players=PLAYER_MIN, coins=HAND_MIN, remove=0, future=False,
+              seed=None, check=False, table_class=Table):
+    """Remove coins, shuffle the pile, deal and start the first turn.
+
+    Args:
+        players: Number of players.
+        coins: Number of coins in each hand.
+        remove: Number of coins to remove prior to game start.
+        future: Enable future features (hand padding).
+        seed: Seed for every random choice in the game; None for fresh.
+        check: Verify every coin move (see Table).
+        table_class: Table or a subclass to create.
+
+    Returns:
+        Table waiting on the first player; its events are the setup.
+    """
+    rng = random.Random(seed)
+    pile, others = [CHEST, KEY], list(range(2, len(COIN_NAMES)))
+    removed = []
+    for _ in range(remove):
+        if len(others) > coins * players:  # 1 hand per player
+            coin = rng.choice(others)
+            others.remove(coin)
+            removed.append(coin)
+    pile += others
+    rng.shuffle(pile)
+    table = table_class(GameState(
+        players, coins, bool(future), tuple(removed), ((),) * players,
+        (NONE,) * players, (False,) * players, tuple(pile), (), players - 1,
+        None, False, 0, rng.getrandbits(64), NONE), check)
+    for coin in removed:
+        table.emit(REMOVED, NONE, coin)
+    for _ in range(1, coins):  # take into account drawn coin
+        for player in range(players):
+            table.emit(DEALT, player, table.draw(player))
+    table.settle()
+    return table
+
+
+def new_game(players=PLAYER_MIN, coins=HAND_MIN, remove=0, future=False,
+             seed=None, check=False, table_class=Table):
+    """Remove coins, shuffle the pile, deal and start the first turn.
+
+    Args:
+        players: Number of players.
+        coins: Number of coins in each hand.
+        remove: Number of coins to remove prior to game start.
+        future: Enable future features (hand padding).
+        seed: Seed for every random choice in the game; None for fresh.
+        check: Verify every coin move (see Table).
+        table_class: Table or a subclass to deal on.
+
+    Returns:
+        (GameState, tuple of Event) waiting on the first player.
+    """
+    table = new_table(players, coins, remove, future, seed, check,
+                      table_class)
+    return table.freeze(), tuple(table.events)
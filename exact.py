@@ -0,0 +1,488 @@
+"""Exact outcome distributions of small configurations.
+
+Instead of sampling games, this walks every way a game can go under fixed
+policies and adds up the chances, giving exact win probabilities by seat:
+the first player advantage, and the effect of each set of removed coins.
+
+Walking every shuffle of the pile would not finish: 10 coins already have
+3.6 million orders.  Three reductions make it tractable:
+
+- The pile is lazy.  Coins nobody has drawn or seen stay unknown, and the
+  pile only branches, over the coins still unaccounted for, at the moment
+  the rules read a position.  All the orders of the coins below the
+  deepest position a game reaches count as one.  The wind makes the whole
+  pile unknown again (a uniform shuffle, like the seeded one).
+- The random choices of the policies (random, greedy) are chance nodes
+  too, with their own odds.  Other policies keep state of their own or
+  search, so they are not supported.
+- Positions reached along different paths (the same hands, field, known
+  and unknown pile, whoever dealt what in which order) are solved once.
+  Seats are never interchangeable, since they play in turn.
+
+Even so, the positions grow five to ten times with every turn once a
+dozen coins are in the game, so the walk stops at a horizon: results are
+exact for the first `--turns` turns, and the chance that a game is still
+running then is reported with them.  With six coins in the game, all 715
+removed sets of two players solve to the default horizon in minutes.
+
+Each removed set of coins is an independent problem, and so is every deal
+of it; they are shared out over a process pool.
+
+    python exact.py -p 2 -r 9 --policy greedy
+    python exact.py -p 2 -r 5 --removed wind,boots,knife,rope,shield --turns 3
+"""
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import math
+import os
+import sys
+import time
+
+import engine
+import policies
+from engine import NONE
+
+
+UNKNOWN = -2  # Pile position nobody has seen yet
+POLICIES = ('random', 'first', 'greedy')  # Stateless but for rng.choice()
+TURNS = 30  # Games still running after this many turns count as unfinished
+
+
+class _Branch(Exception):
+    """A chance outcome is needed that the script does not have yet.
+    """
+    def __init__(self, options):
+        super().__init__(options)
+        self.options = options
+
+
+class _Script:
+    """Replays chosen chance outcomes, then asks for the next one.
+
+    Stands in for the random stream of the policies as well.
+    """
+    def __init__(self, picks):
+        self.picks = picks  # Index chosen at each chance node
+        self.used = 0
+
+    def choice(self, options):
+        """Next chance outcome among options, all equally likely.
+
+        Raises:
+            _Branch: the script has no more outcomes.
+        """
+        if self.used == len(self.picks):
+            raise _Branch(options)
+        self.used += 1
+        return options[self.picks[self.used - 1]]
+
+
+class _Pile(collections.deque):
+    """Pile whose unknown positions are revealed when they are read.
+    """
+    def __init__(self, coins, table):
+        super().__init__(coins)
+        self.table = table
+
+    def popleft(self):
+        coin = super().popleft()
+        return self.table.reveal() if coin == UNKNOWN else coin
+
+    def pop(self):
+        coin = super().pop()
+        return self.table.reveal() if coin == UNKNOWN else coin
+
+    def __getitem__(self, index):
+        coin = super().__getitem__(index)
+        if coin == UNKNOWN:
+            coin = self.table.reveal()
+            self[index] = coin
+        return coin
+
+
+class _Table(engine.Table):
+    """Table with a lazy pile, stepped under a script of chance outcomes.
+    """
+    __slots__ = ('pool', 'script')
+    trusted = True
+
+    def __init__(self, state, pool, script):
+        """Thaw a state.
+
+        Args:
+            state: GameState whose pile may hold UNKNOWN.
+            pool: Set of the coins the UNKNOWN positions hold, changed in
+                place as they are revealed.
+            script: _Script of the chance outcomes.
+        """
+        super().__init__(state)
+        self.pile = _Pile(state.pile, self)
+        self.pool = pool
+        self.script = script
+
+    def emit(self, kind, player, coin=NONE, target=NONE, other=NONE):
+        pass
+
+    def reveal(self):
+        """Coin of an unknown pile position.
+        """
+        coin = self.script.choice(sorted(self.pool))
+        self.pool.remove(coin)
+        return coin
+
+    def shuffle(self, kept=engine.WIND):
+        coins = [coin for coin in self.in_play if coin != kept]
+        for coin in coins:
+            self.move(coin, engine.IN_PLAY, engine.IN_PILE)
+        self.pool.update(coin for coin in collections.deque.__iter__(
+            self.pile) if coin != UNKNOWN)
+        self.pool.update(coins)
+        self.in_play = [kept]
+        self.pile = _Pile([UNKNOWN] * len(self.pool), self)
+
+
+def _outcomes(run):
+    """Every outcome of a run with chance nodes, and its odds.
+
+    Args:
+        run: Function of a _Script; deterministic given the script.
+
+    Yields:
+        (result of run, odds).
+    """
+    scripts = [((), 1.0)]
+    while scripts:
+        picks, odds = scripts.pop()
+        try:
+            result = run(_Script(picks))
+        except _Branch as branch:
+            share = odds / len(branch.options)
+            scripts.extend((picks + (index,), share)
+                           for index in range(len(branch.options)))
+            continue
+        yield result, odds
+
+
+def _dealt(config, removed, script):
+    """Deal, like engine.new_table(), revealing coins as they are dealt.
+
+    Returns:
+        (GameState, frozenset of the coins still unknown).
+    """
+    players, coins, _, future = config
+    pool = set(range(len(engine.COIN_NAMES))) - set(removed)
+    table = _Table(engine.GameState(
+        players, coins, bool(future), tuple(removed), ((),) * players,
+        (NONE,) * players, (False,) * players, (UNKNOWN,) * len(pool), (),
+        players - 1, None, False, 0, 0, NONE), pool, script)
+    for _ in range(1, coins):
+        for player in range(players):
+            table.draw(player)
+    table.settle()
+    return table.freeze(), frozenset(pool)
+
+
+def _deals(config, removed):
+    """Every lazy deal of a removed set.
+
+    Returns:
+        List of (chance outcomes of the deal, odds).
+    """
+    def deal(script):
+        _dealt(config, removed, script)
+        return script.picks
+    return list(_outcomes(deal))
+
+
+class Solver:
+    """Exact outcome of positions under fixed policies, remembered.
+    """
+    def __init__(self, names, players, turns=TURNS):
+        """Solve for some policies.
+
+        Args:
+            names: Policy name per seat, from POLICIES.
+            players: Number of seats.
+            turns: Turns after which a game counts as unfinished.
+
+        Raises:
+            ValueError: a policy cannot be solved exactly.
+        """
+        for name in names:
+            if name not in POLICIES:
+                raise ValueError(f'{name} cannot be solved exactly; choose'
+                                 f' from {", ".join(POLICIES)}')
+        self.seats = [policies.make(name) for name in names]
+        self.players = players
+        self.turns = turns
+        self.memo = {}
+        self.steps = 0  # Steps played, counting the replays of chance
+        self.merged = 0  # Positions found solved along another path
+
+    def solve(self, state, pool):
+        """Chances of every end of a position.
+
+        Args:
+            state: GameState whose pile may hold UNKNOWN.
+            pool: frozenset of the coins the UNKNOWN positions hold.
+
+        Returns:
+            Tuple of float: win chance by seat, then the chance the
+            game is unfinished after `turns` turns.
+        """
+        key = (state, pool)
+        if key in self.memo:
+            self.merged += 1
+            return self.memo[key]
+        if state.winner != NONE:
+            result = [0.0] * (self.players + 1)
+            result[state.winner] = 1.0
+        elif state.turn > self.turns:
+            result = [0.0] * self.players + [1.0]
+        else:
+            result = [0.0] * (self.players + 1)
+            policy = self.seats[state.current]
+            for action, odds in _outcomes(
+                    lambda script: self._act(policy, state, script)):
+                for (after, left), chance in _outcomes(
+                        lambda script, action=action: self._step(
+                            state, pool, action, script)):
+                    weight = odds * chance
+                    for index, value in enumerate(self.solve(after, left)):
+                        result[index] += weight * value
+        result = tuple(result)
+        self.memo[key] = result
+        return result
+
+    def _act(self, policy, state, script):
+        """Action of a policy, its random choices taken from the script.
+        """
+        policy.rng = script
+        policy.seat = state.current
+        return policy.act(state)
+
+    def _step(self, state, pool, action, script):
+        """Play one action, revealing coins from the script.
+        """
+        self.steps += 1
+        left = set(pool)
+        table = _Table(state, left, script)
+        table.step(action)
+        return table.freeze(), frozenset(left)
+
+
+class Report:
+    """Exact outcomes of a configuration, by set of removed coins.
+    """
+    def __init__(self, players):
+        """Nothing solved yet.
+        """
+        self.players = players
+        self.outcomes = {}  # removed coins: outcome vector, as Solver
+        self.deals = collections.Counter()  # removed coins: lazy deals
+        self.positions = 0
+        self.merged = 0
+        self.steps = 0
+
+    def add(self, other):
+        """Merge the report of a shard.
+        """
+        for removed, outcome in other.outcomes.items():
+            total = self.outcomes.setdefault(
+                removed, [0.0] * (self.players + 1))
+            for index, value in enumerate(outcome):
+                total[index] += value
+        self.deals.update(other.deals)
+        self.positions += other.positions
+        self.merged += other.merged
+        self.steps += other.steps
+
+    def overall(self):
+        """Outcome vector over every removed set, all equally likely.
+        """
+        count = len(self.outcomes)
+        return [sum(outcome[index] for outcome in self.outcomes.values())
+                / count for index in range(self.players + 1)]
+
+    def show(self, config, turns, out=sys.stdout):
+        """Print the outcomes and what the reductions saved.
+        """
+        rows = [(' '.join(engine.COIN_NAMES[coin][1:-1] for coin in removed)
+                 or '(none)', outcome) for removed, outcome in sorted(
+                     self.outcomes.items(), key=lambda item: -item[1][0])]
+        if len(rows) > 1:
+            rows.append(('all', self.overall()))
+        width = 1 + max(len('Removed'), *(len(label) for label, _ in rows))
+        seats = ''.join(f'  seat {seat+1:<2}' for seat in range(self.players))
+        print(f'{"Removed":<{width}}{seats}  running', file=out)
+        for label, outcome in rows:
+            print(f'{label:<{width}}'
+                  + ''.join(f' {value:8.4%}' for value in outcome), file=out)
+        overall = self.overall()
+        print(f'Seat 1 wins {overall[0]:.4%} within {turns} turns; an even'
+              f' share of the finished games would be'
+              f' {(1 - overall[-1]) / self.players:.4%}', file=out)
+        orders = len(self.outcomes) * math.factorial(
+            len(engine.COIN_NAMES) - len(next(iter(self.outcomes))))
+        deals = sum(self.deals.values())
+        print(f'{orders:,} pile orders dealt as {deals:,} lazy deals'
+              f' ({orders / deals:,.1f} orders each); {self.positions:,}'
+              f' positions solved ({self.merged:,} reached again along'
+              f' another path), {self.steps:,} steps played', file=out)
+
+
+def removed_sets(config):
+    """Every set of coins removed before a game, all equally likely.
+
+    Removal stops early when the hands would run out of coins, like in
+    engine.new_table().
+    """
+    others = len(engine.COIN_NAMES) - 2
+    remove = min(config[2], max(0, others - config[0] * config[1]))
+    return list(itertools.combinations(range(2, len(engine.COIN_NAMES)),
+                                       remove))
+
+
+def solve_shard(config, names, turns, work):
+    """Solve some deals; executed by pool workers.
+
+    Args:
+        config: (players, coins, remove, future).
+        names: Policy name per seat.
+        turns: Turns after which a game counts as unfinished.
+        work: List of (removed coins, deal picks, odds of the deal).
+
+    Returns:
+        Report of the deals.
+    """
+    solver = Solver(names, config[0], turns)
+    report = Report(config[0])
+    for removed, picks, odds in work:
+        state, pool = _dealt(config, removed, _Script(picks))
+        outcome = solver.solve(state, pool)
+        total = report.outcomes.setdefault(removed,
+                                           [0.0] * (config[0] + 1))
+        for index, value in enumerate(outcome):
+            total[index] += odds * value
+        report.deals[removed] += 1
+    report.positions = len(solver.memo)
+    report.merged = solver.merged
+    report.steps = solver.steps
+    return report
+
+
+def run(config, names, turns=TURNS, removed=None, workers=None,
+        progress=None):
+    """Solve a configuration exactly, up to a number of turns.
+
+    Args:
+        config: (players, coins, remove, future).
+        names: Policy name per seat, from POLICIES.
+        turns: Turns after which a game counts as unfinished.
+        removed: List of removed coin sets to solve; every possible one
+            if None.
+        workers: Number of processes; 1 solves in this process.
+        progress: File to show progress on, or None.
+
+    Returns:
+        Report.
+
+    Raises:
+        ValueError: a policy cannot be solved exactly.
+    """
+    Solver(names, config[0], turns)  # Check the policies
+    work = [(coins, picks, odds)
+            for coins in (removed_sets(config) if removed is None
+                          else removed)
+            for picks, odds in _deals(config, coins)]
+    workers = workers or os.cpu_count() or 1
+    size = max(1, len(work) // (workers * 8))
+    shards = [work[start:start + size] for start in range(0, len(work), size)]
+    report = Report(config[0])
+    done = 0
+
+    def finished(shard_report):
+        nonlocal done
+        report.add(shard_report)
+        done += 1
+        if progress:
+            print(f'\r{done}/{len(shards)} shards, {report.positions:,}'
+                  ' positions ', end='', file=progress, flush=True)
+
+    if workers == 1:
+        for shard in shards:
+            finished(solve_shard(config, names, turns, shard))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(solve_shard, config, names, turns, shard)
+                       for shard in shards]
+            for future in concurrent.futures.as_completed(futures):
+                finished(future.result())
+    if progress:
+        print(file=progress)
+    return report
+
+
+def main(argv=None):
+    """Solve a configuration and print its exact outcomes.
+
+    Args:
+        argv: Command line arguments; sys.argv if None.
+
+    Returns:
+        Exit status.
+    """
+    parser = argparse.ArgumentParser(
+        description='Exact outcomes of small Grackle configurations')
+    parser.add_argument('-p', '--players', default=engine.PLAYER_MIN,
+                        type=int, help='Number of players.')
+    parser.add_argument('-c', '--coins', default=engine.HAND_MIN, type=int,
+                        help='Number of coins in each hand.')
+    parser.add_argument('-r', '--remove', default=0, type=int,
+                        help='Number of coins removed before the game.')
+    parser.add_argument('-f', '--future', action='store_true',
+                        help='Hand padding.')
+    parser.add_argument('--policy', default='first',
+                        help='Policy for every seat or comma separated'
+                             ' policies per seat, from'
+                             f' {", ".join(POLICIES)}.')
+    parser.add_argument('--turns', default=TURNS, type=int,
+                        help='Turns after which a game counts as still'
+                             f' running (default: {TURNS}).')
+    parser.add_argument('--removed', default=None, metavar='COINS',
+                        help='Only solve this comma separated set of removed'
+                             ' coins, e.g. wind,boots.')
+    parser.add_argument('--workers', default=os.cpu_count(), type=int,
+                        help='Number of processes.')
+    args = parser.parse_args(argv)
+    config = (args.players, args.coins, args.remove, args.future)
+    names = [name.strip() for name in args.policy.split(',')]
+    names = (names + names[-1:] * args.players)[:args.players]
+    removed = None
+    if args.removed is not None:
+        try:
+            coins = tuple(sorted(engine.COIN_IDS[f'[{name.strip()}]']
+                                 for name in args.removed.split(',')
+                                 if name.strip()))
+        except KeyError as error:
+            parser.error(f'Unknown coin {error}')
+        if coins not in removed_sets(config):
+            parser.error(f'-r {args.remove} cannot remove {args.removed}')
+        removed = [coins]
+    began = time.perf_counter()
+    try:
+        report = run(config, names, args.turns, removed, args.workers,
+                     sys.stderr)
+    except ValueError as error:
+        parser.error(str(error))
+    print(f'Solved -p {args.players} -c {args.coins} -r {args.remove}'
+          f'{" -f" if args.future else ""} ({", ".join(names)}) to'
+          f' {args.turns} turns in {time.perf_counter() - began:.1f}s')
+    report.show(config, args.turns)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
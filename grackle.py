@@ -46,44 +46,43 @@ __version__ = '0.9.0'
 
 
 import argparse
+import os
 import random
+import time
+
+import engine
+import instrument
+import mcts
+import policies
+import replay
+import server
+import simulate
+import solver
+import stream
+import tablebot
+from engine import (  # pylint: disable=unused-import
+    COINS, COIN_IDS, COIN_NAMES, HAND_MIN, HAND_MAX, PLAYER_MIN, PLAYER_MAX,
+    REMOVE_MAX)
 
 
 NAME_BASE = 'Player'
-COINS = {  # Ordering is important!  These two are required at all times:
-    '[chest]': 'Take one more turn; hopefully you will get the key and win',
-    '[key]': 'No effect; hopefully you will win the game if you play this',
-    # Coins below can be removed prior to game play via -r flag
-    '[arrow]': "Bury an opponent's coin under the pile, if they have one",
-    '[boots]': 'Play this then the top coin from pile immediately',
-    '[coin_purse]': 'Draw new coin and put one in your hand on top of pile',
-    '[ham_hock]': 'Draw new coin and put it into your larder for one turn',
-    '[knife]': 'Trade coins with an opponent, if they have one',
-    '[lantern]': 'Look at top two coins in pile, returning them in any order',
-    '[mirror]': 'Re-use any coin in play, if there are any',
-    '[raven]': "Look at an opponent's coin, if they have one",
-    '[rope]': 'Look at bottom coin of pile and optionally move it to the top',
-    '[shield]': 'Protects player from effects of coins except wind, shovel',
-    '[shovel]': 'Bury a coin in play under pile, removing its effect',
-    '[sickle]': "Put an opponent's coin in play without any effect",
-    '[wind]': 'Shuffle all coins in play into the pile (except wind)',
-    }
-HAND_MIN = 2  # number of coins players can have: held coin + drawn coin
-HAND_MAX = 3  #   (not including larder, which is a separate thing)
-PLAYER_MIN = 2
-PLAYER_MAX = len(COINS) // HAND_MIN  # Does not take into account removal
-REMOVE_MAX = 5  # Does not take into account other parameters
 SELECTION_MODES = (  # Not selectable; only 'first' and 'player' implemented
     'first',  # Always selects first coin in opponent's hand
     'player',  # Player picks which coin in opponent's hand
     'opponent', # Opponent picks which coin in their hand -- will not do?
     )
 SELECTION_MODE = SELECTION_MODES[0]
+UNDO = 'Undo your last move'  # Offered by ask() with --undo
+SKIP = 'Skip your turn'  # Offered by ask() with --undo, with no coin to play
 
 
 class Player:
     """Player class
+
+    The coins themselves live in the engine's GameState; a Player is the
+    person at the console for a seat.
     """
+    human = True
     def __init__(self, name, prefix=None):
         """Create a player with name and password.
 
@@ -120,9 +119,6 @@ class Player:
             else:
                 print(f'{self.name}, your password cannot be blank.')
         self.password = password
-        self.coins = []
-        self.shield = False
-        self.larder = None
         self.note = []  # ephemeral messages based on previous actions
 
     def verify(self):
@@ -135,31 +131,20 @@ class Player:
             verified = answer == self.password
         print(f'Welcome back, {self.name}.')
 
-    def select_coin(self):
-        """Selects coin: player selects coin to play.
-        """
-        coin = None
-        # If there is something in the larder, it MUST be played next
-        if self.larder:
-            coin = self.remove_larder()
-        elif not self.coins:
-            print(f'{self.name} has no coins to play!  Skipping turn.')
-        else:
-            print('Which coin would you like to play?')
-            coin = select_from_list(self.coins)
-        return coin
-
-    def show_status(self, clear_note=True):
+    def show_status(self, state, seat, clear_note=True):
         """Show current player status, including ephemeral notes...
 
         Args:
+            state: engine.GameState of the game.
+            seat: Seat of this player in the game.
             clear_note: Boolean; clears note if True, keeps otherwise.
         """
+        larder = state.larders[seat]
         print('=' * 80)
         print(f'{self.name} status:')
-        print(f'  Coins: {self.coins}')
-        print(f'  Shield: {self.shield}')
-        print(f'  Larder: {self.larder}')
+        print(f'  Coins: {coin_names(state.hands[seat])}')
+        print(f'  Shield: {state.shields[seat]}')
+        print(f'  Larder: {COIN_NAMES[larder] if larder >= 0 else None}')
         if self.note:
             print('  Notes:')
             for line in self.note:
@@ -177,244 +162,59 @@ class Player:
         if line:
             self.note.append(line)
 
-    def add_coin(self, coin):
-        """Adds coin to player's coins.
-
-        Args:
-            coin:
-
-        Returns:
-            None if coin was added successfully, otherwise the coin is
-            returned.
-        """
-        if len(self.coins) < ARGS.coins and coin not in self.coins:
-            self.coins.append(coin)
-            coin = None
-        return coin
-
-    def get_coin(self, index=None, by_name=False):
-        """Get coin from player, removing it from their coins.
-
-        Arguments are only needed when there is more than one coin held.
-
-        Args:
-            index: Optional integer index of coin requested.
-            by_name: Select coin by name rather than index.
-
-        Returns:
-            A coin object, if any, otherwise None.
-        """
-        if by_name and len(self.coins) > 1:
-            coin = select_from_list(self.coins)
-        else:
-            index = self.get_coin_index(index)
-            if index is not None:
-                coin = self.coins[index]
-                self.coins.remove(coin)
-            else:
-                coin = None
-                print(f'{self.name} has no coins to get.')
-        return coin
-
-    def show_coin(self, index=None):
-        """Show a coin given by index, or else ask which coin.
-
-        If there is one coin, just show it regardless of index.
-        If there are no coins, tell that.
-
-        Args:
-            index: Integer index into list of coins in hand.
-        """
-        index = self.get_coin_index(index)
-        if index is not None:
-            coin = self.coins[index]
-            print(f'{self.name} has {coin}: {COINS[coin]}')
-        else:
-            print(f'{self.name} has no coins to show!')
 
-    def get_coin_index(self, index=None):
-        """Gets the index of a coin; used when opponent asks for a coin.
-
-        Returns:
-            Index of coin in hand, or None if there are no coins.
-        """
-        if index:
-            if self.coins and index > len(self.coins):
-                index = None
-            if index < 0 and abs(index) > len(self.coins):
-                index = None
-            if index is None:
-                print('Requested index was out of range.')
-        if index is None:
-            if len(self.coins) > 1:
-                print(f"Which of {self.name}'s coins do you want index of?")
-                options = [index+1 for index in range(len(self.coins))]
-                index = select_from_list(options)
-                index = int(index) - 1
-            elif len(self.coins) == 1:
-                index = 0
-        return index
-
-    def enable_shield(self):
-        """Enables shield for a player.
-        """
-        if self.shield:
-            print(f'{self.name} already has shield...')
-        else:
-            self.shield = True
-            print(f'{self.name} has enabled shield!')
-
-    def disable_shield(self):
-        """Disables shield for a player.
-        """
-        if self.shield:
-            self.shield = False
-            print(f'{self.name} has shield removed!')
-        else:
-            print(f'{self.name} has no shield to disable...')
-
-    def add_larder(self, coin):
-        """Puts a coin into the larder.
-
-        Args:
-            coin:
-
-        Returns:
-            None if coin was added to larder properly, else the coin.
-        """
-        if coin:
-            if not self.larder:
-                self.larder = coin
-                print(f"{coin} added to {self.name}'s larder.")
-                coin = None
-            else:
-                print('add_larder: Larder already full?')
-        else:
-            print('add_larder: Nothing to add?')
-        return coin
-
-    def remove_larder(self):
-        """Remove coin from larder.
-
-        Returns:
-            coin that was in larder, if any.
-        """
-        if self.larder:
-            print(f'{self.name} uses the coin in the larder.')
-        coin = self.larder
-        self.larder = None
-        return coin
-
-
-class Pile:
-    """Pile/Stack class
+class Computer:
+    """A seat played by a policy (see --computer) instead of a person.
     """
-    def __init__(self, remove=0):
-        """Creates a shuffled pile of coins.
+    human = False
 
-        Args:
-            remove: Number of coins to remove prior to shuffling.
-        """
-        self.in_play = []
-        coins = list(COINS)
-        self.coins, coins = coins[:2], coins[2:]  # First two are chest, key
-        for _ in range(remove):
-            if len(coins) > ARGS.coins * ARGS.players:  # 1 hand per player
-                coin = random.choice(coins)
-                coins.remove(coin)
-                print(f'Removed 1 coins out of {remove}...')
-            else:
-                print(f'Not enough coins {len(coins)} to remove {remove}.')
-        self.coins += coins
-        self.shuffle_coins()
-
-    def shuffle_coins(self, stack='coins'):
-        """Shuffles coins.
+    def __init__(self, seat, policy):
+        """Create a computer player.
 
         Args:
-            stack: Coins to shuffle, either 'coins' or 'in_play'.
-        """
-        coins = getattr(self, stack)
-        random.shuffle(coins)
-
-    def get_coin(self):
-        """Get coin from top of pile.
-
-        Returns:
-            First coin, if any, otherwise None.
+            seat: Seat of the player in the game.
+            policy: policies.Policy making its decisions.
         """
-        if self.coins:
-            coin = self.coins[0]
-            self.remove_coin(coin)
-        else:
-            coin = None
-            print('There are no more coins in the pile to get!')
-        return coin
-
-    def play_coin(self, coin):
-        """Puts a coin 'in_play'.
+        self.name = f'Computer_{seat+1}'
+        self.policy = policy
+        self.note = []
 
-        Args:
-            coin:
+    def verify(self):
+        """Nobody to check at the console; just say who is playing.
         """
-        self.in_play.append(coin)
-
-    def remove_coin(self, coin):
-        """Remove a coin from the pile.
-
-        Args:
-            coin:
+        print(f'{self.name} is thinking...')
 
-        Returns:
-            None if the coin was successfully removed; otherwise coin.
+    def show_status(self, state, seat, clear_note=True):
+        """Computer players keep their coins to themselves.
         """
-        if coin in self.coins:
-            self.coins.remove(coin)
-            coin = None
-        return coin
 
-    def reintegrate(self):
-        """Puts the in-play coins back into the pile (at the bottom).
+    def add_note(self, line):
+        """Computer players follow the events instead of notes.
         """
-        self.coins += self.in_play
-        self.in_play = []
-
-    def put_coin(self, coin):
-        """Puts a coin at the top of the pile.
 
-        Args:
-            coin:
-        """
-        self.coins.insert(0, coin)
 
-    def bury_coin(self, coin):
-        """Buries a coin at the bottom of the pile.
+def coin_names(coins):
+    """Names of coins.
 
-        Args:
-            coin:
-        """
-        self.coins.append(coin)
+    Args:
+        coins: Iterable of engine coin ids.
 
-    def show_coins(self, stack='in_play'):
-        """Shows coins that are in a given pile.
+    Returns:
+        List of coin names, e.g. '[chest]'.
+    """
+    return [COIN_NAMES[coin] for coin in coins]
 
-        Args:
-            stack: Either 'pile' or 'in_play'
-        """
-        coins = getattr(self, stack)
-        if coins:
-            print(f'{stack.title()}:')
-            for coin in coins:
-                print(f'    {coin}: {COINS[coin]}')
 
-    def unlock_chest(self):
-        """Checks if both chest and key are in play.
+def show_coins(state):
+    """Shows coins that are in play.
 
-        Returns:
-            Boolean; True if chest and key are in play, False otherwise.
-        """
-        unlocked = '[key]' in self.in_play and '[chest]' in self.in_play
-        return unlocked
+    Args:
+        state: engine.GameState of the game.
+    """
+    if state.in_play:
+        print('In_Play:')
+        for coin in coin_names(state.in_play):
+            print(f'    {coin}: {COINS[coin]}')
 
 
 def select_from_list(item_list):
@@ -453,6 +253,18 @@ def select_from_list(item_list):
     return item
 
 
+def select_coin(coins):
+    """Select a coin by name from engine coin ids.
+
+    Args:
+        coins: Iterable of engine coin ids.
+
+    Returns:
+        Coin id selected.
+    """
+    return COIN_IDS[select_from_list(coin_names(coins))]
+
+
 def select_player(players, exclude=None):
     """Select a player from list of player objects.
 
@@ -495,34 +307,31 @@ def hide_previous(lines=5):
     print(f'{"* hidden " * 10}*\n' * lines)
 
 
-def validate_state(players, pile, coin=None):
+def validate_state(state):
     """Checks if all coins are accounted for/duplicates/
 
     This is only for debugging.
 
     Args:
-        players: Players list of all player objects
-        pile: Pile object.
+        state: engine.GameState to check.
 
     Returns:
         True for consistent, False otherwise, with notes.
     """
     coins = []
-    if coin:
-        coins.append(coin)
-    for player in players:
-        if player.larder:
-            coins.append(player.larder)
-        if player.coins:
-            coins += player.coins
-    if pile.coins:
-        coins += pile.coins
-    if pile.in_play:
-        coins += pile.in_play
+    for hand, larder in zip(state.hands, state.larders):
+        if larder >= 0:
+            coins.append(larder)
+        coins += hand
+    coins += state.pile
+    coins += state.in_play
+    coins = coin_names(coins)
     print(f'Coins found: {coins}')
-    status = len(coins) == len(COINS)
+    status = len(coins) + len(state.removed) == len(COINS)
     if not status:
         print('*' * 50)
+        for coin2 in coin_names(state.removed):
+            coins.append(coin2)
         for coin2 in COINS:
             try:
                 coins.remove(coin2)
@@ -534,6 +343,21 @@ def validate_state(players, pile, coin=None):
     return status
 
 
+def seat_list(text):
+    """Parse the --computer flag.
+
+    Args:
+        text: Comma separated seat numbers, e.g. '2,3'.
+
+    Returns:
+        Set of seat numbers, counting from 1.
+    """
+    try:
+        return {int(seat) for seat in text.split(',') if seat.strip()}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'not a list of seats: {text!r}')
+
+
 def parse_args():
     """Augment argument parser with script-specific options.
 
@@ -567,247 +391,427 @@ def parse_args():
     parser.add_argument(
         '-d', '--debug', action='store_true',
         help='Set debug mode.')
+
+    parser.add_argument(
+        '--simulate', default=0, type=int, metavar='N',
+        help='Play N games between computer players instead.')
+    parser.add_argument(
+        '--policy', default='random',
+        help='Computer player(s) for --simulate and --computer: one policy'
+            ' for every seat'
+            ' or comma separated policies per seat;'
+            f' choose from {", ".join(sorted(policies.POLICIES))}.')
+    parser.add_argument(
+        '--seed', default=None, type=int,
+        help='Seed for --simulate and --solve (random if not given).')
+    parser.add_argument(
+        '--workers', default=os.cpu_count(), type=int,
+        help='Number of processes for --simulate.')
+    parser.add_argument(
+        '--batch', action='store_true',
+        help='Simulate with the NumPy lockstep simulator (needs NumPy;'
+            ' random, first and greedy policies only).')
+    parser.add_argument(
+        '--log', default=None, metavar='FILE',
+        help='Write every event as a line of JSON to FILE (with'
+            ' --simulate, of every game, played in one process).')
+    parser.add_argument(
+        '--record', default=None, metavar='FILE',
+        help='Append the game (with --simulate, every game) to the binary'
+            ' record file FILE (see replay.py).')
+    parser.add_argument(
+        '--variant', default=None, metavar='FILE',
+        help='Simulate with the coin effects of the variant file FILE'
+            ' (see variants.py).')
+    parser.add_argument(
+        '--store', default=None, metavar='DIR',
+        help='Append the result of every --simulate game to the columnar'
+            ' results store DIR (see results.py; needs NumPy).')
+    parser.add_argument(
+        '-q', '--quiet', action='store_true',
+        help='Do not show the game on the terminal, e.g. when the computer'
+            ' plays every seat.')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Time every coin effect, count pile operations and show a'
+            ' summary at the end (see instrument.py).')
+    parser.add_argument(
+        '--metrics', default=None, metavar='FILE',
+        help='Also write the --profile metrics to FILE in the Prometheus'
+            ' text format (rewritten periodically by --serve).')
+    parser.add_argument(
+        '--capture', default=0, type=int, metavar='TURNS',
+        help='Profile the first TURNS turns with cProfile and show the'
+            ' busiest functions.')
+    parser.add_argument(
+        '--sample', action='store_true',
+        help='Profile --capture with the sampling profiler instead.')
+    parser.add_argument(
+        '--capture-file', default=None, metavar='FILE',
+        help='Save the --capture profile to FILE (cProfile stats, or folded'
+            ' stacks with --sample).')
+    parser.add_argument(
+        '--computer', default='', type=seat_list, metavar='SEATS',
+        help='Comma separated seats (from 1) played by the computer, using'
+            ' the --policy of the seat.')
+    parser.add_argument(
+        '--undo', action='store_true',
+        help='Let the one person playing against --computer seats take'
+            ' back moves.')
+    parser.add_argument(
+        '--think', default=mcts.BUDGET, type=float, metavar='SECONDS',
+        help='Search time per decision of the ismcts policy.')
+    parser.add_argument(
+        '--search-workers', default=1, type=int,
+        help='Processes searching each decision of the ismcts policy.')
+    parser.add_argument(
+        '--tables', default=tablebot.TABLES, metavar='DIR',
+        help='Directory of the policy tables of the table policy'
+            ' (see tablebot.py).')
+    parser.add_argument(
+        '--serve', default=None, type=int, metavar='PORT',
+        help='Host games for network clients on a TCP port instead'
+            ' (see server.py).')
+    parser.add_argument(
+        '--host', default=server.HOST,
+        help='Address --serve listens on.')
+    parser.add_argument(
+        '--slab', default=None, metavar='FILE',
+        help='Hibernate idle --serve games to the memory-mapped slab file'
+            ' FILE, emptied first (see slab.py).')
+    parser.add_argument(
+        '--idle', default=server.IDLE, type=float, metavar='SECONDS',
+        help='Time without an action before a --serve game hibernates'
+            ' (with --slab).')
+    parser.add_argument(
+        '--hot', default=server.HOT, type=int, metavar='GAMES',
+        help='Most --serve games kept in memory (with --slab).')
+    parser.add_argument(
+        '--journal', default=None, metavar='FILE',
+        help='Write the --serve games and actions ahead to the journal'
+            ' FILE, and carry on with the games it holds (see journal.py).')
+    parser.add_argument(
+        '--fsync', default='group', choices=('group', 'action'),
+        help='Sync the --journal for groups of actions at once, or for'
+            ' every action.')
+    parser.add_argument(
+        '--group-window', default=server.WINDOW, type=float,
+        metavar='SECONDS',
+        help='Time gathering actions before each group commit of the'
+            ' --journal.')
+    parser.add_argument(
+        '--solve', default=0, type=int, metavar='N',
+        help='Solve N opening deals of a 2 player game with every coin'
+            ' visible instead.')
+    parser.add_argument(
+        '--depth', default=solver.DEPTH, type=int,
+        help='Deepest search of --solve, in decisions.')
+    parser.add_argument(
+        '--tt-size', default=solver.TABLE_SIZE, type=int,
+        help='Transposition table entries for --solve.')
+    parser.add_argument(
+        '--replacement', default='depth', choices=('depth', 'lru'),
+        help='Transposition table replacement policy for --solve.')
     args = parser.parse_args()
     return args
 
 
-def main():
-    """Does the work.
+def show_events(events, state, players, console):
+    """Tell the console player what happened, and the others via notes.
+
+    Args:
+        events: engine.Event tuple returned with the state.
+        state: engine.GameState after the events.
+        players: List of all player objects.
+        console: Seat of the player at the console, or None.
+
+    Returns:
+        Seat of the player at the console after the events.
     """
-    # Prepare players
-    players = []
-    for index in range(ARGS.players):
-        player = Player(NAME_BASE, index+1)
-        players.append(player)
-        hide_previous()
-    # Prepare pile
-    pile = Pile(remove=ARGS.remove)
-    # Distribute coins
-    for index in range(1, ARGS.coins):  # take into account drawn coin
-        print(f'Getting coin {index} for each player...')
-        for player in players:
-            player.add_coin(pile.get_coin())
-
-    p_index = len(players)
-    go_again = False
-    game_over = False
-    while not game_over:
-        if not go_again:
-            p_index += 1  # Increment current player
-            if p_index >= len(players):
-                p_index = 0
-            p_cur = players[p_index]
+    last_played = None
+    dealt = 0
+    for event in events:
+        human = console is None or players[console].human
+        kind = event.kind
+        p_cur = players[event.player] if event.player >= 0 else None
+        p_oth = players[event.target] if event.target >= 0 else None
+        coin = COIN_NAMES[event.coin] if event.coin >= 0 else None
+        if kind == engine.REMOVED:
+            print('Removed 1 coin prior to game start...')
+        elif kind == engine.DEALT:
+            if event.player == 0:
+                dealt += 1
+                print(f'Getting coin {dealt} for each player...')
+        elif kind == engine.TURN:
+            if console is not None and human:
+                print()
+                players[console].show_status(state, console)
+                show_coins(state)
+                input(f'{players[console].name}, press return to end your'
+                      ' turn.')
+            console = event.player
             p_cur.verify()
-            p_cur.show_status()
-        else:
+        elif kind == engine.AGAIN:
             print()
             print(f'{p_cur.name}, please go again.')
-            go_again = False
-        pile.show_coins('in_play')
-        print()
-        if ARGS.future and len(p_cur.coins) < ARGS.coins - 1 and pile.coins:
-            coin = pile.get_coin()
+        elif kind == engine.PADDED and human:
             print(f'Padding your hand with {coin}: {COINS[coin]}')
-            p_cur.add_coin(coin)
-        if not p_cur.larder:
-            coin = pile.get_coin()
-            if coin:
+        elif kind == engine.DREW:
+            if event.player == console and human:
                 print(f'You drew {coin}: {COINS[coin]}')
-                p_cur.add_coin(coin)
-        coin = p_cur.select_coin()
-        # Now determine the effects of each coin
-        while coin:
+            else:
+                p_cur.add_note(f'You drew replacement: {coin}')
+        elif kind == engine.LARDER_USED:
+            print(f'{p_cur.name} uses the coin in the larder.')
+        elif kind == engine.SKIPPED:
+            print(f'{p_cur.name} has no coins to play!  Skipping turn.')
+        elif kind == engine.PLAYED:
+            last_played = event.coin
             print()
-            print(f'You play {coin}: {COINS[coin]}.')
+            who = 'You play' if human else f'{p_cur.name} plays'
+            print(f'{who} {coin}: {COINS[coin]}.')
             add_notes(f'{p_cur.name} played {coin}', players, p_cur)
-            if coin == '[chest]':
-                # Take one more turn; hopefully you will get the key and win
-                go_again = True
-                pile.play_coin(coin)
-                coin = None
-            elif coin == '[key]':
-                # No effect; hopefully you will win the game if you play this
-                pile.play_coin(coin)
-                coin = None
-            elif coin == '[arrow]':
-                # Bury an opponent's coin under the pile, if they have one
-                pile.play_coin(coin)
-                p_oth = select_player(players, p_cur)
-                if not p_oth.shield:
-                    ### choose opponent coin
-                    coin = p_oth.get_coin()
-                    if coin:
-                        pile.bury_coin(coin)
-                        print("You bury your opponent's coin in the pile.")
-                        ### Should we show the player which coin it was?  No...
-                        p_oth.add_note(f'{p_cur.name} buried your {coin}')
-                        coin = pile.get_coin()
-                        p_oth.add_note(f'You drew replacement: {coin}')
-                        p_oth.add_coin(coin)
-                else:
-                    print(f'{p_oth.name} is shielded!')
-                coin = None
-            elif coin == '[boots]':
-                # Play this then the top coin from pile immediately
-                pile.play_coin(coin)
-                print('You play the next coin on the pile immediately(!)')
-                coin = pile.get_coin()
-            elif coin == '[coin_purse]':
-                # Draw new coin and put one in your hand on top of the pile
-                pile.play_coin(coin)
-                coin = pile.get_coin()
-                if coin:
-                    print(f'You drew {coin}: {COINS[coin]}')
-                    p_cur.add_coin(coin)
-                if p_cur.coins:
-                    print('Now select a coin to put back on top of the pile.')
-                    coin = select_from_list(p_cur.coins)
-                    print(f'You put {coin} back on top of the pile.')
-                    pile.put_coin(coin)
-                coin = None
-            elif coin == '[ham_hock]':
-                # Draw new coin and put it into your larder for one turn
-                pile.play_coin(coin)
-                print('You draw another coin for your larder.')
-                coin = pile.get_coin()
-                if coin:
-                    p_cur.add_larder(coin)
-                coin = None
-            elif coin == '[knife]':
-                # Trade coins with an opponent, if they have one
-                pile.play_coin(coin)
-                p_oth = select_player(players, p_cur)
-                if not p_oth.shield:
-                    if len(p_cur.coins) > 1:
-                        print('Which one of your coins do you want to trade?')
-                    coin = p_cur.get_coin(by_name=True)
-                    ### choose opponent coin
-                    coin2 = p_oth.get_coin()
-                    print(f'You trade {coin} for {coin2}')
-                    p_oth.add_note(f'{p_cur.name} traded {coin2} for {coin}')
-                    if coin2:
-                        p_cur.add_coin(coin2)
-                    if coin:
-                        p_oth.add_coin(coin)
-                else:
-                    print(f'{p_oth.name} is shielded!')
-                coin = coin2 = None
-            elif coin == '[lantern]':
-                # Look at top two coins in pile, returning them in any order
-                pile.play_coin(coin)
-                coins = []
-                for index in range(2):
-                    coin = pile.get_coin()
-                    if coin:
-                        print(f'  Coin {index+1} is: {coin}: {COINS[coin]}')
-                        coins.append(coin)
-                if len(coins) > 1:
-                    print('Now choose the order to put them back on top.')
-                    print('Which coin should be put on top first?')
-                    print('(other coin will be placed on top of that one.)')
-                elif len(coins) == 1:
-                    print('There is only one coin left; it will be put back.')
-                if coins:
-                    coin = select_from_list(coins)
-                    coins.insert(0, coin)
-                    for coin in coins:
-                        pile.put_coin(coin)
-                else:
-                    print('There were no coins in the pile to see!')
-                coin = None
-            elif coin == '[mirror]':
-                # Re-use any coin in play, if there are any
-                if pile.in_play:
-                    coin2 = select_from_list(pile.in_play)
-                else:
-                    print('There are no coins in play!')
-                    coin2 = None
-                pile.play_coin(coin)
-                coin = coin2
-            elif coin == '[raven]':
-                # Look at an opponent's coin, if they have one
-                pile.play_coin(coin)
-                p_oth = select_player(players, p_cur)
-                if not p_oth.shield:
-                    ### show opponent coin
-                    p_oth.show_coin()
-                    p_oth.add_note(f'{p_cur.name} saw your hand')
-                else:
-                    print(f'{p_oth.name} is shielded!')
-                coin = None
-            elif coin == '[rope]':
-                # Look at bottom coin of pile and optionally move it to the top
-                pile.play_coin(coin)
-                if pile.coins:
-                    bottom = pile.coins[-1]
-                    print(f'Bottom of pile: {bottom}: {COINS[bottom]}')
-                    answer = input(f'Move {bottom} to the top of pile? (y/n) ')
-                    if answer.lower() in ('y', 'yes'):
-                        pile.remove_coin(bottom)
-                        pile.put_coin(bottom)
-                else:
-                    print('There are no coins in the pile!')
-                coin = None
-            elif coin == '[shield]':
-                # Protects player from effects of coins except wind, shovel
-                pile.play_coin(coin)
-                p_cur.enable_shield()
-                coin = None
-            elif coin == '[shovel]':
-                # Bury a coin in play under pile, removing its effect
-                print('Which in-play coin would you like to bury?')
-                coin2 = select_from_list(pile.in_play)
-                pile.play_coin(coin)
-                if coin2:
-                    print(f'You bury {coin2}: {COINS[coin2]}')
-                    pile.bury_coin(coin2)
-                    if coin2 == '[shield]':
-                        for player in players:
-                            player.disable_shield()
-                    add_notes(f'{p_cur.name} buried {coin2}', players, p_cur)
-                else:
-                    print('There are no coins in play!')
-                coin = None
-            elif coin == '[sickle]':
-                # Put an opponent's coin in play without any effect
-                pile.play_coin(coin)
-                p_oth = select_player(players, p_cur)
-                if not p_oth.shield:
-                    ### choose opponent coin
-                    coin = p_oth.get_coin()
-                    if coin:
-                        print(f"You kill {p_oth.name}'s coin: {coin}")
-                        pile.play_coin(coin)
-                        p_oth.add_note(f'{p_cur.name} killed your {coin}')
-                        coin = pile.get_coin()
-                        if coin:
-                            p_oth.add_note(f'You drew replacement: {coin}')
-                            p_oth.add_coin(coin)
-                else:
-                    print(f'{p_oth.name} is shielded!')
-                coin = None
-            elif coin == '[wind]':
-                # Shuffle all coins in play into the pile (except wind)
-                pile.reintegrate()
-                pile.shuffle_coins()
-                pile.play_coin(coin)
-                for player in players:
-                    player.disable_shield()
-                coin = None
-            if ARGS.debug:
-                validate_state(players, pile, coin)
-
-        if pile.unlock_chest():
+        elif kind == engine.SHIELDED:
+            print(f'{p_oth.name} is shielded!')
+        elif kind == engine.BURIED and p_oth:
+            if human:
+                print("You bury your opponent's coin in the pile.")
+            else:
+                print(f"{p_cur.name} buries {p_oth.name}'s coin in the pile.")
+            p_oth.add_note(f'{p_cur.name} buried your {coin}')
+        elif kind == engine.BURIED:
+            who = 'You bury' if human else f'{p_cur.name} buries'
+            print(f'{who} {coin}: {COINS[coin]}')
+            add_notes(f'{p_cur.name} buried {coin}', players, p_cur)
+        elif kind == engine.KILLED:
+            who = 'You kill' if human else f'{p_cur.name} kills'
+            print(f"{who} {p_oth.name}'s coin: {coin}")
+            p_oth.add_note(f'{p_cur.name} killed your {coin}')
+        elif kind == engine.TRADED:
+            coin2 = COIN_NAMES[event.other] if event.other >= 0 else None
+            if human:
+                print(f'You trade {coin} for {coin2}')
+            else:
+                print(f'{p_cur.name} trades coins with {p_oth.name}')
+            p_oth.add_note(f'{p_cur.name} traded {coin2} for {coin}')
+        elif kind == engine.SAW and p_oth:
+            if human:
+                print(f'{p_oth.name} has {coin}: {COINS[coin]}')
+            else:
+                print(f"{p_cur.name} looks at {p_oth.name}'s coin")
+            p_oth.add_note(f'{p_cur.name} saw your hand')
+        elif kind == engine.SAW and not human:
+            print(f'{p_cur.name} looks at coin {event.other+1} of the pile')
+        elif kind == engine.SAW and last_played == engine.ROPE:
+            print(f'Bottom of pile: {coin}: {COINS[coin]}')
+        elif kind == engine.SAW:
+            print(f'  Coin {event.other+1} is: {coin}: {COINS[coin]}')
+        elif kind == engine.PUT_BACK:
+            if human:
+                print(f'You put {coin} back on top of the pile.')
+            else:
+                print(f'{p_cur.name} puts a coin back on top of the pile.')
+        elif kind == engine.STORED:
+            stored = coin if human else 'A coin'
+            print(f"{stored} added to {p_cur.name}'s larder.")
+        elif kind == engine.ROPED:
+            if human:
+                print('You move it to the top of the pile.')
+            else:
+                print(f'{p_cur.name} moves the bottom coin to the top.')
+        elif kind == engine.SHIELD_ON:
+            print(f'{p_cur.name} has enabled shield!')
+        elif kind == engine.SHIELD_OFF:
+            print(f'{p_cur.name} has shield removed!')
+        elif kind == engine.SHUFFLED:
+            print('The coins in play are shuffled into the pile.')
+        elif kind == engine.WON:
             print(f'*** {p_cur.name} wins! ***')
-            game_over = True
-        elif not go_again:
-            print()
-            p_cur.show_status()
-            pile.show_coins('in_play')
-            input(f'{p_cur.name}, press return to end your turn.')
+    return console
+
+
+class Terminal(stream.Renderer):
+    """Renders the events for the people taking turns at the console.
+    """
+    def __init__(self, players):
+        """Create the console renderer.
+
+        Args:
+            players: List of all player objects.
+        """
+        self.players = players
+        self.console = None  # Seat of the player at the console
+
+    def render(self, events, state):
+        self.console = show_events(events, state, self.players, self.console)
+
+
+def ask(state, players, undo=False):
+    """Ask the console player to answer the pending decision.
+
+    Args:
+        state: engine.GameState waiting on a decision.
+        players: List of all player objects.
+        undo: Also offer to undo the last move when choosing a coin.
+
+    Returns:
+        Action for engine.apply(), or UNDO.
+    """
+    decision = state.pending[0]
+    seat = state.current
+    options = engine.legal_actions(state)
+    if decision == engine.PLAY:
+        players[seat].show_status(state, seat)
+        show_coins(state)
+        print()
+        if undo:
+            print('Which coin would you like to play?')
+            choices = {SKIP if coin == engine.NONE else COIN_NAMES[coin]:
+                       coin for coin in options}
+            answer = select_from_list(list(choices) + [UNDO])
+            action = UNDO if answer == UNDO else choices[answer]
+        elif len(options) > 1:
+            print('Which coin would you like to play?')
+            action = select_coin(options)
+        else:
+            action = options[0]
+    elif decision == engine.TARGET:
+        player = select_player(players, players[seat])
+        action = players.index(player)
+    elif decision == engine.OPP_COIN:
+        print(f"Which of {players[state.pending[2]].name}'s coins do you"
+              ' want index of?')
+        action = select_from_list([index+1 for index in options]) - 1
+    elif decision == engine.GIVE:
+        print('Which one of your coins do you want to trade?')
+        action = select_coin(options)
+    elif decision == engine.PURSE:
+        print('Now select a coin to put back on top of the pile.')
+        action = select_coin(options)
+    elif decision == engine.LANTERN_ORDER:
+        print('Now choose the order to put them back on top.')
+        print('Which coin should be put on top first?')
+        print('(other coin will be placed on top of that one.)')
+        first = select_coin(options)
+        action = options[0] if first == options[1] else options[1]
+    elif decision == engine.ROPE_MOVE:
+        bottom = COIN_NAMES[state.pile[-1]]
+        answer = input(f'Move {bottom} to the top of pile? (y/n) ')
+        action = int(answer.lower() in ('y', 'yes'))
+    elif decision == engine.MIRROR_PICK:
+        print('Which in-play coin would you like to copy?')
+        action = select_coin(options)
+    else:  # engine.SHOVEL_PICK
+        print('Which in-play coin would you like to bury?')
+        action = select_coin(options)
+    return action
+
+
+def main():
+    """Does the work.
+    """
+    # Prepare players
+    seats = policies.seat_policies(ARGS.policy, ARGS.players,
+                                   budget=ARGS.think,
+                                   workers=ARGS.search_workers,
+                                   tables=ARGS.tables)
+    if ARGS.undo and len(ARGS.computer) != ARGS.players - 1:
+        raise SystemExit('--undo needs every seat but one played by'
+                         ' --computer')
+    if ARGS.undo and (ARGS.record or ARGS.log):
+        raise SystemExit('--undo cannot be used with --record or --log')
+    players = []
+    for index in range(ARGS.players):
+        if index + 1 in ARGS.computer:
+            player = Computer(index, seats[index])
+        else:
+            player = Player(NAME_BASE, index+1)
+            hide_previous()
+        players.append(player)
+    # Prepare pile, distribute coins and play until somebody wins
+    # (--debug checks every coin move as it happens; see engine.Table)
+    metrics = instrument.METRICS if ARGS.profile or ARGS.metrics else None
+    table_class = instrument.ProfiledTable if metrics else engine.Table
+    capture = (instrument.Capture(ARGS.capture, ARGS.sample,
+                                  ARGS.capture_file)
+               if ARGS.capture else None)
+    state, events = engine.new_game(
+        players=ARGS.players, coins=ARGS.coins, remove=ARGS.remove,
+        future=ARGS.future, check=ARGS.debug, table_class=table_class)
+    if ARGS.debug:
+        validate_state(state)
+    computers = [player for player in players if not player.human]
+    for player in computers:
+        player.policy.start(players.index(player), state, random.Random())
+        player.policy.observe(events)
+    steps = [(state, events)]  # Each state and the events leading to it
+    moves = []  # Where in steps the person chose each coin, for --undo
+    bus = stream.Bus(stream.NullSink() if ARGS.quiet else Terminal(players))
+    if ARGS.log:
+        bus.subscribe(stream.JsonLines(open(ARGS.log, 'w')))
+    bus.publish(events, state)
+    recorder = replay.Recorder(state) if ARGS.record else None
+    waited = time.perf_counter()  # Everything outside the engine is waiting
+    while state.pending[0] != engine.DONE:
+        player = players[state.current]
+        if player.human:
+            action = ask(state, players, ARGS.undo and bool(moves))
+            if action == UNDO:
+                del steps[moves.pop() + 1:]
+                state = steps[-1][0]
+                for computer in computers:  # Tell them the game again
+                    computer.policy.start(players.index(computer),
+                                          steps[0][0], random.Random())
+                    for _, events in steps:
+                        computer.policy.observe(events)
+                print()
+                print('Your last move was taken back.')
+                continue
+            if state.pending[0] == engine.PLAY:
+                moves.append(len(steps) - 1)
+        else:
+            action = player.policy.act(state)
+        seed = state.seed
+        stepped = time.perf_counter()
+        state, events = engine.apply(state, action, check=ARGS.debug,
+                                     table_class=table_class)
+        if metrics:
+            now = time.perf_counter()
+            metrics.observe(instrument.WAIT, stepped - waited)
+            metrics.observe(instrument.STEP, now - stepped)
+            waited = now
+        if capture:
+            capture.observe(events)
+        if recorder:
+            recorder.add(action, seed, state)
+        if ARGS.undo:
+            steps.append((state, events))
+        for player in computers:
+            player.policy.observe(events)
+        bus.publish(events, state)
+    bus.close()
+    if recorder:
+        archive = replay.Archive(ARGS.record)
+        archive.write(recorder)
+        archive.close()
+    for player in computers:
+        player.policy.close()
+    if capture:
+        capture.stop()
+    if metrics:
+        metrics.summary()
+        if ARGS.metrics:
+            metrics.write(ARGS.metrics)
     print('Thanks for playing.')
 
 
 if __name__ == '__main__':
     ARGS = parse_args()
-    main()
+    if ARGS.simulate:
+        simulate.main(ARGS)
+    elif ARGS.serve is not None:
+        server.main(ARGS)
+    elif ARGS.solve:
+        solver.main(ARGS)
+    else:
+        main()
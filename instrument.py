@@ -0,0 +1,428 @@
+"""Where the time of a game goes: counters, histograms and profiles.
+
+Nothing here costs anything unless asked for.  With --profile, drivers
+play on ProfiledTable instead of engine.Table; it times every coin effect
+and counts pile operations, wind shuffles and turns into METRICS, and the
+driver adds the time spent waiting on players against the time spent in
+the engine.  METRICS prints as a summary table or exports as Prometheus
+text.
+
+Capture runs cProfile, or a sampling profiler, over the first turns played
+only, e.g. to look at the opening of games without the noise of a whole
+run.
+"""
+import bisect
+import collections
+import cProfile
+import io
+import os
+import pstats
+import signal
+import sys
+import time
+
+import engine
+from engine import NONE
+
+
+PREFIX = 'grackle_'  # Prefix of the exported metric names
+SECONDS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3,
+           1e-2, 0.1, 1.0, 10.0, 60.0)  # Histogram buckets of durations
+TURNS = (5, 10, 15, 20, 25, 30, 40, 50, 75, 100, 200, 500)  # Game lengths
+SAMPLE_INTERVAL = 0.001  # Seconds of CPU time between profile samples
+TOP = 25  # Functions shown of a captured profile
+WRITE_EVERY = 10.0  # Seconds between rewrites of a served metrics file
+
+HELP = {
+    'effect_seconds': ('histogram', 'Time resolving a coin effect, with the'
+                       ' decisions it asked for.'),
+    'turn_seconds': ('histogram', 'Time moving on to the next decision:'
+                     ' turn changes and draws.'),
+    'step_seconds': ('histogram', 'Engine time per decision.'),
+    'wait_seconds': ('histogram', 'Time waiting on a player to decide.'),
+    'turns_per_game': ('histogram', 'Turns of finished games.'),
+    'pile_operations_total': ('counter', 'Coins taken from or put on the'
+                              ' pile.'),
+    'wind_shuffles_total': ('counter', 'Times the wind shuffled the coins'
+                            ' in play into the pile.'),
+    'games_total': ('counter', 'Finished games.'),
+    }
+
+
+def key(name, **labels):
+    """Key of a metric: its name and sorted labels.
+
+    Hot paths build their keys once, ahead of time.
+    """
+    return name, tuple(sorted(labels.items()))
+
+
+class Histogram:
+    """Counts of values in fixed buckets, with their sum.
+    """
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds):
+        """Empty histogram.
+
+        Args:
+            bounds: Ascending upper bounds of the buckets; values above the
+                last one fall into an extra bucket.
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Count a value.
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def merge(self, other):
+        """Add the counts of a histogram with the same bounds.
+        """
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.count += other.count
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket a fraction of the values are in.
+
+        Returns:
+            Bound, inf past the last bucket, 0 without values.
+        """
+        wanted = fraction * self.count
+        seen = 0
+        for bound, count in zip((*self.bounds, float('inf')), self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return bound
+        return 0.0
+
+
+class Metrics:
+    """Counters and histograms by key (see key()); mergeable and picklable.
+    """
+    def __init__(self):
+        """No metrics yet.
+        """
+        self.counters = collections.Counter()
+        self.histograms = {}
+
+    def add(self, name_key, amount=1):
+        """Increase a counter.
+        """
+        self.counters[name_key] += amount
+
+    def observe(self, name_key, value, bounds=SECONDS):
+        """Count a value into a histogram, created with the bounds.
+        """
+        histogram = self.histograms.get(name_key)
+        if histogram is None:
+            histogram = self.histograms[name_key] = Histogram(bounds)
+        histogram.observe(value)
+
+    def merge(self, other):
+        """Add the metrics of another Metrics, e.g. of a worker process.
+        """
+        self.counters.update(other.counters)
+        for name_key, histogram in other.histograms.items():
+            if name_key in self.histograms:
+                self.histograms[name_key].merge(histogram)
+            else:
+                self.histograms[name_key] = histogram
+
+    def take(self):
+        """Hand over the metrics so far and start again from nothing.
+
+        Returns:
+            Metrics.
+        """
+        taken = Metrics()
+        taken.counters, self.counters = self.counters, collections.Counter()
+        taken.histograms, self.histograms = self.histograms, {}
+        return taken
+
+    def total(self, name):
+        """Sum of a counter over all its labels.
+        """
+        return sum(count for (counter, _), count in self.counters.items()
+                   if counter == name)
+
+    def summary(self, out=sys.stdout):
+        """Print the metrics as tables for people.
+        """
+        games = self.total('games_total')
+        per_game = max(games, 1)
+        print(f'Games finished: {games}', file=out)
+        turns = self.histograms.get(key('turns_per_game'))
+        if turns and turns.count:
+            print(f'Turns per game: mean {turns.total/turns.count:.1f},'
+                  f' p50 <= {turns.quantile(0.5):g},'
+                  f' p90 <= {turns.quantile(0.9):g}', file=out)
+        step = self.histograms.get(key('step_seconds'))
+        wait = self.histograms.get(key('wait_seconds'))
+        if step and wait:
+            busy = step.total + wait.total or 1.0
+            print(f'Engine {step.total:.3f}s ({step.total/busy:.1%}),'
+                  f' waiting on players {wait.total:.3f}s'
+                  f' ({wait.total/busy:.1%})'
+                  f' over {step.count} decisions', file=out)
+        print(f'{"Effect":<16} {"Count":>9} {"Mean us":>9} {"p50 us":>8}'
+              f' {"p99 us":>8} {"Total ms":>10}', file=out)
+        effects = sorted(
+            ((dict(labels).get('coin', '(turns)'), histogram)
+             for (name, labels), histogram in self.histograms.items()
+             if name in ('effect_seconds', 'turn_seconds')),
+            key=lambda item: -item[1].total)
+        for label, histogram in effects:
+            mean = histogram.total / max(histogram.count, 1)
+            print(f'{label:<16} {histogram.count:>9}'
+                  f' {mean*1e6:>9.1f}'
+                  f' {histogram.quantile(0.5)*1e6:>8g}'
+                  f' {histogram.quantile(0.99)*1e6:>8g}'
+                  f' {histogram.total*1e3:>10.1f}', file=out)
+        operations = sorted(
+            (dict(labels)['op'], count)
+            for (name, labels), count in self.counters.items()
+            if name == 'pile_operations_total')
+        if operations:
+            print('Pile operations per game: ' + ', '.join(
+                f'{op} {count/per_game:.1f}' for op, count in operations),
+                  file=out)
+        shuffles = self.total('wind_shuffles_total')
+        print(f'Wind shuffles: {shuffles} ({shuffles/per_game:.2f} per'
+              f' game)', file=out)
+
+    def exposition(self):
+        """The metrics in the Prometheus text exposition format.
+
+        Returns:
+            str.
+        """
+        lines = []
+        names = sorted({name for name, _ in self.counters}
+                       | {name for name, _ in self.histograms})
+        for name in names:
+            kind, text = HELP.get(name, ('untyped', name))
+            full = PREFIX + name
+            lines.append(f'# HELP {full} {text}')
+            lines.append(f'# TYPE {full} {kind}')
+            for (counter, labels), count in sorted(self.counters.items()):
+                if counter == name:
+                    lines.append(f'{full}{_labels(labels)} {count}')
+            for (histogram_name, labels), histogram in sorted(
+                    self.histograms.items()):
+                if histogram_name != name:
+                    continue
+                seen = 0
+                for bound, count in zip((*histogram.bounds, '+Inf'),
+                                        histogram.counts):
+                    seen += count
+                    lines.append(f'{full}_bucket'
+                                 f'{_labels(labels, le=bound)} {seen}')
+                lines.append(f'{full}_sum{_labels(labels)}'
+                             f' {histogram.total!r}')
+                lines.append(f'{full}_count{_labels(labels)}'
+                             f' {histogram.count}')
+        lines.append('')
+        return '\n'.join(lines)
+
+    def write(self, path):
+        """Write the exposition to a file, replacing it atomically, e.g.
+        for the textfile collector of the Prometheus node exporter.
+        """
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as out:
+            out.write(self.exposition())
+        os.replace(temporary, path)
+
+
+def _labels(labels, le=None):
+    """Label set of an exposition line.
+    """
+    pairs = [f'{name}="{value}"' for name, value in labels]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+METRICS = Metrics()  # Metrics of this process
+
+_EFFECT = tuple(key('effect_seconds', coin=name.strip('[]'))
+                for name in engine.COIN_NAMES)
+_TURN = key('turn_seconds')
+_TAKE_TOP = key('pile_operations_total', op='take_top')
+_PUT_TOP = key('pile_operations_total', op='put_top')
+_PUT_BOTTOM = key('pile_operations_total', op='put_bottom')
+_SHUFFLES = key('wind_shuffles_total')
+_GAMES = key('games_total')
+_TURNS = key('turns_per_game')
+STEP = key('step_seconds')
+WAIT = key('wait_seconds')
+
+
+class ProfiledTable(engine.Table):
+    """Table recording metrics of everything it does into METRICS.
+
+    A decision is charged to the coin whose effect it resolves (the coin
+    played, or the one that asked for a target, a pick, ...), except for
+    the time moving on to the next decision, which is charged to turns.
+    Effects of coins played by the boots count within the boots too.
+    """
+    __slots__ = ('settling',)
+    metrics = METRICS
+
+    def decide(self, action):
+        pending = self.pending
+        decision = pending[0]
+        if decision == engine.PLAY:
+            coin = action
+        elif decision in (engine.TARGET, engine.OPP_COIN):
+            coin = pending[1]
+        else:  # The coin asking is the last one played
+            coin = self.in_play[-1]
+        self.settling = 0.0
+        began = time.perf_counter()
+        super().decide(action)
+        elapsed = time.perf_counter() - began
+        if coin != NONE:
+            self.metrics.observe(_EFFECT[coin], elapsed - self.settling)
+
+    def settle(self):
+        began = time.perf_counter()
+        super().settle()
+        self.settling = time.perf_counter() - began
+        metrics = self.metrics
+        metrics.observe(_TURN, self.settling)
+        if self.pending[0] == engine.DONE:
+            metrics.add(_GAMES)
+            metrics.observe(_TURNS, self.turn, TURNS)
+
+    def pop_top(self, destination):
+        self.metrics.counters[_TAKE_TOP] += 1
+        return super().pop_top(destination)
+
+    def push_top(self, coin, source):
+        self.metrics.counters[_PUT_TOP] += 1
+        super().push_top(coin, source)
+
+    def push_bottom(self, coin, source):
+        self.metrics.counters[_PUT_BOTTOM] += 1
+        super().push_bottom(coin, source)
+
+    def shuffle(self, kept=engine.WIND):
+        self.metrics.counters[_SHUFFLES] += 1
+        super().shuffle(kept)
+
+
+class Capture:
+    """Profile of the first turns played, by cProfile or by sampling.
+
+    The sampling profiler interrupts the process every SAMPLE_INTERVAL
+    seconds of CPU time and counts the stack it was in; it disturbs the
+    timing much less than cProfile, but needs Unix signals.
+    """
+    def __init__(self, turns, sampling=False, path=None, out=sys.stderr):
+        """Start profiling.
+
+        Args:
+            turns: Turns to profile, over all games, then stop.
+            sampling: Sample stacks instead of running cProfile.
+            path: File to save the profile to when done (cProfile stats,
+                or folded stacks for flame graph tools), if any.
+            out: Text file for the report.
+
+        Raises:
+            ValueError: sampling is not available on this platform.
+        """
+        self.left = turns
+        self.path = path
+        self.out = out
+        self.samples = None
+        self.profiler = None
+        if sampling:
+            if not hasattr(signal, 'setitimer'):
+                raise ValueError('Sampling needs Unix interval timers')
+            self.samples = collections.Counter()
+            signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, SAMPLE_INTERVAL,
+                             SAMPLE_INTERVAL)
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @property
+    def active(self):
+        """Whether turns are still being profiled."""
+        return self.left > 0
+
+    def _sample(self, number, frame):
+        """SIGPROF handler: count the interrupted stack.
+        """
+        del number
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:'
+                         f'{code.co_name}')
+            frame = frame.f_back
+        self.samples[';'.join(reversed(stack))] += 1
+
+    def observe(self, events):
+        """Count the turns started in a step; stop after the last one.
+
+        Args:
+            events: Sequence of engine.Event.
+        """
+        if self.left <= 0:
+            return
+        for event in events:
+            if event.kind in (engine.TURN, engine.AGAIN):
+                self.left -= 1
+        if self.left <= 0:
+            self.stop()
+
+    def stop(self):
+        """Stop profiling and report, if not done yet.
+        """
+        self.left = 0
+        if self.profiler:
+            self.profiler.disable()
+            text = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=text)
+            stats.sort_stats('cumulative').print_stats(TOP)
+            print(text.getvalue(), file=self.out)
+            if self.path:
+                stats.dump_stats(self.path)
+            self.profiler = None
+        elif self.samples is not None:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+            self.report()
+            self.samples = None
+
+    def report(self):
+        """Print the functions most samples were in, and save the stacks.
+        """
+        total = sum(self.samples.values()) or 1
+        own = collections.Counter()
+        within = collections.Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                within[frame] += count
+        print(f'{total} samples every {SAMPLE_INTERVAL*1e3:g} ms of CPU',
+              file=self.out)
+        print(f'{"Own":>7} {"Within":>7}  Function', file=self.out)
+        for frame, count in within.most_common(TOP):
+            print(f'{own[frame]/total:>7.1%} {count/total:>7.1%}  {frame}',
+                  file=self.out)
+        if self.path:
+            with open(self.path, 'w') as out:
+                for stack, count in sorted(self.samples.items()):
+                    print(stack, count, file=out)
@@ -0,0 +1,228 @@
+"""Write-ahead journal of the game server, for recovery after a crash.
+
+Each game the server deals and each action it accepts is appended to the
+journal before anyone hears of it (see server.py): the state after the
+deal, then one record per action, since the rules step a state the same
+way every time.  A file holds
+
+    MAGIC, key        the key signing the server's tokens, so that the
+                      seats of recovered games keep their tokens
+    numbers           next table number, so finished games' numbers are
+                      not dealt again
+    records           kind, table number, length, data, CRC-32: STATE
+                      (a replay.encode() snapshot) or ACT (action + 1)
+
+The checkpoint is the start of the file: compaction writes the key and a
+STATE record of every live game to a new file, syncs it and renames it
+over the journal, which drops the records of finished games and the
+actions the snapshots include.  Recovery reads the checkpoint and replays
+the records after it; a record cut short by the crash, or failing its
+CRC, ends the journal there.
+
+Records are buffered and written and synced by commit(), which the server
+calls after every action or, with group commit, for every action taken
+while the last commit was syncing, so one fsync covers many tables.
+"""
+import os
+import struct
+import zlib
+
+import replay
+
+
+MAGIC = b'GRKJ\x02\x00\x00\x00'  # File signature and format version 2
+STATE, ACT = 1, 2  # Kinds of records
+KEY_BYTES = 16
+COMPACT_MIN = 1 << 26  # Bytes the journal may grow to before compacting
+COMPACT_GROWTH = 4  # Times the last checkpoint it may grow to, if larger
+_HEADER = struct.Struct(f'<{KEY_BYTES}sQ')  # key, next table number
+_RECORD = struct.Struct('<BIB')  # kind, table number, length
+_CRC = struct.Struct('<I')
+
+
+def record(kind, number, data):
+    """Bytes of one record.
+    """
+    head = _RECORD.pack(kind, number, len(data)) + data
+    return head + _CRC.pack(zlib.crc32(head))
+
+
+def checkpoint(key, numbers, snapshots):
+    """Contents of a compacted journal.
+
+    Args:
+        key: Key of the server.
+        numbers: Next table number.
+        snapshots: Iterable of (table number, replay.encode() bytes) of
+            every live game.
+
+    Returns:
+        bytes.
+    """
+    parts = [MAGIC, _HEADER.pack(key, numbers)]
+    parts.extend(record(STATE, number, bytes(data))
+                 for number, data in snapshots)
+    return b''.join(parts)
+
+
+def read(data):
+    """Games of a journal, as far as its records are whole.
+
+    Args:
+        data: bytes of the file.
+
+    Returns:
+        (key, next table number, games, length of the whole records):
+        games is a dict of table number: (snapshot, list of actions).
+
+    Raises:
+        ValueError: not a journal.
+    """
+    start = len(MAGIC) + _HEADER.size
+    if data[:len(MAGIC)] != MAGIC or len(data) < start:
+        raise ValueError('Not a journal of this version')
+    key, numbers = _HEADER.unpack_from(data, len(MAGIC))
+    games = {}
+    position = start
+    while position + _RECORD.size <= len(data):
+        kind, number, length = _RECORD.unpack_from(data, position)
+        end = position + _RECORD.size + length
+        if end + _CRC.size > len(data) or _CRC.unpack_from(data, end)[0] != (
+                zlib.crc32(data[position:end])):
+            break
+        payload = data[position + _RECORD.size:end]
+        if kind == STATE:
+            games[number] = (payload, [])
+        elif kind == ACT and number in games:
+            games[number][1].append(payload[0] - 1)
+        else:
+            break
+        numbers = max(numbers, number + 1)
+        position = end + _CRC.size
+    return key, numbers, games, position
+
+
+class Journal:
+    """Append-only file of the server's games and actions.
+    """
+    def __init__(self, path):
+        """Open a journal, creating an empty one with a new key if needed.
+
+        The games it holds are in `recovered` until the server takes them;
+        a torn record at the end is cut off.
+
+        Args:
+            path: File name.
+
+        Raises:
+            ValueError: the file is not a journal.
+        """
+        self.path = path
+        self.buffer = bytearray()  # Records not written yet
+        self.appended = 0  # Bytes of records ever buffered: their position
+        self.taken = 0  # Position of the end of the records taken
+        self.synced = 0  # Position up to which the records are on disk
+        if not os.path.exists(path):
+            self._replace(checkpoint(os.urandom(KEY_BYTES), 1, ()))
+        with open(path, 'rb') as existing:
+            data = existing.read()
+        self.key, self.numbers, self.recovered, length = read(data)
+        self.checkpointed = len(MAGIC) + _HEADER.size
+        # pylint: disable-next=consider-using-with
+        self.file = open(path, 'r+b')
+        if length < len(data):
+            self.file.truncate(length)
+            os.fsync(self.file.fileno())
+        self.file.seek(length)
+        self.size = length
+        self.syncs = 0
+
+    def state(self, number, table):
+        """Buffer the state of a game, e.g. after the deal.
+
+        Args:
+            number: Table number.
+            table: engine.Table or engine.GameState.
+        """
+        self._add(record(STATE, number, replay.encode(table)))
+
+    def act(self, number, action):
+        """Buffer an action of a game.
+        """
+        self._add(record(ACT, number, bytes((action + 1,))))
+
+    def _add(self, data):
+        """Buffer a record.
+        """
+        self.buffer += data
+        self.appended += len(data)
+
+    def take(self):
+        """Records buffered since the last call, to hand to commit().
+        """
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.taken = self.appended
+        return data
+
+    def commit(self, data):
+        """Append records and sync them to disk.
+
+        Blocks on the disk; the server calls it from a thread with group
+        commit.
+
+        Args:
+            data: bytes from take().
+        """
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size += len(data)
+        self.syncs += 1
+        self.synced = self.taken
+
+    def crowded(self):
+        """Whether the journal grew enough to be compacted.
+        """
+        return self.size > max(COMPACT_MIN,
+                               COMPACT_GROWTH * self.checkpointed)
+
+    def compact(self, data):
+        """Replace the journal by a checkpoint.
+
+        Records taken before the checkpoint was made need no commit: it
+        holds their games as they are now.  Blocks on the disk like
+        commit().
+
+        Args:
+            data: bytes from checkpoint(), of every live game.
+        """
+        self.file.close()
+        self._replace(data)
+        # pylint: disable-next=consider-using-with
+        self.file = open(self.path, 'r+b')
+        self.file.seek(len(data))
+        self.size = self.checkpointed = len(data)
+        self.syncs += 1
+        self.synced = self.taken
+
+    def _replace(self, data):
+        """Write a file in full and rename it over the journal.
+        """
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as new:
+            new.write(data)
+            new.flush()
+            os.fsync(new.fileno())
+        os.replace(temporary, self.path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)),
+                            os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def close(self):
+        """Close the file; records still buffered are lost.
+        """
+        self.file.close()
@@ -0,0 +1,351 @@
+"""Information set Monte Carlo tree search (ISMCTS) computer player.
+
+The player only uses what its seat has seen.  A belief.Belief follows the
+events of the game: coins seen with the raven, lantern and rope, coins
+traded, put back or buried in view, and where those coins went afterwards.
+Each iteration of the search deals every unseen coin at random to the
+places it could be (a determinization), then plays on in that world.  One tree
+per seat is shared by all determinizations (single observer ISMCTS);
+children are chosen by UCB weighted by how often they were available.
+
+Playouts are cut short after ROLLOUT_DEPTH decisions and scored by
+evaluate(), which keeps the iteration rate up without losing the endgame.
+The tree below the chosen action is kept for the next decision, and
+searches can be spread over processes (root parallelization).
+
+    python grackle.py --computer 2 --policy random,ismcts --think 2
+"""
+import math
+import multiprocessing
+import random
+import time
+
+import belief
+import engine
+import policies
+from engine import NONE, CHEST, KEY
+
+
+BUDGET = 1.0  # Default seconds of search per decision
+ROLLOUT_DEPTH = 8  # Decisions played at random before evaluate()
+EXPLORATION = 0.7  # UCB exploration constant
+CHECK_EVERY = 16  # Iterations between looks at the clock
+
+
+def evaluate(table):
+    """Rough chance of each seat winning an unfinished game.
+
+    A seat holding the chest or the key is closer to winning, more so when
+    the other one of the pair is already in play.
+
+    Args:
+        table: engine.Table.
+
+    Returns:
+        List of floats per seat, adding up to 1.
+    """
+    in_play = table.in_play
+    scores = []
+    for seat in range(table.players):
+        score = 1.0
+        held = list(table.hands[seat])
+        held.append(table.larders[seat])
+        for coin, other in ((CHEST, KEY), (KEY, CHEST)):
+            if coin in held:
+                score += 4.0 if other in in_play else 1.0
+        scores.append(score)
+    total = sum(scores)
+    return [score / total for score in scores]
+
+
+def rollout(table, rng, depth=ROLLOUT_DEPTH):
+    """Play on at random, taking a win when there is one.
+
+    Args:
+        table: engine.Table, played in place.
+        rng: random.Random.
+        depth: Decisions to play before evaluate().
+
+    Returns:
+        List of rewards per seat.
+    """
+    uniform = rng.random
+    for _ in range(depth):
+        if table.winner != NONE:
+            break
+        actions = table.legal_actions()
+        action = actions[0]
+        if len(actions) > 1:
+            action = actions[int(uniform() * len(actions))]
+            if table.pending[0] == engine.PLAY:
+                in_play = table.in_play
+                if CHEST in actions and KEY in in_play:
+                    action = CHEST
+                elif KEY in actions and CHEST in in_play:
+                    action = KEY
+        table.step(action)
+    if table.winner != NONE:
+        rewards = [0.0] * table.players
+        rewards[table.winner] = 1.0
+        return rewards
+    return evaluate(table)
+
+
+class _Playout(engine.Table):
+    """Table of a determinization: nobody reads its events, so skip them.
+
+    Every action comes from legal_actions(), so it is not checked again.
+    """
+    __slots__ = ()
+    trusted = True
+
+    def emit(self, kind, player, coin=NONE, target=NONE, other=NONE):
+        pass
+
+
+class Node:
+    """Node of the search tree, reached by an action of a player.
+    """
+    __slots__ = ('player', 'children', 'visits', 'reward', 'avails')
+
+    def __init__(self, player=NONE):
+        """Create an unvisited node.
+
+        Args:
+            player: Seat that took the action leading here.
+        """
+        self.player = player
+        self.children = {}  # action: Node
+        self.visits = 0
+        self.reward = 0.0  # Total reward of player
+        self.avails = 1  # Iterations in which the action was legal
+
+
+class Search:
+    """Single observer ISMCTS for one seat, keeping its tree between moves.
+    """
+    def __init__(self, rng, exploration=EXPLORATION, depth=ROLLOUT_DEPTH):
+        """Create a search with an empty tree.
+
+        Args:
+            rng: random.Random for determinizations and playouts.
+            exploration: UCB exploration constant.
+            depth: Decisions per playout before evaluate().
+        """
+        self.rng = rng
+        self.exploration = exploration
+        self.depth = depth
+        self.root = Node()
+        self.iterations = 0
+
+    def advance(self, actions):
+        """Move the root past the actions taken since the last search.
+
+        Args:
+            actions: Actions in order; None for one that was not seen,
+                which starts a fresh tree.
+        """
+        node = self.root
+        for action in actions:
+            node = node.children.get(action) if action is not None else None
+            if node is None:
+                break
+        self.root = node or Node()
+
+    def iterate(self, world):
+        """Run one iteration in a determinization.
+
+        Args:
+            world: engine.GameState.
+        """
+        rng = self.rng
+        table = _Playout(world)
+        node = self.root
+        path = [node]
+        while table.winner == NONE:
+            actions = table.legal_actions()
+            children = node.children
+            untried = []
+            for action in actions:
+                child = children.get(action)
+                if child is None:
+                    untried.append(action)
+                else:
+                    child.avails += 1
+            if untried:
+                action = rng.choice(untried)
+                node = children[action] = Node(table.current)
+                table.step(action)
+                path.append(node)
+                break
+            scale = self.exploration
+            best = -1.0
+            for action in actions:
+                child = children[action]
+                value = (child.reward / child.visits + scale
+                         * math.sqrt(math.log(child.avails) / child.visits))
+                if value > best:
+                    best, chosen = value, action
+            node = children[chosen]
+            table.step(chosen)
+            path.append(node)
+        rewards = rollout(table, rng, self.depth)
+        for node in path:
+            node.visits += 1
+            if node.player != NONE:
+                node.reward += rewards[node.player]
+        self.iterations += 1
+
+    def think(self, state, beliefs, budget=BUDGET, iterations=None):
+        """Search a decision.
+
+        Args:
+            state: engine.GameState or engine.Table of the real game.
+            beliefs: belief.Belief of the seat to move.
+            budget: Seconds to search for.
+            iterations: Stop after this many iterations instead, if given.
+
+        Returns:
+            Dict of legal action: visits at the root.
+        """
+        rng = self.rng
+        deadline = time.perf_counter() + budget
+        done = 0
+        while True:
+            if iterations is not None:
+                if done >= iterations:
+                    break
+            elif done % CHECK_EVERY == 0 and time.perf_counter() > deadline:
+                break
+            self.iterate(beliefs.sample(state, rng))
+            done += 1
+        children = self.root.children
+        return {action: children[action].visits if action in children else 0
+                for action in engine.legal_actions(state)}
+
+
+def _serve(connection, seed, exploration, depth):
+    """Worker process of a root parallel search: one Search, many requests.
+    """
+    search = Search(random.Random(seed), exploration, depth)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        trail, state, beliefs, budget, iterations = request
+        search.advance(trail)
+        connection.send(search.think(state, beliefs, budget, iterations))
+    connection.close()
+
+
+@policies.register
+class ISMCTSPolicy(policies.Policy):
+    """Searches every decision with ISMCTS for a fixed time.
+    """
+    name = 'ismcts'
+    options = ('budget', 'workers')
+
+    def __init__(self, budget=BUDGET, workers=1, iterations=None,
+                 exploration=EXPLORATION, depth=ROLLOUT_DEPTH):
+        """Create the player.
+
+        Args:
+            budget: Seconds of search per decision.
+            workers: Processes searching in parallel; their root visits are
+                added up (root parallelization).
+            iterations: Fixed number of iterations per decision (and per
+                worker) instead of the time budget.
+            exploration: UCB exploration constant.
+            depth: Decisions per playout before evaluate().
+        """
+        self.budget = budget
+        self.workers = workers
+        self.iterations = iterations
+        self.exploration = exploration
+        self.depth = depth
+        self.search = None
+        self.pool = []  # (process, connection) per worker
+        self.beliefs = self.trail = self.acted = None
+
+    def start(self, seat, state, rng):
+        super().start(seat, state, rng)
+        self.beliefs = belief.Belief(seat, state.players)
+        self.trail = []  # Actions since the last search
+        self.acted = None  # Our own action, until its events are observed
+        self.search = Search(rng, self.exploration, self.depth)
+        if self.workers > 1 and not self.pool:
+            for _ in range(self.workers):
+                mine, theirs = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=_serve, daemon=True,
+                    args=(theirs, rng.getrandbits(64), self.exploration,
+                          self.depth))
+                process.start()
+                self.pool.append((process, mine))
+
+    def observe(self, events):
+        if self.acted is not None:
+            self.trail.append(self.acted)
+            self.acted = None
+        else:
+            self.trail.append(seen_action(events))
+        self.beliefs.observe(events)
+
+    def act(self, state):
+        actions = engine.legal_actions(state)
+        if len(actions) == 1:
+            self.acted = actions[0]
+            return self.acted
+        if self.pool:
+            request = (self.trail, state_of(state), self.beliefs,
+                       self.budget, self.iterations)
+            for _, connection in self.pool:
+                connection.send(request)
+            visits = dict.fromkeys(actions, 0)
+            for _, connection in self.pool:
+                for action, count in connection.recv().items():
+                    visits[action] += count
+            action = max(actions, key=visits.__getitem__)
+        else:
+            self.search.advance(self.trail)
+            visits = self.search.think(state, self.beliefs, self.budget,
+                                       self.iterations)
+            action = max(actions, key=visits.__getitem__)
+        self.trail = []
+        self.acted = action
+        return action
+
+    def close(self):
+        for process, connection in self.pool:
+            connection.send(None)
+            process.join()
+        self.pool = []
+
+
+def seen_action(events):
+    """Action of another player, as far as its events show it.
+
+    Args:
+        events: Events of one step.
+
+    Returns:
+        The action, or None if the events do not reveal it.
+    """
+    if not events:
+        return None
+    first = events[0]
+    if first.kind in (engine.PLAYED, engine.LARDER_USED):
+        return first.coin  # PLAY, or MIRROR_PICK
+    if first.kind == engine.SKIPPED:
+        return NONE
+    if first.kind == engine.BURIED and first.target == NONE:
+        return first.coin  # SHOVEL_PICK
+    if first.kind == engine.ROPED:
+        return 1
+    return None
+
+
+def state_of(state):
+    """GameState of a state or table, to send to another process.
+    """
+    return state.freeze() if isinstance(state, engine.Table) else state
@@ -0,0 +1,346 @@
+"""Compact, hashable Grackle positions.
+
+A PackedState holds the same position as an engine.GameState in a handful
+of integers and a short bytes object, so search code can keep millions of
+them in transposition tables.
+
+- hands, larders: one 16 bit coin mask per seat, seat 0 in the low bits
+- in_play: coin mask of the field
+- pile: bytes of coin ids, top of the pile first
+- header: everything else (seats, flags, shields, pending decision)
+
+A position is what matters for play: the turn counter and the wind seed
+are left out, and coins in hands and in play are kept as sets.  Unpacking
+therefore gives hands and the field in coin id order, which also decides
+what OPP_COIN indexes refer to.  The one exception is the coin whose
+effect asks a GIVE, MIRROR_PICK or SHOVEL_PICK decision: the engine takes
+it to be the last coin played, so the header keeps it and unpacking puts
+it last on the field.
+"""
+import engine
+from engine import NONE, DECISIONS
+
+
+COIN_BITS = 16  # Width of one seat in hands and larders
+SEAT_MASK = (1 << COIN_BITS) - 1
+ALL_COINS = (1 << len(engine.COIN_NAMES)) - 1
+WIN_MASK = 1 << engine.CHEST | 1 << engine.KEY
+DECISION_CODES = {decision: code for code, decision in enumerate(DECISIONS)}
+# Decisions about the coin played last, found by the engine at in_play[-1]
+RESOLVING = (engine.GIVE, engine.MIRROR_PICK, engine.SHOVEL_PICK)
+
+# header layout: (shift, width)
+_PLAYERS = (0, 3)
+_HAND_SIZE = (3, 2)
+_FUTURE = (5, 1)
+_GO_AGAIN = (6, 1)
+_CURRENT = (7, 3)
+_WINNER = (10, 3)  # winner + 1
+_SHIELDS = (13, 7)  # one bit per seat
+_DECISION = (20, 4)
+_CONTEXT = (24, 12)  # up to three pending values + 1, 4 bits each
+_LAST = (36, 4)  # last coin played + 1, while a decision resolves it
+HEADER_BYTES = 5
+
+
+def _field(header, spec):
+    """Extract a field from a header.
+    """
+    shift, width = spec
+    return header >> shift & ((1 << width) - 1)
+
+
+def mask(coins):
+    """Coin mask of coin ids.
+
+    Args:
+        coins: Iterable of coin ids.
+
+    Returns:
+        Integer with bit `coin` set for each coin.
+    """
+    bits = 0
+    for coin in coins:
+        bits |= 1 << coin
+    return bits
+
+
+def coins_of(bits):
+    """Coin ids in a coin mask, lowest first.
+
+    Args:
+        bits: Coin mask.
+
+    Returns:
+        Tuple of coin ids.
+    """
+    return tuple(coin for coin in range(len(engine.COIN_NAMES))
+                 if bits >> coin & 1)
+
+
+def is_won(in_play):
+    """Checks if both chest and key are in play.
+
+    Args:
+        in_play: Coin mask of the field.
+
+    Returns:
+        Boolean; True if chest and key are in play, False otherwise.
+    """
+    return in_play & WIN_MASK == WIN_MASK
+
+
+class PackedState:
+    """Immutable, hashable position.
+    """
+    __slots__ = ('header', 'hands', 'larders', 'in_play', 'pile', '_hash')
+
+    def __init__(self, header, hands, larders, in_play, pile):
+        """Create a packed position; see pack() to build one from a state.
+
+        Args:
+            header: Integer with seats, flags, shields and pending decision.
+            hands: Integer with one coin mask per seat.
+            larders: Integer with one coin mask per seat.
+            in_play: Coin mask of the field.
+            pile: bytes of coin ids, top of the pile first.
+        """
+        setter = object.__setattr__
+        setter(self, 'header', header)
+        setter(self, 'hands', hands)
+        setter(self, 'larders', larders)
+        setter(self, 'in_play', in_play)
+        setter(self, 'pile', bytes(pile))
+        setter(self, '_hash', hash((header, hands, larders, in_play, pile)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, PackedState):
+            return NotImplemented
+        return (self._hash == other._hash and self.header == other.header
+                and self.hands == other.hands
+                and self.larders == other.larders
+                and self.in_play == other.in_play and self.pile == other.pile)
+
+    def __reduce__(self):
+        return (PackedState.from_bytes, (self.to_bytes(),))
+
+    def __repr__(self):
+        return f'PackedState({self.to_bytes().hex()})'
+
+    @property
+    def players(self):
+        """Number of seats."""
+        return _field(self.header, _PLAYERS)
+
+    @property
+    def current(self):
+        """Seat of the player making the pending decision."""
+        return _field(self.header, _CURRENT)
+
+    @property
+    def winner(self):
+        """Seat of the winner, NONE until the game is over."""
+        return _field(self.header, _WINNER) - 1
+
+    @property
+    def shields(self):
+        """Bit per seat with the shield."""
+        return _field(self.header, _SHIELDS)
+
+    @property
+    def decision(self):
+        """Pending decision, e.g. engine.PLAY."""
+        return DECISIONS[_field(self.header, _DECISION)]
+
+    @property
+    def won(self):
+        """True if both chest and key are in play."""
+        return is_won(self.in_play)
+
+    def hand(self, seat):
+        """Coin mask of the hand of a seat.
+        """
+        return self.hands >> seat * COIN_BITS & SEAT_MASK
+
+    def larder(self, seat):
+        """Coin mask of the larder of a seat.
+        """
+        return self.larders >> seat * COIN_BITS & SEAT_MASK
+
+    def to_bytes(self):
+        """Serialize the position.
+
+        Returns:
+            bytes; the header, then per seat the hand and larder masks, the
+            field mask and the pile.
+        """
+        seats = self.players
+        size = seats * 2 * COIN_BITS // 8
+        return b''.join((
+            self.header.to_bytes(HEADER_BYTES, 'little'),
+            self.hands.to_bytes(size // 2, 'little'),
+            self.larders.to_bytes(size // 2, 'little'),
+            self.in_play.to_bytes(COIN_BITS // 8, 'little'),
+            self.pile))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialize a position written by to_bytes().
+
+        Args:
+            data: bytes-like object.
+
+        Returns:
+            PackedState.
+        """
+        data = bytes(data)
+        header = int.from_bytes(data[:HEADER_BYTES], 'little')
+        half = _field(header, _PLAYERS) * COIN_BITS // 8
+        start = HEADER_BYTES
+        hands = int.from_bytes(data[start:start+half], 'little')
+        start += half
+        larders = int.from_bytes(data[start:start+half], 'little')
+        start += half
+        in_play = int.from_bytes(data[start:start+COIN_BITS//8], 'little')
+        return cls(header, hands, larders, in_play,
+                   data[start+COIN_BITS//8:])
+
+
+def pack_header(state):
+    """Header of a state: seats, flags, shields and pending decision.
+
+    Args:
+        state: engine.GameState or engine.Table.
+
+    Returns:
+        Integer, as PackedState.header.
+    """
+    shields = 0
+    for seat, shield in enumerate(state.shields):
+        if shield:
+            shields |= 1 << seat
+    pending = state.pending
+    context = 0
+    for index, value in enumerate(pending[1:]):
+        context |= (value + 1) << 4 * index
+    last = state.in_play[-1] + 1 if pending[0] in RESOLVING else 0
+    return (state.players
+            | state.hand_size << _HAND_SIZE[0]
+            | state.future << _FUTURE[0]
+            | state.go_again << _GO_AGAIN[0]
+            | state.current << _CURRENT[0]
+            | (state.winner + 1) << _WINNER[0]
+            | shields << _SHIELDS[0]
+            | DECISION_CODES[pending[0]] << _DECISION[0]
+            | context << _CONTEXT[0]
+            | last << _LAST[0])
+
+
+def pack(state):
+    """Pack a GameState.
+
+    Args:
+        state: engine.GameState.
+
+    Returns:
+        PackedState of the position.
+    """
+    hands = larders = 0
+    for seat in range(state.players):
+        shift = seat * COIN_BITS
+        hands |= mask(state.hands[seat]) << shift
+        if state.larders[seat] != NONE:
+            larders |= 1 << state.larders[seat] << shift
+    return PackedState(pack_header(state), hands, larders,
+                       mask(state.in_play), bytes(state.pile))
+
+
+_CONTEXT_SIZES = {engine.TARGET: 1, engine.OPP_COIN: 3, engine.GIVE: 1}
+
+
+def unpack_header(header):
+    """Fields of a header.
+
+    Args:
+        header: Header of a PackedState.
+
+    Returns:
+        (players, hand_size, future, shields, current, pending, go_again,
+        winner), as in engine.GameState.
+    """
+    seats = _field(header, _PLAYERS)
+    shields = _field(header, _SHIELDS)
+    decision = DECISIONS[_field(header, _DECISION)]
+    context = _field(header, _CONTEXT)
+    pending = (decision,) + tuple(
+        (context >> 4 * index & 15) - 1
+        for index in range(_CONTEXT_SIZES.get(decision, 0)))
+    return (seats, _field(header, _HAND_SIZE),
+            bool(_field(header, _FUTURE)),
+            tuple(bool(shields >> seat & 1) for seat in range(seats)),
+            _field(header, _CURRENT), pending,
+            bool(_field(header, _GO_AGAIN)), _field(header, _WINNER) - 1)
+
+
+def unpack(packed, seed=0, turn=0):
+    """Unpack a PackedState into a GameState.
+
+    Args:
+        packed: PackedState.
+        seed: Seed for the next shuffle by the wind.
+        turn: Number of turns started so far.
+
+    Returns:
+        engine.GameState of the position; hands and the field are in coin
+        id order, but for the coin a RESOLVING decision resolves, last.
+    """
+    (seats, hand_size, future, shields, current, pending, go_again,
+     winner) = unpack_header(packed.header)
+    hands, larders = [], []
+    present = packed.in_play | mask(packed.pile)
+    for seat in range(seats):
+        hand = packed.hand(seat)
+        larder = packed.larder(seat)
+        present |= hand | larder
+        hands.append(coins_of(hand))
+        larders.append(larder.bit_length() - 1 if larder else NONE)
+    field = coins_of(packed.in_play)
+    last = _field(packed.header, _LAST) - 1
+    if last != NONE:
+        field = tuple(coin for coin in field if coin != last) + (last,)
+    return engine.GameState(
+        seats, hand_size, future, coins_of(ALL_COINS & ~present),
+        tuple(hands), tuple(larders), shields, tuple(packed.pile), field,
+        current, pending, go_again, turn, seed, winner)
+
+
+def _check_header():
+    """Fail at import if a header does not round-trip, e.g. every seat of
+    the largest table shielded, or the coin a pick resolves.
+    """
+    seats = engine.PLAYER_MAX
+    assert _LAST[0] + _LAST[1] <= 8 * HEADER_BYTES
+    field = (len(engine.COIN_NAMES) - 1, 0)  # Last is not the highest id
+    for decision in DECISIONS:
+        pending = (decision,) + (14,) * _CONTEXT_SIZES.get(decision, 0)
+        fields = (seats, engine.HAND_MAX, True, (True,) * seats, seats - 1,
+                  pending, True, seats - 1)
+        state = engine.GameState(
+            seats, engine.HAND_MAX, True, (), ((),) * seats,
+            (NONE,) * seats, (True,) * seats, (), field, seats - 1,
+            pending, True, 0, 0, seats - 1)
+        assert unpack_header(pack_header(state)) == fields, decision
+        if decision in RESOLVING:
+            assert unpack(pack(state)).in_play[-1] == 0, decision
+
+
+_check_header()
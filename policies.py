@@ -0,0 +1,158 @@
+"""Computer players for Grackle.
+
+A policy answers the pending decision of a game for one seat.  Policies are
+registered by name so that simulations and command line flags can refer to
+them; register() new ones with the decorator.
+"""
+import engine
+from engine import CHEST, KEY
+
+
+POLICIES = {}
+
+
+def register(cls):
+    """Class decorator: make a policy available by its name.
+    """
+    POLICIES[cls.name] = cls
+    return cls
+
+
+def make(name, **kwargs):
+    """Create a policy by name.
+
+    Args:
+        name: Registered policy name, see POLICIES.
+        kwargs: Passed on to the policy class.
+
+    Returns:
+        Policy object.
+
+    Raises:
+        ValueError: unknown policy name.
+    """
+    try:
+        cls = POLICIES[name]
+    except KeyError:
+        raise ValueError(f'Unknown policy {name!r};'
+                         f' choose from {sorted(POLICIES)}') from None
+    return cls(**kwargs)
+
+
+class Policy:
+    """Base class for computer players.
+
+    A policy sees the whole game it is given and is trusted to only use
+    what its seat could know.
+    """
+    name = None
+    options = ()  # Keyword arguments taken from seat_policies() options
+
+    def start(self, seat, state, rng):
+        """Called once before the game starts.
+
+        Args:
+            seat: Seat played by this policy.
+            state: engine.GameState or engine.Table after the deal.
+            rng: random.Random stream for this policy and game.
+        """
+        self.seat = seat  # pylint: disable=attribute-defined-outside-init
+        self.rng = rng  # pylint: disable=attribute-defined-outside-init
+
+    def observe(self, events):
+        """Called with the events of every step, whoever took it.
+
+        Args:
+            events: Sequence of engine.Event.
+        """
+
+    def act(self, state):
+        """Answer the pending decision.
+
+        Args:
+            state: engine.GameState or engine.Table; state.current is the
+                seat of this policy.
+
+        Returns:
+            One of engine.legal_actions(state).
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Called when the policy is done with all its games.
+        """
+
+
+@register
+class RandomPolicy(Policy):
+    """Picks uniformly among the legal actions.
+    """
+    name = 'random'
+
+    def act(self, state):
+        return self.rng.choice(engine.legal_actions(state))
+
+
+@register
+class FirstPolicy(Policy):
+    """Always picks the first legal action; deterministic.
+    """
+    name = 'first'
+
+    def act(self, state):
+        return engine.legal_actions(state)[0]
+
+
+@register
+class GreedyPolicy(Policy):
+    """Plays the winning coin when it can and keeps chest and key otherwise.
+    """
+    name = 'greedy'
+
+    def act(self, state):
+        actions = engine.legal_actions(state)
+        if len(actions) == 1:
+            return actions[0]
+        if state.pending[0] == engine.PLAY:
+            in_play = state.in_play
+            if CHEST in actions and KEY in in_play:
+                return CHEST
+            if KEY in actions and CHEST in in_play:
+                return KEY
+            others = [coin for coin in actions if coin not in (CHEST, KEY)]
+            if others:
+                return self.rng.choice(others)
+        elif state.pending[0] in (engine.PURSE, engine.GIVE):
+            others = [coin for coin in actions if coin not in (CHEST, KEY)]
+            if others:
+                return self.rng.choice(others)
+        elif state.pending[0] == engine.SHOVEL_PICK:
+            for coin in (CHEST, KEY):
+                if coin in actions:
+                    return coin
+        return self.rng.choice(actions)
+
+
+def seat_policies(names, players, **options):
+    """Create one policy per seat.
+
+    Args:
+        names: Policy name for all seats, or comma separated names per seat
+            (the last one is repeated for the remaining seats).
+        players: Number of seats.
+        options: Settings, each passed on to the policies that take it
+            (see Policy.options).
+
+    Returns:
+        List of Policy objects.
+    """
+    names = [name.strip() for name in names.split(',')]
+    names += names[-1:] * (players - len(names))
+    seats = []
+    for name in names[:players]:
+        cls = POLICIES.get(name)
+        taken = {key: value for key, value in options.items()
+                 if cls and key in cls.options}
+        seats.append(make(name, **taken))
+    return seats
+
@@ -0,0 +1,418 @@
+"""Compact binary game records, and a tool to check and inspect them.
+
+A record file starts with MAGIC and holds one block per game, appended as
+games end, so it can be read through mmap without loading it:
+
+    block header  length, decisions, stream bytes, snapshot interval,
+                  snapshots, winner + 1 (0: unfinished)
+    start         the state after the deal (snapshot encoding)
+    directory     per snapshot: offset of its data in the block, offset of
+                  the next decision in the stream
+    stream        one byte per decision: action + 1, with bit 7 set when
+                  the step shuffled the pile; the wind seed the shuffle
+                  started from then follows as 8 bytes (a checkpoint)
+    snapshots     the state after every `interval` decisions
+
+Snapshots keep hands and the field in order (OPP_COIN answers index into
+hands), so any move can be reached from the snapshot before it.
+
+    python replay.py verify games.grr
+    python replay.py show games.grr 12 --move 30
+    python grackle.py --simulate 1000 --record games.grr
+"""
+import argparse
+import itertools
+import mmap
+import os
+import struct
+import sys
+import time
+
+import engine
+import packed
+from engine import NONE
+
+
+MAGIC = b'GRKR\x02\x00\x00\x00'  # File signature and format version 2
+INTERVAL = 16  # Default decisions between snapshots
+_BLOCK = struct.Struct('<IIIHHB')
+_SPOT = struct.Struct('<II')  # Snapshot directory entry
+_CLOCK = struct.Struct('<IQ')  # turn, seed
+_SEED = struct.Struct('<Q')
+_CHECKPOINT = 0x80
+_ACTION = 0x1F
+_NO_COIN = 0xFF
+
+
+def encode(state):
+    """Snapshot of a state.
+
+    Args:
+        state: engine.GameState or engine.Table.
+
+    Returns:
+        bytes.
+    """
+    header = packed.pack_header(state)
+    parts = [header.to_bytes(packed.HEADER_BYTES, 'little'),
+             _CLOCK.pack(state.turn, state.seed)]
+    for coins in (state.removed, *state.hands, state.pile, state.in_play):
+        parts.append(bytes((len(coins), *coins)))
+    parts.append(bytes(_NO_COIN if larder == NONE else larder
+                       for larder in state.larders))
+    return b''.join(parts)
+
+
+def decode(data):
+    """State of a snapshot written by encode().
+
+    Args:
+        data: bytes-like object.
+
+    Returns:
+        engine.GameState.
+    """
+    data = bytes(data)
+    size = packed.HEADER_BYTES
+    (players, hand_size, future, shields, current, pending, go_again,
+     winner) = packed.unpack_header(int.from_bytes(data[:size], 'little'))
+    turn, seed = _CLOCK.unpack_from(data, size)
+    position = size + _CLOCK.size
+    lists = []
+    for _ in range(players + 3):
+        count = data[position]
+        lists.append(tuple(data[position+1:position+1+count]))
+        position += 1 + count
+    larders = tuple(NONE if larder == _NO_COIN else larder
+                    for larder in data[position:position+players])
+    return engine.GameState(
+        players, hand_size, future, lists[0], tuple(lists[1:players+1]),
+        larders, shields, lists[-2], lists[-1], current, pending, go_again,
+        turn, seed, winner)
+
+
+class Recorder:
+    """Records one game as it is played.
+    """
+    def __init__(self, state, interval=INTERVAL):
+        """Start recording after the deal.
+
+        Args:
+            state: engine.GameState or engine.Table after the deal.
+            interval: Decisions between snapshots.
+        """
+        self.interval = interval
+        self.start = encode(state)
+        self.stream = bytearray()
+        self.spots = []  # (snapshot, stream offset after it)
+        self.decisions = 0
+        self.winner = state.winner
+
+    def add(self, action, seed, state):
+        """Record a decision.
+
+        Args:
+            action: Action taken.
+            seed: Wind seed of the state before the action.
+            state: engine.GameState or engine.Table after the action.
+        """
+        if state.seed != seed:
+            self.stream.append(action + 1 | _CHECKPOINT)
+            self.stream += _SEED.pack(seed)
+        else:
+            self.stream.append(action + 1)
+        self.decisions += 1
+        self.winner = state.winner
+        if self.decisions % self.interval == 0:
+            self.spots.append((encode(state), len(self.stream)))
+
+    def block(self):
+        """The record of the game so far.
+
+        Returns:
+            bytes of one block.
+        """
+        start = bytes((len(self.start),)) + self.start
+        offset = _BLOCK.size + len(start) + _SPOT.size * len(self.spots)
+        offset += len(self.stream)
+        directory, data = [], []
+        for snapshot, position in self.spots:
+            directory.append(_SPOT.pack(offset, position))
+            data.append(bytes((len(snapshot),)) + snapshot)
+            offset += 1 + len(snapshot)
+        return b''.join((
+            _BLOCK.pack(offset, self.decisions, len(self.stream),
+                        self.interval, len(self.spots), self.winner + 1),
+            start, *directory, self.stream, *data))
+
+
+class Archive:
+    """Record file open for appending games.
+
+    Each game is appended with a single unbuffered write, so processes can
+    share a file that already exists.
+    """
+    def __init__(self, path):
+        """Open or create a record file.
+
+        Args:
+            path: File name.
+        """
+        # pylint: disable-next=consider-using-with
+        self.out = open(path, 'ab', buffering=0)
+        if self.out.tell() == 0:
+            self.out.write(MAGIC)
+
+    def write(self, recorder):
+        """Append a finished game.
+
+        Args:
+            recorder: Recorder of the game.
+        """
+        self.out.write(recorder.block())
+
+    def close(self):
+        """Close the file.
+        """
+        self.out.close()
+
+
+class Replay:
+    """One recorded game, read in place from a buffer.
+    """
+    def __init__(self, buffer, offset):
+        """Read the header of a block.
+
+        Args:
+            buffer: bytes-like object (e.g. an mmap) of the file.
+            offset: Offset of the block in it.
+        """
+        (self.length, self.decisions, stream_bytes, self.interval,
+         snapshots, winner) = _BLOCK.unpack_from(buffer, offset)
+        self.buffer = buffer
+        self.offset = offset
+        self.winner = winner - 1
+        start = offset + _BLOCK.size
+        self.start = start + 1, start + 1 + buffer[start]
+        self.directory = self.start[1]
+        self.stream = self.directory + _SPOT.size * snapshots
+        self.stream_end = self.stream + stream_bytes
+        self.snapshots = snapshots
+
+    def initial(self):
+        """State after the deal.
+        """
+        return decode(self.buffer[self.start[0]:self.start[1]])
+
+    def snapshot(self, index):
+        """State after (index + 1) * interval decisions, and where the next
+        decision starts in the stream.
+
+        Returns:
+            (engine.GameState, stream offset in the buffer).
+        """
+        where, position = _SPOT.unpack_from(
+            self.buffer, self.directory + _SPOT.size * index)
+        where += self.offset
+        size = self.buffer[where]
+        return (decode(self.buffer[where+1:where+1+size]),
+                self.stream + position)
+
+    def actions(self, position=None):
+        """Decisions from a stream offset on.
+
+        Yields:
+            (action, checkpoint seed or None).
+        """
+        buffer = self.buffer
+        position = self.stream if position is None else position
+        end = self.stream_end
+        while position < end:
+            code = buffer[position]
+            position += 1
+            seed = None
+            if code & _CHECKPOINT:
+                seed, = _SEED.unpack_from(buffer, position)
+                position += _SEED.size
+            yield (code & _ACTION) - 1, seed
+
+    def state_at(self, move):
+        """State after a number of decisions, from the nearest snapshot.
+
+        Args:
+            move: Number of decisions, 0 to self.decisions.
+
+        Returns:
+            engine.GameState.
+
+        Raises:
+            IndexError: no such move.
+        """
+        if not 0 <= move <= self.decisions:
+            raise IndexError(f'Move {move} of {self.decisions}')
+        index = min(move // self.interval, self.snapshots)
+        if index:
+            state, position = self.snapshot(index - 1)
+        else:
+            state, position = self.initial(), self.stream
+        table = _Quiet(state)
+        steps = self.actions(position)
+        for action, _ in itertools.islice(steps, move - index * self.interval):
+            table.step(action)
+        return table.freeze()
+
+    def verify(self):
+        """Replay the whole game through the rules.
+
+        Returns:
+            List of problems found; empty if the record is sound.
+        """
+        problems = []
+        table = _Quiet(self.initial())
+        count = 0
+        snapshot = 0
+        for action, checkpoint in self.actions():
+            seed = table.seed
+            if checkpoint is not None and checkpoint != seed:
+                problems.append(f'move {count+1}: shuffle seed differs')
+            try:
+                table.step(action)
+            except ValueError as error:
+                problems.append(f'move {count+1}: {error}')
+                return problems
+            if (table.seed != seed) != (checkpoint is not None):
+                problems.append(f'move {count+1}: unexpected shuffle')
+            count += 1
+            if count % self.interval == 0 and snapshot < self.snapshots:
+                if table.freeze() != self.snapshot(snapshot)[0]:
+                    problems.append(f'move {count}: snapshot differs')
+                snapshot += 1
+        if count != self.decisions:
+            problems.append(f'{count} decisions instead of {self.decisions}')
+        if table.winner != self.winner:
+            problems.append(f'winner {table.winner} instead of {self.winner}')
+        return problems
+
+
+class _Quiet(engine.Table):
+    """Table replaying a record; its events are not needed.
+    """
+    __slots__ = ()
+
+    def emit(self, kind, player, coin=NONE, target=NONE, other=NONE):
+        pass
+
+
+class Replays:
+    """All games of a record file, memory-mapped.
+    """
+    def __init__(self, path):
+        """Open a record file.
+
+        Args:
+            path: File name.
+
+        Raises:
+            ValueError: not a record file.
+        """
+        with open(path, 'rb') as data:
+            size = os.fstat(data.fileno()).st_size
+            self.buffer = (mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+                           if size else b'')
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a game record file')
+        self._offsets = None
+
+    @property
+    def offsets(self):
+        """Offset of each block, found by hopping over block lengths."""
+        if self._offsets is None:
+            offsets = []
+            offset, size = len(MAGIC), len(self.buffer)
+            while offset + _BLOCK.size <= size:
+                offsets.append(offset)
+                offset += _BLOCK.unpack_from(self.buffer, offset)[0]
+            self._offsets = offsets
+        return self._offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        return Replay(self.buffer, self.offsets[index])
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield Replay(self.buffer, offset)
+
+
+def show(state, out=sys.stdout):
+    """Print a state for people.
+    """
+    names = engine.COIN_NAMES
+    for seat in range(state.players):
+        larder = state.larders[seat]
+        print(f'Seat {seat+1}: {" ".join(names[c] for c in state.hands[seat])}'
+              f'{"  larder " + names[larder] if larder != NONE else ""}'
+              f'{"  shielded" if state.shields[seat] else ""}', file=out)
+    print(f'In play: {" ".join(names[coin] for coin in state.in_play)}',
+          file=out)
+    print(f'Pile: {" ".join(names[coin] for coin in state.pile)}', file=out)
+    if state.winner != NONE:
+        print(f'Seat {state.winner+1} won', file=out)
+    else:
+        print(f'Turn {state.turn}, seat {state.current+1} to {state.pending}',
+              file=out)
+
+
+def main(argv=None):
+    """Verify or inspect record files.
+
+    Args:
+        argv: Command line arguments; sys.argv if None.
+
+    Returns:
+        Exit status: 1 if verify found problems.
+    """
+    parser = argparse.ArgumentParser(
+        description='Check and inspect Grackle game records')
+    commands = parser.add_subparsers(dest='command', required=True)
+    verify = commands.add_parser(
+        'verify', help='Replay every game through the rules.')
+    verify.add_argument('path')
+    info = commands.add_parser('show', help='Show a game at a move.')
+    info.add_argument('path')
+    info.add_argument('game', type=int, help='Game number, from 0.')
+    info.add_argument('--move', default=None, type=int,
+                      help='Number of decisions (default: the end).')
+    args = parser.parse_args(argv)
+    replays = Replays(args.path)
+    if args.command == 'show':
+        if not 0 <= args.game < len(replays):
+            parser.error(f'{args.path} has {len(replays)} games')
+        replay = replays[args.game]
+        move = replay.decisions if args.move is None else args.move
+        if not 0 <= move <= replay.decisions:
+            parser.error(f'Game {args.game} has {replay.decisions} moves')
+        print(f'Game {args.game}: move {move} of {replay.decisions}')
+        show(replay.state_at(move))
+        return 0
+    began = time.perf_counter()
+    games = decisions = bad = 0
+    for index, replay in enumerate(replays):
+        problems = replay.verify()
+        games += 1
+        decisions += replay.decisions
+        if problems:
+            bad += 1
+            print(f'Game {index}: {"; ".join(problems)}')
+    elapsed = time.perf_counter() - began
+    print(f'{games} games, {decisions} decisions verified in {elapsed:.1f}s'
+          f' ({games/max(elapsed, 1e-9):,.0f} games/s,'
+          f' {decisions/max(elapsed, 1e-9):,.0f} decisions/s);'
+          f' {bad} with problems; {len(replays.buffer):,} bytes')
+    return 1 if bad else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
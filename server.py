@@ -0,0 +1,964 @@
+"""Asyncio game server: many Grackle tables in one process.
+
+Every table waits on the action of its current player, which steps it at
+once; one event loop serves thousands of them.  Clients talk JSON lines
+over TCP, one object per line, and may play any number of seats on one
+connection.  Creating a table hands out one secret token per seat; a
+connection plays a seat after joining with its token, which replaces the
+hot-seat passwords of the console game.
+
+    -> {"op": "create", "players": 2, "coins": 2, "remove": 0,
+        "future": false, "seed": 1, "id": 1}
+    <- {"op": "created", "table": 1, "tokens": ["...", "..."], "id": 1}
+    -> {"op": "join", "token": "..."}
+    <- {"op": "joined", "table": 1, "seat": 0}
+    <- {"op": "update", "table": 1, "seat": 0, "events": [...],
+        "decision": "play", "actions": [3, 7], "view": {...}}
+    -> {"op": "act", "token": "...", "action": 3}
+    <- {"op": "error", "message": "..."}
+
+An update goes to every joined seat after each step, with the events as
+[kind, player, coin, target, other] lists; coins the seat could not see
+are NONE (see stream.visible()).  The seat to move also gets the
+decision, its legal actions and what it can see of the table; "winner" is
+set once the game is over.
+
+Anyone may also watch a table, on one of three channels: "public" shows
+what every player sees, "delayed" shows everything (hands and the pile in
+order) DELAY steps behind the game, and "seat" shows what one seat sees,
+to whoever has its token.  Each step is redacted, diffed against the last
+view and encoded once per channel, whatever the number of spectators:
+
+    -> {"op": "watch", "table": 1, "channel": "public"}
+    <- {"op": "sync", "table": 1, "channel": "public", "seq": 4,
+        "view": {...}}
+    <- {"op": "watch", "table": 1, "channel": "public", "seq": 5,
+        "events": [...], "delta": {"in_play": [3], "current": 1}}
+    -> {"op": "unwatch", "table": 1, "channel": "public"}
+
+A delta holds the parts of the view that changed.  A spectator that does
+not keep up (WATCH_BUFFER bytes unsent) misses updates and is sent a sync
+of the whole view once it caught up, so "seq" may jump; the end of the
+game, with the winner, is sent to everyone.  {"op": "stats"}
+answers with the counters of the server, spectator fan-out time included.
+
+With a slab file (--slab), games nobody acted on for --idle seconds, and
+the least recently used ones beyond the --hot most recent, are hibernated:
+their state is written to a fixed-size slot of the memory-mapped slab (see
+slab.py) and dropped from memory, and the next request for the table wakes
+it again.  Tokens are signed table and seat numbers, so a sleeping game
+keeps nothing in memory but the connections joined to its seats.  The
+events of the last step are not kept: a seat joining a woken game gets an
+update without them.
+
+With a journal file (--journal), every game dealt and every action
+accepted is written ahead to the journal (see journal.py) before any
+client hears of it, and a server started again on the journal carries on
+with every game that was not over, tokens included.  The messages of the
+clients wait for the fsync: with group commit (the default) one fsync, in
+a thread, covers every action taken while the last one was running (or
+within --group-window seconds), where --fsync action syncs each action
+before stepping it.  The journal is compacted to a checkpoint of the live
+games as it grows, and on exit.
+
+    python grackle.py --serve 7777
+    python grackle.py --serve 7777 --slab games.slab --idle 30 --hot 100000
+    python grackle.py --serve 7777 --journal games.journal
+"""
+import asyncio
+import base64
+import bisect
+import collections
+import hmac
+import json
+import secrets
+import sys
+import time
+
+import engine
+import instrument
+import journal
+import replay
+import slab
+import stream
+from engine import NONE
+
+
+HOST = '127.0.0.1'
+LIMIT = 1 << 16  # Longest request line, in bytes
+HIGH_WATER = 1 << 16  # Unsent bytes a connection may queue before waiting
+IDLE = 60.0  # Default seconds without an action before a game hibernates
+HOT = 100000  # Default most games kept in memory with a slab
+SWEEP_EVERY = 1.0  # Seconds between looks for idle games
+PUBLIC, SEAT, DELAYED = 'public', 'seat', 'delayed'  # Spectator channels
+DELAY = 10  # Steps the delayed channel runs behind the game
+WATCH_BUFFER = 1 << 16  # Unsent bytes past which spectators miss updates
+WINDOW = 0.0  # Default seconds gathering actions before a group commit
+
+
+def view(table, seat):
+    """What a seat sees of the table.
+
+    Args:
+        table: engine.Table.
+        seat: Seat looking at it.
+
+    Returns:
+        Dict for the update message.
+    """
+    return {
+        'hand': list(table.hands[seat]),
+        'larder': table.larders[seat],
+        'hands': [len(hand) for hand in table.hands],
+        'in_play': list(table.in_play),
+        'pile': len(table.pile),
+        'shields': list(table.shields),
+        'current': table.current,
+        }
+
+
+def public_view(table):
+    """What everyone sees of the table.
+
+    Args:
+        table: engine.Table.
+
+    Returns:
+        Dict for spectators.
+    """
+    return {
+        'hands': [len(hand) for hand in table.hands],
+        'larders': [larder != NONE for larder in table.larders],
+        'in_play': list(table.in_play),
+        'pile': len(table.pile),
+        'shields': list(table.shields),
+        'current': table.current,
+        }
+
+
+def full_view(table):
+    """Everything on the table, the pile in order.
+
+    Args:
+        table: engine.Table.
+
+    Returns:
+        Dict for spectators.
+    """
+    return {
+        'hands': [list(hand) for hand in table.hands],
+        'larders': list(table.larders),
+        'in_play': list(table.in_play),
+        'pile': list(table.pile),
+        'shields': list(table.shields),
+        'current': table.current,
+        }
+
+
+class Channel:
+    """Spectators of one view of a table.
+
+    Each step is redacted, diffed against the last view sent and encoded
+    once, then the same line is queued for every spectator.
+    """
+    def __init__(self, number, table, name, seat):
+        """Create a channel without spectators.
+
+        Args:
+            number: Table number.
+            table: engine.Table of the game.
+            name: PUBLIC, DELAYED or 'seat N'.
+            seat: Seat whose view is shown, stream.OBSERVER, or None for
+                everything.
+        """
+        self.number = number
+        self.name = name
+        self.seat = seat
+        self.watchers = {}  # Session: True while it needs a sync
+        self.seq = 0
+        self.winner = NONE
+        self.lag = collections.deque() if name == DELAYED else None
+        self.view = self.look(table) if self.lag is None else None
+
+    def look(self, table):
+        """The view of the table shown on the channel.
+        """
+        if self.seat is None:
+            return full_view(table)
+        if self.seat == stream.OBSERVER:
+            return public_view(table)
+        return view(table, self.seat)
+
+    def sync(self):
+        """Message with the whole view, for a spectator catching up.
+        """
+        message = {'op': 'sync', 'table': self.number, 'channel': self.name,
+                   'seq': self.seq, 'view': self.view}
+        if self.winner != NONE:
+            message['winner'] = self.winner
+        return message
+
+    def publish(self, table, events):
+        """Send a step to the spectators, or hold it back on DELAYED.
+
+        Args:
+            table: engine.Table after the step.
+            events: Events of the step.
+
+        Returns:
+            Number of messages queued.
+        """
+        step = ([list(stream.visible(event, self.seat)) for event in events],
+                self.look(table), table.winner)
+        if self.lag is None:
+            return self.send(*step)
+        self.lag.append(step)
+        sent = 0
+        while len(self.lag) > DELAY or self.lag and table.winner != NONE:
+            sent += self.send(*self.lag.popleft())
+        return sent
+
+    def send(self, events, seen, winner):
+        """Queue one update for every spectator that keeps up.
+        """
+        last = self.view
+        self.view = seen
+        self.winner = winner
+        self.seq += 1
+        message = {'op': 'watch', 'table': self.number,
+                   'channel': self.name, 'seq': self.seq, 'events': events,
+                   'delta': {key: value for key, value in seen.items()
+                             if last is None or last[key] != value}}
+        if winner != NONE:
+            message['winner'] = winner
+        line = json.dumps(message)
+        synced = None
+        sent = 0
+        watchers = self.watchers
+        for session, behind in watchers.items():
+            if session.backlog() > WATCH_BUFFER:
+                if winner == NONE:
+                    watchers[session] = True
+                    continue
+                behind = True  # The end of the game is never missed
+            if behind:
+                synced = synced or json.dumps(self.sync())
+                session.post(synced)
+                watchers[session] = False
+            else:
+                session.post(line)
+            sent += 1
+        return sent
+
+
+class Session:
+    """One client connection and the seats it joined.
+
+    Messages are collected and written once per pass of the event loop, so
+    the updates of many tables share one system call.  With a journal, a
+    message waits until the journal synced every record buffered when it
+    was queued.
+    """
+    def __init__(self, writer, defer=None, journal=None):
+        """Create a session.
+
+        Args:
+            writer: asyncio.StreamWriter of the connection.
+            defer: Called with the flush of the messages to have it called
+                when they may go, e.g. Server.defer(); soon if None.
+            journal: journal.Journal the messages wait on, if any.
+        """
+        self.writer = writer
+        self.defer = defer
+        self.journal = journal
+        self.tokens = set()
+        self.watching = set()  # (table number, channel name)
+        self.outbox = []
+        self.marks = []  # Journal position each message of the outbox needs
+        self.queued = 0  # Characters in the outbox
+
+    def send(self, message):
+        """Queue a message to the client; does not wait for it to be sent.
+        """
+        self.post(json.dumps(message))
+
+    def post(self, line):
+        """Queue a message already encoded as a line of JSON.
+        """
+        if not self.outbox:
+            if self.defer:
+                self.defer(self.flush)
+            else:
+                asyncio.get_running_loop().call_soon(self.flush)
+        self.outbox.append(line)
+        self.queued += len(line)
+        if self.journal is not None:
+            self.marks.append(self.journal.appended)
+
+    def backlog(self):
+        """Bytes queued or written but not sent yet.
+        """
+        return self.queued + self.writer.transport.get_write_buffer_size()
+
+    def flush(self):
+        """Write the queued messages, those the journal allows.
+        """
+        lines = self.outbox
+        if self.journal is None:
+            self.outbox = []
+            self.queued = 0
+        else:  # Keep those needing records not synced yet
+            count = bisect.bisect_right(self.marks, self.journal.synced)
+            lines, self.outbox = lines[:count], lines[count:]
+            del self.marks[:count]
+            self.queued = sum(map(len, self.outbox))
+            if self.outbox:
+                self.defer(self.flush)
+        if lines and not self.writer.is_closing():
+            lines.append('')
+            self.writer.write('\n'.join(lines).encode())
+
+
+class Game:
+    """A table of the server: an engine.Table and who plays each seat.
+
+    A game has no coroutine of its own: the action of the current player
+    steps the table at once, so a game waiting on a player is plain data
+    that can be hibernated.
+    """
+    def __init__(self, number, table, sessions=None, channels=None):
+        """Create a game waiting on its current player.
+
+        Args:
+            number: Table number, unique in the server.
+            table: engine.Table, e.g. after new_table().
+            sessions: Session joined to each seat, if any.
+            channels: Dict of channel name: Channel being watched, if any.
+        """
+        self.number = number
+        self.table = table
+        self.sessions = sessions or [None] * table.players
+        self.channels = channels or {}
+        self.asked = time.perf_counter()  # The current decision was asked
+        self.touched = time.monotonic()
+
+    def act(self, seat, action, server):
+        """Step the table with the action of a seat, publish the events.
+
+        Args:
+            seat: Seat acting.
+            action: Action of the seat.
+            server: Server hosting the game.
+
+        Raises:
+            ValueError: not the seat's turn, or not a legal action.
+        """
+        table = self.table
+        if table.current != seat or table.pending[0] == engine.DONE:
+            raise ValueError('Not your turn')
+        # Only ints: 14.0 and True equal legal actions, but fail the step
+        # pylint: disable-next=unidiomatic-typecheck
+        if type(action) is not int or action not in table.legal_actions():
+            raise ValueError(f'Illegal action {action!r}'
+                             f' for {table.pending[0]}')
+        if server.journal is not None:
+            server.journal.act(self.number, action)
+            server.journaled()
+        began = time.perf_counter()
+        events = table.step(action)
+        self.touched = time.monotonic()
+        self.publish(events)
+        if self.channels:
+            fanning = time.perf_counter()
+            messages = sum(channel.publish(table, events)
+                           for channel in self.channels.values())
+            server.fanned(time.perf_counter() - fanning, messages)
+        now = time.perf_counter()
+        server.stepped(now - began, began - self.asked, events)
+        self.asked = now
+        if table.pending[0] == engine.DONE:
+            server.finished(self)
+        server.settled()
+
+    def publish(self, events):
+        """Send the events of a step to every joined seat.
+        """
+        for seat, session in enumerate(self.sessions):
+            if session is not None:
+                session.send(self.update(seat, events))
+
+    def update(self, seat, events):
+        """Update message for one seat.
+
+        Args:
+            seat: Seat the message is for.
+            events: Events of the last step.
+
+        Returns:
+            Dict.
+        """
+        table = self.table
+        message = {'op': 'update', 'table': self.number, 'seat': seat,
+                   'events': [list(stream.visible(event, seat))
+                              for event in events]}
+        if table.winner != NONE:
+            message['winner'] = table.winner
+        elif table.current == seat:
+            message['decision'] = table.pending[0]
+            message['actions'] = list(table.legal_actions())
+            message['view'] = view(table, seat)
+        return message
+
+
+class Server:
+    """All games of the process and the sessions playing them.
+    """
+    def __init__(self, profile=False, capture=None, slab=None, idle=IDLE,
+                 hot=HOT, journal=None, group=True):
+        """Create a server without games.
+
+        Args:
+            profile: Record metrics into instrument.METRICS.
+            capture: instrument.Capture profiling the first turns, if any.
+            slab: slab.Slab to hibernate games to; None keeps every game in
+                memory.
+            idle: Seconds without an action before a game hibernates.
+            hot: Most games kept in memory, the least recently used
+                hibernating first.
+            journal: journal.Journal to write the games and actions ahead
+                to, and to recover() the games from; None for none.
+            group: Commit the journal in groups with commit(), instead of
+                syncing every action before it is stepped.
+        """
+        self.games = collections.OrderedDict()  # number: Game, LRU first
+        self.kept = {}  # number: (sessions, channels) of hibernated games
+        self.key = secrets.token_bytes(16)  # Signs the tokens
+        self.numbers = 1  # Next table number
+        self.actions = 0
+        self.busy = 0.0  # Seconds spent stepping tables
+        self.fanout = 0.0  # Seconds of it spent updating spectators
+        self.watch_updates = 0  # Messages queued for spectators
+        self.metrics = instrument.METRICS if profile else None
+        self.capture = capture
+        self.table_class = (instrument.ProfiledTable if self.metrics
+                            else engine.Table)
+        self.slab = slab
+        self.idle = idle
+        self.hot = hot
+        self.hibernated = 0  # Games put to sleep, counting every time
+        self.woken = 0
+        self.journal = journal
+        self.group = group
+        self.pending = asyncio.Event()  # Records or messages await a commit
+        self.waiting = []  # Flushes of sessions, after the next commit
+        if journal is not None:
+            self.key = journal.key
+            self.numbers = journal.numbers
+
+    def recover(self):
+        """Take the games of the journal, stepped through its actions.
+
+        Returns:
+            Number of games recovered; those over are not.
+        """
+        count = 0
+        for number, (snapshot, actions) in self.journal.recovered.items():
+            table = self.table_class(replay.decode(snapshot))
+            for action in actions:
+                table.step(action)
+            if table.pending[0] != engine.DONE:
+                self.games[number] = Game(number, table)
+                self.evict()
+                count += 1
+        self.journal.recovered = {}
+        return count
+
+    def journaled(self):
+        """Make the records just added to the journal durable.
+
+        With group commit, commit() syncs them along with the others;
+        otherwise they are synced now, blocking the event loop.
+        """
+        if self.group:
+            self.pending.set()
+        else:
+            self.journal.commit(self.journal.take())
+
+    def settled(self):
+        """Compact the journal if it grew enough, once a change is made.
+
+        Without group commit only, and only after the record just synced
+        is applied to the games, which the checkpoint must hold; commit()
+        compacts between requests instead.
+        """
+        if (self.journal is not None and not self.group
+                and self.journal.crowded()):
+            self.journal.compact(self.checkpoint())
+
+    def defer(self, callback):
+        """Call back once the journal synced every record buffered so far.
+
+        Sessions flush their messages through it with group commit, so
+        nobody hears of an action that a crash could still undo.
+        """
+        if self.journal.synced < self.journal.appended:
+            self.waiting.append(callback)
+            self.pending.set()
+        else:
+            asyncio.get_running_loop().call_soon(callback)
+
+    def checkpoint(self):
+        """Journal checkpoint of every game not over.
+
+        The records buffered are dropped: the checkpoint holds them.
+
+        Returns:
+            bytes for journal.Journal.compact().
+        """
+        self.journal.take()
+        snapshots = [(number, replay.encode(game.table))
+                     for number, game in self.games.items()]
+        if self.slab is not None:
+            snapshots.extend(self.slab.items())
+        return journal.checkpoint(self.key, self.numbers, snapshots)
+
+    def token(self, number, seat):
+        """Secret token of a seat: the table and seat numbers, signed.
+        """
+        name = f'{number}.{seat}'
+        mac = hmac.digest(self.key, name.encode(), 'sha256')[:16]
+        return f'{name}.{base64.urlsafe_b64encode(mac).decode()[:22]}'
+
+    def seat_of(self, token):
+        """Table and seat a token plays.
+
+        Returns:
+            (table number, seat).
+
+        Raises:
+            ValueError: not a token of this server.
+        """
+        try:
+            number, seat, _ = token.split('.')
+            number, seat = int(number), int(seat)
+        except (AttributeError, ValueError):
+            raise ValueError('Unknown token') from None
+        if not hmac.compare_digest(token, self.token(number, seat)):
+            raise ValueError('Unknown token')
+        return number, seat
+
+    def game(self, number):
+        """Game of a table, woken up if it was hibernated.
+
+        Args:
+            number: Table number.
+
+        Returns:
+            Game, now the most recently used.
+
+        Raises:
+            ValueError: no such game, e.g. it is over.
+        """
+        game = self.games.get(number)
+        if game is not None:
+            self.games.move_to_end(number)
+            return game
+        data = self.slab.get(number) if self.slab is not None else None
+        if data is None:
+            raise ValueError('Unknown token')
+        self.slab.free(number)
+        table = self.table_class(replay.decode(data))
+        game = Game(number, table, *self.kept.pop(number, (None, None)))
+        self.games[number] = game
+        self.woken += 1
+        self.evict()
+        return game
+
+    def hibernate(self, game):
+        """Write a game to the slab and forget it until it is needed.
+        """
+        self.slab.put(game.number, replay.encode(game.table))
+        del self.games[game.number]
+        if game.channels or any(
+                session is not None for session in game.sessions):
+            self.kept[game.number] = (game.sessions, game.channels)
+        self.hibernated += 1
+
+    def evict(self):
+        """Hibernate the least recently used games beyond `hot`.
+        """
+        if self.slab is not None:
+            while len(self.games) > self.hot:
+                self.hibernate(next(iter(self.games.values())))
+
+    def sweep(self):
+        """Hibernate the games idle for longer than `idle` seconds.
+
+        Returns:
+            Number of games hibernated.
+        """
+        if self.slab is None:
+            return 0
+        since = time.monotonic() - self.idle
+        count = 0
+        while self.games:
+            game = next(iter(self.games.values()))
+            if game.touched > since:
+                break
+            self.hibernate(game)
+            count += 1
+        return count
+
+    def create(self, request):
+        """Create a game.
+
+        Args:
+            request: Dict of the create message.
+
+        Returns:
+            Game.
+
+        Raises:
+            ValueError: bad game settings.
+        """
+        players = int(request.get('players', engine.PLAYER_MIN))
+        coins = int(request.get('coins', engine.HAND_MIN))
+        remove = int(request.get('remove', 0))
+        if not engine.PLAYER_MIN <= players <= engine.PLAYER_MAX:
+            raise ValueError(f'Bad number of players {players}')
+        if not engine.HAND_MIN <= coins <= engine.HAND_MAX:
+            raise ValueError(f'Bad number of coins {coins}')
+        if not 0 <= remove <= engine.REMOVE_MAX:
+            raise ValueError(f'Bad number of coins to remove {remove}')
+        table = engine.new_table(
+            players, coins, remove, bool(request.get('future')),
+            request.get('seed'), table_class=self.table_class)
+        game = Game(self.numbers, table)
+        self.numbers += 1
+        if self.journal is not None:
+            self.journal.state(game.number, table)
+            self.journaled()
+        self.games[game.number] = game
+        self.evict()
+        self.settled()
+        return game
+
+    def stepped(self, seconds, waited, events):
+        """Count one action.
+
+        Args:
+            seconds: Time stepping the table and sending the updates.
+            waited: Time waiting on the action.
+            events: Events of the step.
+        """
+        self.actions += 1
+        self.busy += seconds
+        if self.metrics:
+            self.metrics.observe(instrument.STEP, seconds)
+            self.metrics.observe(instrument.WAIT, waited)
+        if self.capture:
+            self.capture.observe(events)
+
+    def fanned(self, seconds, messages):
+        """Count the spectator updates of one step.
+
+        Args:
+            seconds: Time redacting, encoding and queueing them.
+            messages: Number of messages queued.
+        """
+        self.fanout += seconds
+        self.watch_updates += messages
+
+    def finished(self, game):
+        """Forget a game that is over.
+        """
+        del self.games[game.number]
+        for channel in game.channels.values():
+            for session in channel.watchers:
+                session.watching.discard((game.number, channel.name))
+
+    def handle(self, session, request):
+        """Answer one request of a client.
+
+        Args:
+            session: Session of the client.
+            request: Dict of the message.
+
+        Raises:
+            ValueError, KeyError, TypeError: bad request.
+        """
+        operation = request['op']
+        if operation == 'act':
+            token = request['token']
+            if token not in session.tokens:
+                raise ValueError('Join the seat first')
+            number, seat = self.seat_of(token)
+            self.game(number).act(seat, request['action'], self)
+        elif operation == 'create':
+            game = self.create(request)
+            session.send({'op': 'created', 'table': game.number,
+                          'tokens': [self.token(game.number, seat)
+                                     for seat in range(game.table.players)],
+                          'id': request.get('id')})
+        elif operation == 'join':
+            token = request['token']
+            number, seat = self.seat_of(token)
+            game = self.game(number)
+            old = game.sessions[seat]
+            if old is not None:
+                old.tokens.discard(token)
+            game.sessions[seat] = session
+            session.tokens.add(token)
+            session.send({'op': 'joined', 'table': game.number,
+                          'seat': seat})
+            session.send(game.update(seat, game.table.events))
+        elif operation == 'watch':
+            self.watch(session, request)
+        elif operation == 'unwatch':
+            number = int(request['table'])
+            name = request.get('channel', PUBLIC)
+            if name == SEAT:
+                name = f'seat {self.seat_of(request["token"])[1]}'
+            self.unwatch(session, number, name)
+        elif operation == 'stats':
+            session.send({'op': 'stats', 'actions': self.actions,
+                          'busy': self.busy, 'fanout': self.fanout,
+                          'watch_updates': self.watch_updates,
+                          'games': len(self.games),
+                          'hibernated': len(self.slab or ()),
+                          'syncs': self.journal.syncs if self.journal
+                                   else 0})
+        else:
+            raise ValueError(f'Unknown op {operation!r}')
+
+    def watch(self, session, request):
+        """Add a spectator to a channel of a table.
+
+        Args:
+            session: Session of the spectator.
+            request: Dict of the watch message.
+
+        Raises:
+            ValueError, KeyError, TypeError: bad request.
+        """
+        name = request.get('channel', PUBLIC)
+        if name == SEAT:
+            number, seat = self.seat_of(request['token'])
+            name = f'seat {seat}'
+        elif name in (PUBLIC, DELAYED):
+            number = int(request['table'])
+            seat = stream.OBSERVER if name == PUBLIC else None
+        else:
+            raise ValueError(f'Unknown channel {name!r}')
+        game = self.game(number)
+        channel = game.channels.get(name)
+        if channel is None:
+            channel = game.channels[name] = Channel(number, game.table, name,
+                                                    seat)
+        session.send({'op': 'watching', 'table': number, 'channel': name})
+        if channel.view is not None:
+            session.send(channel.sync())
+            channel.watchers[session] = False
+        else:
+            channel.watchers[session] = True
+        session.watching.add((number, name))
+
+    def unwatch(self, session, number, name):
+        """Remove a spectator from a channel; unwatched channels go.
+        """
+        session.watching.discard((number, name))
+        if number in self.games:
+            channels = self.games[number].channels
+        else:
+            channels = self.kept.get(number, (None, {}))[1]
+        channel = channels.get(name)
+        if channel is not None:
+            channel.watchers.pop(session, None)
+            if not channel.watchers:
+                del channels[name]
+        self.forget(number)
+
+    def forget(self, number):
+        """Drop what a hibernated game kept once nobody is left on it.
+        """
+        if number in self.kept:
+            sessions, channels = self.kept[number]
+            if not channels and all(other is None for other in sessions):
+                del self.kept[number]
+
+    def leave(self, session):
+        """Unseat a session whose connection closed; its games wait.
+        """
+        for number, name in list(session.watching):
+            self.unwatch(session, number, name)
+        for token in session.tokens:
+            number, seat = self.seat_of(token)
+            if number in self.games:
+                sessions = self.games[number].sessions
+            else:
+                sessions = self.kept.get(number, ((),))[0]
+            if seat < len(sessions) and sessions[seat] is session:
+                sessions[seat] = None
+                self.forget(number)
+        session.tokens.clear()
+
+    async def connected(self, reader, writer):
+        """Serve one client connection until it closes.
+        """
+        if self.journal is not None and self.group:
+            session = Session(writer, self.defer, self.journal)
+        else:
+            session = Session(writer)
+        rest = b''
+        try:
+            while True:
+                data = await reader.read(LIMIT)
+                if not data:
+                    break
+                lines = (rest + data).split(b'\n')
+                rest = lines.pop()
+                if len(rest) > LIMIT:
+                    break
+                for line in lines:
+                    try:
+                        self.handle(session, json.loads(line))
+                    except (ValueError, KeyError, TypeError) as error:
+                        session.send({'op': 'error', 'message': str(error)})
+                if writer.transport.get_write_buffer_size() > HIGH_WATER:
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.leave(session)
+            writer.close()
+
+    async def serve(self, host=HOST, port=0, ready=None):
+        """Accept clients until cancelled.
+
+        Args:
+            host: Address to listen on.
+            port: TCP port; 0 picks a free one.
+            ready: Called with the port once listening, if given.
+        """
+        listener = await asyncio.start_server(self.connected, host, port)
+        if ready:
+            ready(listener.sockets[0].getsockname()[1])
+        async with listener:
+            await listener.serve_forever()
+
+
+async def sweep(server, every=SWEEP_EVERY):
+    """Hibernate idle games periodically, until cancelled.
+
+    Args:
+        server: Server with a slab.
+        every: Seconds between looks.
+    """
+    while True:
+        await asyncio.sleep(every)
+        server.sweep()
+
+
+async def commit(server, window=WINDOW):
+    """Commit the journal of a server in groups, until cancelled.
+
+    Each commit writes and syncs the records of every action since the
+    last one in a thread, the event loop serving on meanwhile, then lets
+    the messages waiting on them go; the journal is compacted instead
+    once it grew enough.
+
+    Args:
+        server: Server with a journal, committing in groups.
+        window: Seconds to gather more actions before each commit.
+    """
+    loop = asyncio.get_running_loop()
+    journal = server.journal
+    while True:
+        await server.pending.wait()
+        if window:
+            await asyncio.sleep(window)
+        server.pending.clear()
+        waiting, server.waiting = server.waiting, []
+        if journal.crowded():
+            await loop.run_in_executor(None, journal.compact,
+                                       server.checkpoint())
+        elif journal.buffer:
+            await loop.run_in_executor(None, journal.commit, journal.take())
+        for callback in waiting:  # Flushes needing later records wait on
+            callback()
+
+
+async def export(metrics, path, every=instrument.WRITE_EVERY):
+    """Rewrite a metrics file periodically, until cancelled.
+
+    Args:
+        metrics: instrument.Metrics.
+        path: Prometheus text file to write.
+        every: Seconds between writes.
+    """
+    while True:
+        await asyncio.sleep(every)
+        metrics.write(path)
+
+
+def main(args):
+    """Run the --serve mode of the script.
+
+    Args:
+        args: Parsed command line flags.
+    """
+    try:
+        log = journal.Journal(args.journal) if args.journal else None
+    except (OSError, ValueError) as error:
+        raise SystemExit(f'--journal {args.journal}: {error}') from None
+    server = Server(
+        bool(args.profile or args.metrics),
+        instrument.Capture(args.capture, args.sample, args.capture_file)
+        if args.capture else None,
+        slab.Slab(args.slab) if args.slab else None, args.idle, args.hot,
+        log, args.fsync == 'group')
+    if log is not None:
+        began = time.perf_counter()
+        count = server.recover()
+        print(f'Recovered {count} games from {args.journal} in'
+              f' {time.perf_counter() - began:.1f}s', flush=True)
+
+    def ready(port):
+        print(f'Serving Grackle tables on {args.host}:{port}', flush=True)
+
+    async def serve():
+        if args.metrics:
+            asyncio.get_running_loop().create_task(
+                export(server.metrics, args.metrics))
+        if server.slab is not None:
+            asyncio.get_running_loop().create_task(sweep(server))
+        if log is not None and server.group:
+            asyncio.get_running_loop().create_task(
+                commit(server, args.group_window))
+        await server.serve(args.host, args.serve, ready)
+
+    began = time.perf_counter()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        elapsed = time.perf_counter() - began
+        print(f'\n{server.actions} actions in {elapsed:.1f}s,'
+              f' {len(server.games)} games left', file=sys.stderr)
+        if server.watch_updates:
+            print(f'{server.watch_updates} spectator updates in'
+                  f' {server.fanout:.1f}s', file=sys.stderr)
+        if log is not None:
+            print(f'{log.syncs} journal syncs', file=sys.stderr)
+            log.compact(server.checkpoint())
+            log.close()
+        if server.slab is not None:
+            print(f'{len(server.slab)} more games hibernated;'
+                  f' {server.hibernated} hibernations,'
+                  f' {server.woken} wake-ups', file=sys.stderr)
+            server.slab.close()
+        if server.capture:
+            server.capture.stop()
+        if server.metrics:
+            server.metrics.summary(sys.stderr)
+            if args.metrics:
+                server.metrics.write(args.metrics)
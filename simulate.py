@@ -0,0 +1,401 @@
+"""Monte Carlo simulation of Grackle games with computer players.
+
+Games are split in chunks over a process pool.  Every game gets its own
+seed derived from the run seed and the game number, so results do not
+depend on the number of workers or on how games were chunked.
+
+    python grackle.py --simulate 100000 -p 3 -c 3 --policy greedy,random
+"""
+import collections
+import concurrent.futures
+import hashlib
+import os
+import random
+import sys
+import time
+from typing import NamedTuple
+
+import engine
+import instrument
+import mcts  # pylint: disable=unused-import (registers 'ismcts')
+import policies
+import replay
+import results
+import stream
+import tablebot  # pylint: disable=unused-import (registers 'table')
+import variants
+
+
+MAX_TURNS = 500  # Games still running after this many turns are unfinished
+CHUNK_MAX = 2000  # Most games handed to a worker at once
+HISTOGRAM_ROWS = 20  # Most rows of the game length histogram
+
+
+class Config(NamedTuple):
+    """Rule settings of a game, as given by the command line flags.
+    """
+    players: int = engine.PLAYER_MIN
+    coins: int = engine.HAND_MIN
+    remove: int = 0
+    future: bool = False
+
+    @classmethod
+    def from_args(cls, args):
+        """Config of parsed command line flags.
+        """
+        return cls(args.players, args.coins, args.remove, args.future)
+
+    def __str__(self):
+        flags = f'-p {self.players} -c {self.coins} -r {self.remove}'
+        return flags + (' -f' if self.future else '')
+
+
+class GameResult(NamedTuple):
+    """Outcome of one simulated game.
+    """
+    seed: int
+    winner: int  # Seat, or engine.NONE if the game hit the turn limit
+    turns: int
+    decisions: int
+    removed: tuple  # Coin ids
+    plays: tuple  # Number of times each coin id was played
+
+
+def derive(*parts):
+    """Derive an independent 64 bit seed.
+
+    Args:
+        parts: Anything with a stable str(), e.g. (run seed, 'game', 12).
+
+    Returns:
+        Integer seed.
+    """
+    key = '/'.join(map(str, parts)).encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(),
+                          'little')
+
+
+def play_game(config, seats, seed, check=False, max_turns=MAX_TURNS,
+              bus=None, archive=None, profile=False, capture=None,
+              effects=engine.EFFECTS):
+    """Play one game between policies.
+
+    Args:
+        config: Config of the game.
+        seats: List of policies.Policy, one per seat.
+        seed: Seed of the game; seeds the engine and every policy.
+        check: Verify every coin move (see engine.Table).
+        max_turns: Give up on the game after this many turns.
+        bus: stream.Bus to publish the events on, if any.
+        archive: replay.Archive to record the game in, if any.
+        profile: Record metrics into instrument.METRICS.
+        capture: instrument.Capture to tell about the turns, if any.
+        effects: Effect of every coin, see variants.py.
+
+    Returns:
+        GameResult.
+    """
+    metrics = instrument.METRICS if profile else None
+    table = engine.new_table(
+        *config, seed=seed, check=check,
+        table_class=variants.table_class(
+            effects, instrument.ProfiledTable if profile else engine.Table))
+    for seat, policy in enumerate(seats):
+        policy.start(seat, table, random.Random(derive(seed, 'seat', seat)))
+        policy.observe(table.events)
+    if bus:
+        bus.publish(table.events, table)
+    if capture:
+        capture.observe(table.events)
+    recorder = replay.Recorder(table) if archive else None
+    plays = [0] * len(engine.COIN_NAMES)
+    decisions = 0
+    while table.pending[0] != engine.DONE and table.turn <= max_turns:
+        if metrics:
+            began = time.perf_counter()
+        action = seats[table.current].act(table)
+        wind = table.seed
+        if metrics:
+            acted = time.perf_counter()
+            metrics.observe(instrument.WAIT, acted - began)
+        events = table.step(action)
+        if metrics:
+            metrics.observe(instrument.STEP, time.perf_counter() - acted)
+        if capture:
+            capture.observe(events)
+        if recorder:
+            recorder.add(action, wind, table)
+        decisions += 1
+        for event in events:
+            if event.kind == engine.PLAYED:
+                plays[event.coin] += 1
+        for policy in seats:
+            policy.observe(events)
+        if bus:
+            bus.publish(events, table)
+    if bus:
+        bus.close()
+    if recorder:
+        archive.write(recorder)
+    return GameResult(seed, table.winner, table.turn, decisions,
+                      table.removed, tuple(plays))
+
+
+class Stats:
+    """Aggregate results of many games; mergeable across workers.
+    """
+    def __init__(self, players):
+        """Empty statistics.
+
+        Args:
+            players: Number of seats.
+        """
+        self.games = 0
+        self.wins = [0] * players
+        self.unfinished = 0
+        self.turns = collections.Counter()  # turns -> games
+        self.plays = [0] * len(engine.COIN_NAMES)
+        self.decisions = 0
+        self.metrics = None  # instrument.Metrics of profiled games
+        self.rows = None  # results.columns() of the games, when kept
+
+    def add(self, result):
+        """Count one GameResult.
+        """
+        self.games += 1
+        if result.winner == engine.NONE:
+            self.unfinished += 1
+        else:
+            self.wins[result.winner] += 1
+        self.turns[result.turns] += 1
+        for coin, count in enumerate(result.plays):
+            self.plays[coin] += count
+        self.decisions += result.decisions
+
+    def merge(self, other):
+        """Add the counts of another Stats.
+        """
+        self.games += other.games
+        self.wins = [a + b for a, b in zip(self.wins, other.wins)]
+        self.unfinished += other.unfinished
+        self.turns.update(other.turns)
+        self.plays = [a + b for a, b in zip(self.plays, other.plays)]
+        self.decisions += other.decisions
+        if other.metrics and self.metrics:
+            self.metrics.merge(other.metrics)
+        elif other.metrics:
+            self.metrics = other.metrics
+
+    def percentile(self, fraction):
+        """Game length (turns) at a fraction of the games, e.g. 0.5.
+        """
+        wanted = fraction * self.games
+        seen = 0
+        for turns in sorted(self.turns):
+            seen += self.turns[turns]
+            if seen >= wanted:
+                return turns
+        return 0
+
+    def report(self, names, out=sys.stdout):
+        """Print win rate by seat, game lengths and coin play frequency.
+
+        Args:
+            names: Policy name per seat.
+            out: File to print to.
+        """
+        games = self.games or 1
+        print('Seat  Policy          Wins   Win rate', file=out)
+        for seat, wins in enumerate(self.wins):
+            print(f'{seat+1:>4}  {names[seat]:<14} {wins:>6}'
+                  f' {wins/games:>9.2%}', file=out)
+        if self.unfinished:
+            print(f'Unfinished after {MAX_TURNS} turns: {self.unfinished}',
+                  file=out)
+        mean = sum(t * n for t, n in self.turns.items()) / games
+        print(f'Turns per game: mean {mean:.1f},'
+              f' p10 {self.percentile(0.1)}, median {self.percentile(0.5)},'
+              f' p90 {self.percentile(0.9)}, p99 {self.percentile(0.99)},'
+              f' max {max(self.turns, default=0)}', file=out)
+        buckets = collections.Counter()
+        step = -(-max(self.turns, default=0) // HISTOGRAM_ROWS) or 1
+        for turns, count in self.turns.items():
+            buckets[turns // step * step] += count
+        width = max(buckets.values(), default=1)
+        for turns in sorted(buckets):
+            count = buckets[turns]
+            bar = '#' * max(1, round(40 * count / width))
+            label = f'{turns}-{turns+step-1}' if step > 1 else f'{turns}'
+            print(f'  {label:>7} {count/games:>7.2%} {bar}', file=out)
+        print('Coin plays per game:', file=out)
+        for coin, count in sorted(enumerate(self.plays),
+                                  key=lambda item: -item[1]):
+            print(f'  {engine.COIN_NAMES[coin]:<13} {count/games:6.3f}',
+                  file=out)
+
+
+def run_chunk(config, names, seed, start, stop, check=False, options=None,
+              log=None, record=None, profile=False, capture=None,
+              variant=None, keep=False):
+    """Play games start..stop-1 of a run; executed by pool workers.
+
+    Args:
+        config: Config of the games.
+        names: Policy name per seat.
+        seed: Seed of the whole run.
+        start: First game number.
+        stop: Game number after the last one.
+        check: Verify every coin move.
+        options: Dict of policy settings, see policies.seat_policies().
+        log: Text file to write every event to as JSON lines, if any.
+        record: Name of an existing record file to append the games to.
+        profile: Collect instrument metrics of the games into the Stats.
+        capture: instrument.Capture profiling the first turns, if any.
+        variant: Name of a variant file to play, if any.
+        keep: Keep the result of every game in the rows of the Stats.
+
+    Returns:
+        Stats of the chunk.
+    """
+    seats = policies.seat_policies(','.join(names), config.players,
+                                   **(options or {}))
+    effects = variants.load(variant) if variant else engine.EFFECTS
+    stats = Stats(config.players)
+    archive = replay.Archive(record) if record else None
+    games = []
+    for index in range(start, stop):
+        bus = stream.Bus(stream.JsonLines(log, game=index)) if log else None
+        result = play_game(config, seats, derive(seed, 'game', index),
+                           check, bus=bus, archive=archive, profile=profile,
+                           capture=capture, effects=effects)
+        stats.add(result)
+        if keep:
+            games.append(result)
+    for policy in seats:
+        policy.close()
+    if archive:
+        archive.close()
+    if profile:
+        stats.metrics = instrument.METRICS.take()
+    if keep:
+        stats.rows = results.columns(config, games)
+    return stats
+
+
+def run(config, names, games, seed, workers=None, check=False,
+        progress=None, options=None, log=None, record=None, profile=False,
+        capture=None, variant=None, store=None):
+    """Simulate games over a process pool.
+
+    Args:
+        config: Config of the games.
+        names: Policy name per seat.
+        games: Number of games.
+        seed: Seed of the whole run.
+        workers: Number of processes; 1 runs in this process.
+        check: Verify every coin move.
+        progress: File to show live throughput on, or None.
+        options: Dict of policy settings, see policies.seat_policies().
+        log: Text file to write every event to as JSON lines, if any; the
+            games are then played in this process.
+        record: Name of a record file to append every game to.
+        profile: Collect instrument metrics into the Stats.
+        capture: instrument.Capture profiling the first turns, if any;
+            the games are then played in this process.
+        variant: Name of a variant file to play, if any.
+        store: Directory of a results.Store to append every game to.
+
+    Returns:
+        Stats of all games.
+    """
+    workers = 1 if log or capture else workers or os.cpu_count() or 1
+    if record:
+        replay.Archive(record).close()  # Create it before the workers
+    saved = results.Store(store, create=True) if store else None
+    size = max(1, min(CHUNK_MAX, games // (workers * 20)))
+    chunks = [(start, min(start + size, games))
+              for start in range(0, games, size)]
+    stats = Stats(config.players)
+    began = time.perf_counter()
+
+    def done(chunk_stats):
+        if saved is not None:
+            saved.append(chunk_stats.rows)
+        stats.merge(chunk_stats)
+        if progress:
+            rate = stats.games / (time.perf_counter() - began)
+            print(f'\r{stats.games}/{games} games, {rate:,.0f} games/s ',
+                  end='', file=progress, flush=True)
+
+    if workers == 1:
+        for start, stop in chunks:
+            done(run_chunk(config, names, seed, start, stop, check,
+                           options, log, record, profile, capture,
+                           variant, bool(store)))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(run_chunk, config, names, seed, start,
+                                   stop, check, options, None, record,
+                                   profile, None, variant, bool(store))
+                       for start, stop in chunks]
+            for future in concurrent.futures.as_completed(futures):
+                done(future.result())
+    if progress:
+        print(file=progress)
+    return stats
+
+
+def main(args):
+    """Run the --simulate mode of the script.
+
+    Args:
+        args: Parsed command line flags.
+    """
+    config = Config.from_args(args)
+    names = [policy.name for policy in
+             policies.seat_policies(args.policy, config.players)]
+    options = {'budget': args.think, 'workers': args.search_workers,
+               'tables': args.tables}
+    seed = args.seed if args.seed is not None else random.getrandbits(32)
+    profile = bool(args.profile or args.metrics)
+    capture = (instrument.Capture(args.capture, args.sample,
+                                  args.capture_file)
+               if args.capture else None)
+    if args.variant:
+        if args.batch or args.record or args.store:
+            raise SystemExit('--variant cannot be used with --batch,'
+                             ' --record or --store: they assume the usual'
+                             ' effects')
+        try:  # Fail before starting the workers
+            variants.load(args.variant)
+        except (OSError, ValueError) as error:
+            raise SystemExit(f'--variant {args.variant}: {error}') from None
+    print(f'Simulating {args.simulate} games ({config}) with seed {seed}...')
+    began = time.perf_counter()
+    if args.batch:
+        import batch  # pylint: disable=import-outside-toplevel (cycle)
+        stats = batch.run(config, names, args.simulate, seed, args.workers,
+                          progress=sys.stderr, store=args.store)
+    elif args.log:
+        with open(args.log, 'w') as log:
+            stats = run(config, names, args.simulate, seed, args.workers,
+                        args.debug, sys.stderr, options, log, args.record,
+                        profile, capture, args.variant, args.store)
+    else:
+        stats = run(config, names, args.simulate, seed, args.workers,
+                    args.debug, sys.stderr, options, record=args.record,
+                    profile=profile, capture=capture, variant=args.variant,
+                    store=args.store)
+    if capture:
+        capture.stop()
+    elapsed = time.perf_counter() - began
+    rates = f'{stats.games/elapsed:,.0f} games/s'
+    if stats.decisions:  # not counted by the batch simulator
+        rates += f', {stats.decisions/elapsed:,.0f} decisions/s'
+    print(f'{stats.games} games in {elapsed:.1f}s: {rates}')
+    stats.report(names)
+    if stats.metrics:
+        print()
+        stats.metrics.summary()
+        if args.metrics:
+            stats.metrics.write(args.metrics)
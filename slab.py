@@ -0,0 +1,108 @@
+"""Fixed-size records in a memory-mapped file.
+
+The game server hibernates idle games here (see server.py).  Record `index`
+lives at offset index * size: a length byte, 0 for a free slot, then the
+data.  The file is sparse and grows by doubling, so slots nobody used take
+no disk space, and the pages of the map are file backed: the kernel writes
+back and drops those not touched lately instead of growing the resident
+memory of the process.
+
+A slab is scratch space, emptied when it is opened; it is not a way to keep
+games over a restart.
+"""
+import mmap
+
+
+SIZE = 64  # Default bytes per slot, the length byte included
+INITIAL = 1 << 20  # Bytes mapped at first
+
+
+class Slab:
+    """Memory-mapped file of fixed-size slots.
+    """
+    def __init__(self, path, size=SIZE):
+        """Create an empty slab, replacing any file of that name.
+
+        Args:
+            path: File name.
+            size: Bytes per slot, at most 256.
+        """
+        if not 2 <= size <= 256:
+            raise ValueError(f'Bad slot size {size}')
+        self.size = size
+        # pylint: disable-next=consider-using-with
+        self.file = open(path, 'w+b')
+        self.map = None
+        self.length = 0
+        self.used = 0  # Slots holding data
+        self._grow(INITIAL)
+
+    def _grow(self, length):
+        """Extend the file and map it again.
+        """
+        if self.map is not None:
+            self.map.close()
+        self.file.truncate(length)
+        self.map = mmap.mmap(self.file.fileno(), length)
+        self.length = length
+
+    def put(self, index, data):
+        """Store data in a slot, replacing what was there.
+
+        Args:
+            index: Slot number.
+            data: bytes, shorter than the slot.
+
+        Raises:
+            ValueError: the data does not fit.
+        """
+        if len(data) >= self.size:
+            raise ValueError(f'{len(data)} bytes do not fit a slot of'
+                             f' {self.size}')
+        start = index * self.size
+        if start + self.size > self.length:
+            self._grow(max(start + self.size, 2 * self.length))
+        if not self.map[start]:
+            self.used += 1
+        self.map[start + 1:start + 1 + len(data)] = data
+        self.map[start] = len(data)
+
+    def get(self, index):
+        """Data of a slot.
+
+        Args:
+            index: Slot number.
+
+        Returns:
+            bytes, or None for a free slot.
+        """
+        start = index * self.size
+        if start >= self.length or not self.map[start]:
+            return None
+        return self.map[start + 1:start + 1 + self.map[start]]
+
+    def free(self, index):
+        """Mark a slot free.
+        """
+        start = index * self.size
+        if start < self.length and self.map[start]:
+            self.map[start] = 0
+            self.used -= 1
+
+    def items(self):
+        """Slot number and data of every used slot, in slot order.
+        """
+        size = self.size
+        for start in range(0, self.length, size):
+            if self.map[start]:
+                yield start // size, self.map[start + 1:start + 1
+                                              + self.map[start]]
+
+    def __len__(self):
+        return self.used
+
+    def close(self):
+        """Unmap and close the file.
+        """
+        self.map.close()
+        self.file.close()
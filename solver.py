@@ -0,0 +1,320 @@
+"""Perfect information solver for small 2 player games.
+
+With every hand and the pile order visible, a game is a tree of the
+current player's decisions plus chance at each gust of wind.  The solver
+runs depth-limited alpha-beta (expectiminimax) over it, deepening one ply
+at a time, with a bounded transposition table keyed by packed.PackedState.
+
+Values are from the first player's point of view: 1 if they win, -1 if
+they lose, 0 where the search horizon was reached.  The chest's extra turn
+needs nothing special: the same player simply decides again.  Boots and
+mirror chains resolve inside engine.apply(), so they are part of the move
+that started them.  A shuffle by the wind becomes a chance node over every
+order of the new pile when there are at most CHANCE_EXACT of them, and
+over CHANCE_SAMPLES orders otherwise, drawn from the run seed and the
+position so that runs repeat (the value is then an estimate).
+
+    python grackle.py --solve 5 -r 5 --depth 20
+"""
+import collections
+import itertools
+import math
+import random
+import sys
+import time
+
+import engine
+import packed
+import simulate
+
+
+DEPTH = 16  # Default search depth, in decisions
+TABLE_SIZE = 1 << 20  # Default number of transposition table entries
+CHANCE_EXACT = 120  # Enumerate every pile order up to this many (5!)
+CHANCE_SAMPLES = 8  # Orders sampled for larger piles
+EXACT, LOWER, UPPER = 0, 1, 2  # What a stored value is
+
+
+class Entry(collections.namedtuple(
+        'Entry', 'key depth value flag move sampled')):
+    """A transposition table entry; sampled if the value rests on a
+    sampled wind shuffle.
+    """
+    __slots__ = ()
+
+
+class TranspositionTable:
+    """Bounded map from positions to search results.
+
+    'depth' replacement is a direct-mapped table that keeps the deeper of
+    two colliding entries; 'lru' evicts the least recently used entry.
+    """
+    def __init__(self, size=TABLE_SIZE, replacement='depth'):
+        """Create an empty table.
+
+        Args:
+            size: Maximum number of entries.
+            replacement: 'depth' or 'lru'.
+        """
+        if replacement not in ('depth', 'lru'):
+            raise ValueError(f'Unknown replacement {replacement!r}')
+        self.size = size
+        self.replacement = replacement
+        if replacement == 'depth':
+            self.slots = [None] * size
+        else:
+            self.slots = collections.OrderedDict()
+        self.probes = self.hits = self.stores = self.evictions = 0
+
+    def get(self, key):
+        """Look up a position.
+
+        Args:
+            key: PackedState.
+
+        Returns:
+            Entry or None.
+        """
+        self.probes += 1
+        if self.replacement == 'depth':
+            entry = self.slots[hash(key) % self.size]
+            if entry is not None and entry.key != key:
+                entry = None
+        else:
+            entry = self.slots.get(key)
+            if entry is not None:
+                self.slots.move_to_end(key)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def put(self, entry):
+        """Store a search result, subject to the replacement policy.
+        """
+        if self.replacement == 'depth':
+            index = hash(entry.key) % self.size
+            old = self.slots[index]
+            if old is not None and old.key != entry.key:
+                if old.depth > entry.depth:
+                    return
+                self.evictions += 1
+            self.slots[index] = entry
+        else:
+            self.slots[entry.key] = entry
+            self.slots.move_to_end(entry.key)
+            if len(self.slots) > self.size:
+                self.slots.popitem(last=False)
+                self.evictions += 1
+        self.stores += 1
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups that found their position."""
+        return self.hits / self.probes if self.probes else 0.0
+
+
+class _ChanceTable(engine.Table):
+    """Table whose wind shuffle can be set to a given order.
+    """
+    __slots__ = ('order', 'shuffled')
+
+    def __init__(self, state, order=None):
+        super().__init__(state)
+        self.order = order
+        self.shuffled = 0
+
+    def mix(self, coins):
+        self.shuffled = len(coins)
+        if self.order is None:
+            super().mix(coins)
+        else:
+            coins[:] = [coins[index] for index in self.order]
+
+
+class Solver:
+    """Expectiminimax search with a transposition table.
+    """
+    def __init__(self, table=None, chance_exact=CHANCE_EXACT,
+                 chance_samples=CHANCE_SAMPLES, seed=0):
+        """Create a solver.
+
+        Args:
+            table: TranspositionTable; a default sized one if None.
+            chance_exact: Enumerate wind shuffles up to this many orders.
+            chance_samples: Orders sampled for larger shuffles.
+            seed: Seed of the sampled orders.
+        """
+        self.table = table or TranspositionTable()
+        self.chance_exact = chance_exact
+        self.chance_samples = chance_samples
+        self.seed = seed
+        self.nodes = 0
+        self.chance_nodes = 0
+        self.sampled = 0  # Chance nodes sampled rather than enumerated
+
+    def outcomes(self, state, action):
+        """States an action can lead to.
+
+        Returns:
+            List of (probability, GameState).
+        """
+        table = _ChanceTable(state)
+        table.step(action)
+        if not table.shuffled:
+            return [(1.0, table.freeze())]
+        self.chance_nodes += 1
+        count = table.shuffled
+        if math.factorial(count) <= self.chance_exact:
+            orders = list(itertools.permutations(range(count)))
+        else:
+            self.sampled += 1
+            rng = random.Random(
+                simulate.derive(self.seed, packed.pack(state), action))
+            orders = [rng.sample(range(count), count)
+                      for _ in range(self.chance_samples)]
+        results = []
+        for order in orders:
+            table = _ChanceTable(state, order)
+            table.step(action)
+            results.append((1 / len(orders), table.freeze()))
+        return results
+
+    def search(self, state, depth, alpha=-1.0, beta=1.0):
+        """Value of a position for the first player.
+
+        Args:
+            state: engine.GameState.
+            depth: Remaining decisions to look ahead.
+            alpha: Value the first player is already assured of.
+            beta: Value the second player is already assured of.
+
+        Returns:
+            (value, best action or None, whether the value rests on a
+            sampled wind shuffle).
+        """
+        self.nodes += 1
+        if state.winner != engine.NONE:
+            return (1.0 if state.winner == 0 else -1.0), None, False
+        if depth <= 0:
+            return 0.0, None, False
+        key = packed.pack(state)
+        entry = self.table.get(key)
+        first = None
+        if entry is not None:
+            first = entry.move
+            if entry.depth >= depth:
+                if (entry.flag == EXACT
+                        or entry.flag == LOWER and entry.value >= beta
+                        or entry.flag == UPPER and entry.value <= alpha):
+                    return entry.value, entry.move, entry.sampled
+        actions = list(engine.legal_actions(state))
+        if first in actions:
+            actions.remove(first)
+            actions.insert(0, first)
+        maximize = state.current == 0
+        low, high = alpha, beta
+        best, move = (-2.0 if maximize else 2.0), None
+        sampled = False
+        for action in actions:
+            value = 0.0
+            before = self.sampled
+            outcomes = self.outcomes(state, action)
+            sampled |= self.sampled > before
+            for probability, child in outcomes:
+                if len(outcomes) == 1:
+                    result, _, guessed = self.search(child, depth - 1, low,
+                                                     high)
+                else:
+                    result, _, guessed = self.search(child, depth - 1)
+                value += probability * result
+                sampled |= guessed
+            if maximize and value > best or not maximize and value < best:
+                best, move = value, action
+            if maximize:
+                low = max(low, best)
+            else:
+                high = min(high, best)
+            if low >= high:
+                break
+        if best <= alpha:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.put(Entry(key, depth, best, flag, move, sampled))
+        return best, move, sampled
+
+    def solve(self, state, depth=DEPTH):
+        """Search deeper and deeper until the value is proven or depth.
+
+        Args:
+            state: engine.GameState of a 2 player game.
+            depth: Deepest search, in decisions.
+
+        Returns:
+            (value, best action, depth reached, whether the value rests on
+            a sampled wind shuffle and is only an estimate).
+
+        Raises:
+            ValueError: the game does not have 2 players.
+        """
+        if state.players != 2:
+            raise ValueError('The solver only handles 2 player games')
+        value, move, reached, sampled = 0.0, None, 0, False
+        for reached in range(1, depth + 1):
+            value, move, sampled = self.search(state, reached)
+            if abs(value) == 1.0:
+                break
+        return value, move, reached, sampled
+
+
+def describe(state, action):
+    """Readable name of an action.
+    """
+    decision = state.pending[0]
+    if decision == engine.PLAY and action == engine.NONE:
+        return 'skip'
+    if decision in (engine.TARGET, engine.OPP_COIN, engine.ROPE_MOVE):
+        return f'{decision} {action}'
+    return engine.COIN_NAMES[action]
+
+
+def main(args, out=sys.stdout):
+    """Run the --solve mode of the script: solve opening deals.
+
+    Args:
+        args: Parsed command line flags.
+        out: File to print to.
+    """
+    config = simulate.Config.from_args(args)
+    seed = args.seed if args.seed is not None else random.getrandbits(32)
+    solver = Solver(TranspositionTable(args.tt_size, args.replacement),
+                    seed=seed)
+    print(f'Solving {args.solve} deals ({config}) with seed {seed},'
+          f' depth {args.depth}...', file=out)
+    for index in range(args.solve):
+        state, _ = engine.new_game(
+            *config, seed=simulate.derive(seed, 'game', index))
+        nodes = solver.nodes
+        began = time.perf_counter()
+        value, move, reached, sampled = solver.solve(state, args.depth)
+        elapsed = time.perf_counter() - began
+        nodes = solver.nodes - nodes
+        hands = ' vs '.join(
+            ' '.join(engine.COIN_NAMES[coin] for coin in hand)
+            for hand in state.hands)
+        pile = ' '.join(engine.COIN_NAMES[coin] for coin in state.pile)
+        if sampled:
+            verdict = 'estimate'
+        elif abs(value) == 1.0:
+            verdict = 'proven'
+        else:
+            verdict = 'at horizon'
+        print(f'Deal {index+1}: {hands} | pile {pile}', file=out)
+        print(f'  value {value:+.3f} ({verdict}, depth {reached}),'
+              f' best first move {describe(state, move)}', file=out)
+        print(f'  {nodes} nodes in {elapsed:.2f}s'
+              f' ({nodes/max(elapsed, 1e-9):,.0f} nodes/s),'
+              f' table hit rate {solver.table.hit_rate:.1%},'
+              f' {solver.chance_nodes} chance nodes so far', file=out)
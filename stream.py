@@ -0,0 +1,227 @@
+"""Event stream of a game: what each kind of event means, who may see it,
+and who is listening.
+
+The engine reports what happened in a step as engine.Event tuples, one
+type tagged by its kind, so that simulations and searches pay nothing for
+them.  KINDS describes each kind: which fields it uses, under what names,
+and its visibility scope.  Drivers publish the events of every step on a
+Bus; renderers subscribed to it show or record them.  The terminal UI of
+the console game is one renderer (see grackle.py), JsonLines another, and
+a NullSink is never even called, so runs nobody watches format nothing.
+"""
+import json
+from typing import NamedTuple
+
+import engine
+from engine import NONE
+
+
+# Visibility scopes: who sees the coins of an event (everything else about
+# an event is public)
+PUBLIC = 'public'  # Everyone
+OWN = 'own'  # The player of the event only
+INVOLVED = 'involved'  # The player and the target; everyone without target
+VICTIM = 'victim'  # The target only; everyone without target
+HIDDEN = 'hidden'  # Nobody
+
+OBSERVER = -2  # Seat of a spectator: sees what everyone sees
+
+COIN_FIELDS = frozenset(('coin', 'given', 'taken'))  # Named by coin
+
+
+class Kind(NamedTuple):
+    """Description of an event kind.
+    """
+    scope: str
+    fields: tuple  # Names of player, coin, target, other; None if unused
+
+
+KINDS = {
+    engine.TURN: Kind(PUBLIC, ('player', None, None, None)),
+    engine.AGAIN: Kind(PUBLIC, ('player', None, None, None)),
+    engine.REMOVED: Kind(HIDDEN, (None, 'coin', None, None)),
+    engine.DEALT: Kind(OWN, ('player', 'coin', None, None)),
+    engine.PADDED: Kind(OWN, ('player', 'coin', None, None)),
+    engine.DREW: Kind(OWN, ('player', 'coin', None, None)),
+    engine.LARDER_USED: Kind(PUBLIC, ('player', 'coin', None, None)),
+    engine.SKIPPED: Kind(PUBLIC, ('player', None, None, None)),
+    engine.PLAYED: Kind(PUBLIC, ('player', 'coin', None, None)),
+    engine.SHIELDED: Kind(PUBLIC, ('player', 'coin', 'target', None)),
+    engine.BURIED: Kind(VICTIM, ('player', 'coin', 'target', None)),
+    engine.KILLED: Kind(PUBLIC, ('player', 'coin', 'target', None)),
+    engine.TRADED: Kind(INVOLVED, ('player', 'given', 'target', 'taken')),
+    engine.SAW: Kind(OWN, ('player', 'coin', 'target', 'position')),
+    engine.PUT_BACK: Kind(OWN, ('player', 'coin', None, None)),
+    engine.STORED: Kind(OWN, ('player', 'coin', None, None)),
+    engine.REORDERED: Kind(OWN, ('player', 'coin', None, None)),
+    engine.ROPED: Kind(PUBLIC, ('player', None, None, None)),
+    engine.SHIELD_ON: Kind(PUBLIC, ('player', None, None, None)),
+    engine.SHIELD_OFF: Kind(PUBLIC, ('player', None, None, None)),
+    engine.SHUFFLED: Kind(PUBLIC, ('player', None, None, None)),
+    engine.WON: Kind(PUBLIC, ('player', None, None, None)),
+    }
+
+
+def sees(event, seat):
+    """Checks if a seat sees the coins of an event.
+
+    Args:
+        event: engine.Event.
+        seat: Seat looking at it, or OBSERVER; None sees everything.
+
+    Returns:
+        Boolean.
+    """
+    if seat is None:
+        return True
+    scope = KINDS[event.kind].scope
+    if scope == PUBLIC:
+        return True
+    if scope == OWN:
+        return seat == event.player
+    if scope == INVOLVED:
+        return event.target == NONE or seat in (event.player, event.target)
+    if scope == VICTIM:
+        return event.target in (NONE, seat)
+    return False
+
+
+def visible(event, seat):
+    """What a seat sees of an event.
+
+    Args:
+        event: engine.Event.
+        seat: Seat looking at it, or OBSERVER; None sees everything.
+
+    Returns:
+        engine.Event, with the coins the seat does not see set to NONE.
+    """
+    if sees(event, seat):
+        return event
+    if event.kind == engine.TRADED:
+        return event._replace(coin=NONE, other=NONE)
+    return event._replace(coin=NONE)
+
+
+def as_dict(event):
+    """Event with its fields named as in KINDS and coins by name.
+
+    Args:
+        event: engine.Event.
+
+    Returns:
+        Dict, e.g. {'kind': 'played', 'player': 0, 'coin': '[arrow]'}; coins
+        that were not seen are None.
+    """
+    record = {'kind': event.kind}
+    for name, value in zip(KINDS[event.kind].fields, event[1:]):
+        if name in COIN_FIELDS:
+            record[name] = engine.COIN_NAMES[value] if value != NONE else None
+        elif name:
+            record[name] = value if value != NONE else None
+    return record
+
+
+class Renderer:
+    """Something subscribed to a Bus that shows or records events.
+    """
+    active = True  # False: the bus never calls it
+
+    def render(self, events, state):
+        """Handle the events of one step.
+
+        Args:
+            events: Sequence of engine.Event.
+            state: engine.GameState or engine.Table after the events.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Called when the game is over.
+        """
+
+
+class NullSink(Renderer):
+    """Renderer that drops everything; the bus does not even call it.
+    """
+    active = False
+
+    def render(self, events, state):
+        pass
+
+
+class JsonLines(Renderer):
+    """Writes every event as a line of JSON (see as_dict()), with the turn.
+    """
+    def __init__(self, out, seat=None, game=None):
+        """Log events to a file.
+
+        Args:
+            out: Text file to write to.
+            seat: Only log what this seat sees; None logs everything.
+            game: Added to every line as "game", if given.
+        """
+        self.out = out
+        self.seat = seat
+        self.game = game
+
+    def render(self, events, state):
+        lines = []
+        for event in events:
+            record = as_dict(visible(event, self.seat))
+            record['turn'] = state.turn
+            if self.game is not None:
+                record['game'] = self.game
+            lines.append(json.dumps(record))
+        if lines:
+            lines.append('')
+            self.out.write('\n'.join(lines))
+
+    def close(self):
+        self.out.flush()
+
+
+class Bus:
+    """Hands the events of every step to the subscribed renderers.
+    """
+    def __init__(self, *renderers):
+        """Create a bus.
+
+        Args:
+            renderers: Renderers to subscribe right away.
+        """
+        self.renderers = []
+        for renderer in renderers:
+            self.subscribe(renderer)
+
+    def subscribe(self, renderer):
+        """Add a renderer; inactive ones (NullSink) are left out.
+
+        Returns:
+            The renderer.
+        """
+        if renderer.active:
+            self.renderers.append(renderer)
+        return renderer
+
+    def unsubscribe(self, renderer):
+        """Remove a renderer.
+        """
+        if renderer in self.renderers:
+            self.renderers.remove(renderer)
+
+    def publish(self, events, state):
+        """Send the events of a step to every renderer.
+
+        Args:
+            events: Sequence of engine.Event.
+            state: engine.GameState or engine.Table after the events.
+        """
+        for renderer in self.renderers:
+            renderer.render(events, state)
+
+    def close(self):
+        """Close every renderer; the game is over.
+        """
+        for renderer in self.renderers:
+            renderer.close()
@@ -0,0 +1,438 @@
+"""Sweeps over the rule settings, with the games cached on disk.
+
+A sweep simulates every cell of a grid of settings (players, coins,
+remove, future: the flags of grackle.py) between the same policies, over
+all cores, and prints a matrix of one result by cell, e.g. how far apart
+the win rates of the seats are.  The games of a cell are played in blocks
+of BLOCK game numbers, each game seeded from the sweep seed and its number
+as in simulate.py, and the statistics of every block are saved to an
+SQLite cache under the key
+
+    (settings, policy of every seat, seed, first game, engine version)
+
+so running a sweep again only plays the blocks missing: those of new
+cells, more games of a cell, or cells whose engine version changed.  The
+engine version is a digest of the source of every module of this
+directory that the games load, so any change to the rules or the policies
+invalidates the blocks they played; those are dropped from the cache when
+the sweep runs.
+
+    python sweep.py run sweep.db --policy greedy --games 20000
+    python sweep.py run sweep.db -p 2-4 -c 2,3 -r 0-2 --value win:1
+    python sweep.py show sweep.db --rows players --columns coins
+
+Each axis takes a list (2,3), a range (0-5) or 'all'.
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import engine
+import policies
+import simulate
+
+
+BLOCK = 1000  # Games per cached block, and per chunk handed to a worker
+GAMES = 10000  # Default games per cell
+REPORT_INTERVAL = 10.0  # Seconds between progress lines
+AXES = {  # Flag: every value
+    'players': range(engine.PLAYER_MIN, engine.PLAYER_MAX + 1),
+    'coins': range(engine.HAND_MIN, engine.HAND_MAX + 1),
+    'remove': range(engine.REMOVE_MAX + 1),
+    'future': range(2),
+    }
+VALUES = ('spread', 'turns', 'unfinished', 'win:SEAT')  # Shown by cell
+SPREAD = 'spread'
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    config TEXT, policy TEXT, seed INTEGER, start INTEGER, version TEXT,
+    stats TEXT, PRIMARY KEY (config, policy, seed, start, version))
+    WITHOUT ROWID;
+"""
+
+
+def engine_version():
+    """Digest of the source of the modules that play simulated games.
+
+    Every module loaded from this directory counts, so that one imported
+    by simulate.py, or by a module it imports, is not missed.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    paths = set()
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if path and os.path.dirname(os.path.abspath(path)) == directory:
+            paths.add(os.path.abspath(path))
+    digest = hashlib.blake2b(digest_size=8)
+    for path in sorted(paths):
+        with open(path, 'rb') as source:
+            digest.update(os.path.basename(path).encode() + b'\0')
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def axis(text, name):
+    """Values of an axis of the grid.
+
+    Args:
+        text: 'all', comma separated values and ranges like 0-2.
+        name: Key of AXES.
+
+    Returns:
+        Sorted list of ints.
+
+    Raises:
+        ValueError: values outside those of the axis.
+    """
+    allowed = AXES[name]
+    if text == 'all':
+        return list(allowed)
+    values = set()
+    for part in text.split(','):
+        low, _, high = part.partition('-')
+        values.update(range(int(low), int(high or low) + 1))
+    outside = sorted(values - set(allowed))
+    if outside or not values:
+        raise ValueError(f'--{name} takes {allowed[0]} to {allowed[-1]},'
+                         f' not {outside or text}')
+    return sorted(values)
+
+
+def grid(players, coins, remove, future):
+    """Settings of every cell of a sweep.
+
+    Args:
+        players, coins, remove, future: Lists of values of each axis.
+
+    Returns:
+        List of simulate.Config.
+    """
+    return [simulate.Config(*cell) for cell in
+            itertools.product(players, coins, remove, map(bool, future))]
+
+
+def seating(policy, players):
+    """Policy name of every seat, as cached.
+    """
+    return ','.join(policy.name for policy in
+                    policies.seat_policies(policy, players))
+
+
+def dump(stats):
+    """Stats of a block as JSON.
+    """
+    return json.dumps({'games': stats.games, 'wins': stats.wins,
+                       'unfinished': stats.unfinished,
+                       'turns': sorted(stats.turns.items()),
+                       'plays': stats.plays, 'decisions': stats.decisions})
+
+
+def load(text, players):
+    """Stats of a block saved by dump().
+    """
+    saved = json.loads(text)
+    stats = simulate.Stats(players)
+    stats.games = saved['games']
+    stats.wins = saved['wins']
+    stats.unfinished = saved['unfinished']
+    stats.turns.update(dict(saved['turns']))
+    stats.plays = saved['plays']
+    stats.decisions = saved['decisions']
+    return stats
+
+
+class Cache:
+    """Statistics of the blocks of games played by sweeps.
+    """
+    def __init__(self, path, version=None):
+        """Open or create a cache.
+
+        Args:
+            path: File name.
+            version: Engine version of the blocks used; engine_version()
+                if None.
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.version = version or engine_version()
+
+    def blocks(self, config, policy, seed):
+        """Blocks of a cell in the cache.
+
+        Returns:
+            Dict of first game number: Stats.
+        """
+        rows = self.connection.execute(
+            'SELECT start, stats FROM blocks WHERE config = ? AND policy = ?'
+            ' AND seed = ? AND version = ?',
+            (str(config), policy, seed, self.version))
+        return {start: load(stats, config.players) for start, stats in rows}
+
+    def add(self, config, policy, seed, start, stats):
+        """Save the Stats of a block.
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?)',
+                (str(config), policy, seed, start, self.version, dump(stats)))
+
+    def prune(self):
+        """Drop the blocks of other engine versions.
+
+        Returns:
+            Number of blocks dropped.
+        """
+        with self.connection:
+            return self.connection.execute(
+                'DELETE FROM blocks WHERE version != ?',
+                (self.version,)).rowcount
+
+    def close(self):
+        """Close the cache.
+        """
+        self.connection.close()
+
+
+def collect(cache, cells, policy, games, seed):
+    """Statistics of the cells from the cache, and the blocks missing.
+
+    Args:
+        cache: Cache.
+        cells: List of simulate.Config.
+        policy: Policy name for every seat, or comma separated per seat.
+        games: Games per cell, rounded up to whole blocks.
+        seed: Seed of the sweep.
+
+    Returns:
+        (dict of Config: Stats of the cached blocks, list of (Config,
+        first game number) of the blocks to play).
+    """
+    found = {}
+    missing = []
+    for config in cells:
+        blocks = cache.blocks(config, seating(policy, config.players), seed)
+        found[config] = simulate.Stats(config.players)
+        for start in range(0, games, BLOCK):
+            if start in blocks:
+                found[config].merge(blocks[start])
+            else:
+                missing.append((config, start))
+    return found, missing
+
+
+def play_block(config, policy, seed, start):
+    """Play a block of games of a cell; executed by pool workers.
+
+    Returns:
+        simulate.Stats of the block.
+    """
+    names = seating(policy, config.players).split(',')
+    return simulate.run_chunk(config, names, seed, start, start + BLOCK)
+
+
+def run(cache, cells, policy, games=GAMES, seed=0, workers=None,
+        progress=None):
+    """Play the blocks of a sweep missing from the cache.
+
+    Args:
+        cache: Cache to read and fill.
+        cells: List of simulate.Config.
+        policy: Policy name for every seat, or comma separated per seat.
+        games: Games per cell, rounded up to whole blocks.
+        seed: Seed of the sweep.
+        workers: Number of processes; 1 plays in this process.
+        progress: File to show progress on, or None.
+
+    Returns:
+        Dict of Config: Stats of its games.
+    """
+    found, missing = collect(cache, cells, policy, games, seed)
+    if progress:
+        print(f'{len(cells)} cells: {len(missing) * BLOCK} games to play,'
+              f' {sum(stats.games for stats in found.values())} cached',
+              file=progress, flush=True)
+    workers = workers or os.cpu_count() or 1
+    began = reported = time.perf_counter()
+    done = 0
+
+    def finished(config, start, stats):
+        nonlocal done, reported
+        cache.add(config, seating(policy, config.players), seed, start, stats)
+        found[config].merge(stats)
+        done += 1
+        now = time.perf_counter()
+        if progress and (now - reported >= REPORT_INTERVAL
+                         or done == len(missing)):
+            reported = now
+            print(f'{done}/{len(missing)} blocks,'
+                  f' {done * BLOCK / (now - began):,.0f} games/s',
+                  file=progress, flush=True)
+
+    if workers == 1:
+        for config, start in missing:
+            finished(config, start, play_block(config, policy, seed, start))
+        return found
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(play_block, config, policy, seed, start):
+                   (config, start) for config, start in missing}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                finished(*futures[future], future.result())
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return found
+
+
+def value(stats, name):
+    """One result of a cell.
+
+    Args:
+        stats: simulate.Stats of the cell.
+        name: One of VALUES, with a seat from 1 for win:SEAT.
+
+    Returns:
+        Float, or None if the cell has no such value.
+    """
+    if not stats.games:
+        return None
+    if name == SPREAD:
+        return (max(stats.wins) - min(stats.wins)) / stats.games
+    if name == 'turns':
+        return sum(turns * count
+                   for turns, count in stats.turns.items()) / stats.games
+    if name == 'unfinished':
+        return stats.unfinished / stats.games
+    seat = int(name.partition(':')[2]) - 1
+    return stats.wins[seat] / stats.games if seat < len(stats.wins) else None
+
+
+def matrix(found, name, rows='players', columns='remove', out=sys.stdout):
+    """Print a value of the cells as matrices.
+
+    Cells differing in the other two axes go to separate matrices.
+
+    Args:
+        found: Dict of simulate.Config: Stats.
+        name: Value shown, see value().
+        rows: Axis of the rows.
+        columns: Axis of the columns.
+        out: Text file to print on.
+    """
+    others = [other for other in AXES if other not in (rows, columns)]
+    row_values = sorted({getattr(config, rows) for config in found})
+    column_values = sorted({getattr(config, columns) for config in found})
+    split = sorted({tuple(getattr(config, other) for other in others)
+                    for config in found})
+    cells = {(getattr(config, rows), getattr(config, columns),
+              tuple(getattr(config, other) for other in others)): stats
+             for config, stats in found.items()}
+    percent = name != 'turns'
+    for part in split:
+        print(f'{name} by {rows} (rows) and {columns} (columns), '
+              + ', '.join(f'{other} {int(setting)}'
+                          for other, setting in zip(others, part)), file=out)
+        print(f'{"":>8}' + ''.join(f'{int(column):>9}'
+                                   for column in column_values), file=out)
+        for row in row_values:
+            shown = []
+            for column in column_values:
+                stats = cells.get((row, column, part))
+                result = value(stats, name) if stats else None
+                shown.append('-' if result is None else
+                             f'{result:.1%}' if percent else f'{result:.2f}')
+            print(f'{int(row):>8}' + ''.join(f'{text:>9}' for text in shown),
+                  file=out)
+        print(file=out)
+
+
+def main(argv=None):
+    """Run a sweep or show what its cache holds.
+
+    Args:
+        argv: Command line arguments; sys.argv if None.
+
+    Returns:
+        Exit status.
+    """
+    parser = argparse.ArgumentParser(
+        description='Sweeps over the Grackle rule settings')
+    commands = parser.add_subparsers(dest='command', required=True)
+    running = commands.add_parser(
+        'run', help='Play the games of a sweep missing from its cache.')
+    showing = commands.add_parser(
+        'show', help='Show the cached games of a sweep, playing none.')
+    for command in (running, showing):
+        command.add_argument('path', help='Cache file of the games.')
+        for name, flag in (('players', '-p'), ('coins', '-c'),
+                           ('remove', '-r'), ('future', '-f')):
+            command.add_argument(flag, f'--{name}', default='all',
+                                 help=f'Values of {name} swept'
+                                      ' (default: all).')
+        command.add_argument('--policy', default='random',
+                             help='One policy for every seat or comma'
+                                  ' separated policies per seat.')
+        command.add_argument('--games', default=GAMES, type=int,
+                             help=f'Games per cell, in blocks of {BLOCK}'
+                                  f' (default: {GAMES}).')
+        command.add_argument('--seed', default=0, type=int,
+                             help='Seed of the sweep.')
+        command.add_argument('--value', default=SPREAD,
+                             help=f'Value shown: {", ".join(VALUES)}'
+                                  f' (default: {SPREAD}).')
+        command.add_argument('--rows', default='players', choices=AXES,
+                             help='Axis of the rows of the matrix.')
+        command.add_argument('--columns', default='remove', choices=AXES,
+                             help='Axis of the columns of the matrix.')
+    running.add_argument('--workers', default=os.cpu_count(), type=int,
+                         help='Number of processes.')
+    args = parser.parse_args(argv)
+    if args.value not in VALUES[:-1] and not (
+            args.value.startswith('win:') and args.value[4:].isdigit()):
+        parser.error(f'Unknown --value {args.value!r}')
+    if args.rows == args.columns:
+        parser.error('--rows and --columns must be different axes')
+    try:
+        cells = grid(*(axis(getattr(args, name), name) for name in AXES))
+        for name in args.policy.split(','):
+            if name.strip() not in policies.POLICIES:
+                raise ValueError(f'Unknown policy {name.strip()!r}')
+    except ValueError as error:
+        parser.error(str(error))
+    games = -(-args.games // BLOCK) * BLOCK
+    cache = Cache(args.path)
+    try:
+        if args.command == 'show':
+            found, _ = collect(cache, cells, args.policy, games, args.seed)
+        else:
+            pruned = cache.prune()
+            if pruned:
+                print(f'Dropped {pruned} blocks of other engine versions',
+                      file=sys.stderr)
+            began = time.perf_counter()
+            try:
+                found = run(cache, cells, args.policy, games, args.seed,
+                            args.workers, sys.stderr)
+            except KeyboardInterrupt:
+                print('Stopped; run again to play the remaining games.',
+                      file=sys.stderr)
+                return 130
+            print(f'Done in {time.perf_counter() - began:.1f}s',
+                  file=sys.stderr)
+    finally:
+        cache.close()
+    print(f'{args.policy}, {games} games per cell, seed {args.seed}')
+    matrix(found, args.value, args.rows, args.columns)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
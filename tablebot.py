@@ -0,0 +1,474 @@
+"""Precomputed policy tables, and the bot answering from them.
+
+Most decisions depend mostly on what a seat can see at a glance: the coins
+in its hand, the coins in play and the shields.  An offline build plays
+many games per configuration, groups the decisions met by that
+information (see information()), and picks an action for each group by
+playing on from the real positions behind it with rollouts.  The table is
+written as an open-addressing hash table of 64 bit slots, read back
+through mmap, so loading costs nothing and a lookup is one hash and
+usually one read.  Decisions the table has no answer for are left to the
+greedy policy.
+
+    python tablebot.py build -p 2 -c 2
+    python tablebot.py build --all --games 50000
+    python grackle.py --simulate 10000 --policy table,greedy
+"""
+import argparse
+import concurrent.futures
+import math
+import mmap
+import os
+import random
+import statistics
+import struct
+import sys
+import time
+
+import engine
+import mcts
+import packed
+import policies
+from engine import NONE, CHEST, KEY
+
+
+MAGIC = b'GRKT\x01\x00\x00\x00'  # File signature and format version 1
+TABLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables')
+GAMES = 20000  # Default games played to find the decisions of a build
+ROLLOUTS = 32  # Default rollouts per action of a decision
+DEPTH = 40  # Default decisions per rollout before mcts.evaluate()
+KEEP = 16  # Positions kept per information set
+MIN_SEEN = 2  # Information sets seen fewer times are left out
+SIGNIFICANCE = 3.0  # Standard errors an action must gain over greedy
+LOAD = 0.5  # Most slots used of the hash table
+# Header after MAGIC: players, coins, remove, future, slot bits, entries
+_HEADER = struct.Struct('<BBBBII')
+_HEADER_BYTES = 32  # MAGIC, header and padding up to the slots
+_HASH = 0x9E3779B97F4A7C15  # Fibonacci hashing multiplier
+_WORD = (1 << 64) - 1
+
+# Decisions answered from the table: those decided by hand and field
+TABULATED = frozenset((engine.PLAY, engine.GIVE, engine.PURSE,
+                       engine.MIRROR_PICK, engine.SHOVEL_PICK))
+_PICKS = frozenset((engine.MIRROR_PICK, engine.SHOVEL_PICK))
+_CODES = packed.DECISION_CODES
+
+
+def information(state):
+    """Key of what the current seat sees at a glance.
+
+    Picks from the field see it whole; other decisions only see whether
+    the chest and key are in play and how many coins are, which groups
+    enough positions together for each group to be seen often.
+
+    Args:
+        state: engine.GameState or engine.Table.
+
+    Returns:
+        Integer: the decision, the hand and field as coin masks, and
+        whether the seat and any opponent are shielded.
+    """
+    seat = state.current
+    shields = state.shields
+    shielded = shields[seat] | (sum(shields) > shields[seat]) << 1
+    decision = state.pending[0]
+    in_play = state.in_play
+    if decision in _PICKS:
+        field = packed.mask(in_play)
+    else:
+        field = ((CHEST in in_play) | (KEY in in_play) << 1
+                 | min(len(in_play), 7) << 2)
+    hand = 0
+    for coin in state.hands[seat]:
+        hand |= 1 << coin
+    return _CODES[decision] | hand << 4 | field << 19 | shielded << 34
+
+
+def file_name(players, coins, remove=0, future=False):
+    """Name of the table of a configuration.
+    """
+    return f'p{players}c{coins}r{remove}{"f" if future else ""}.grt'
+
+
+class PolicyTable:
+    """Table of actions by information() key, read through mmap.
+    """
+    def __init__(self, path):
+        """Open a table file.
+
+        Args:
+            path: File name.
+
+        Raises:
+            ValueError: not a policy table file.
+        """
+        with open(path, 'rb') as data:
+            self.buffer = mmap.mmap(data.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a policy table file')
+        (self.players, self.coins, self.remove, future, bits,
+         self.entries) = _HEADER.unpack_from(self.buffer, len(MAGIC))
+        self.future = bool(future)
+        self.shift = 64 - bits
+        self.mask = (1 << bits) - 1
+        slots = memoryview(self.buffer)[_HEADER_BYTES:]
+        if sys.byteorder == 'little':
+            self.slots = slots.cast('Q')
+        else:
+            self.slots = struct.unpack(f'<{len(slots) // 8}Q', slots)
+
+    def get(self, key):
+        """Action stored for a key.
+
+        Returns:
+            Action, or None if the key is not in the table.
+        """
+        index = (key * _HASH & _WORD) >> self.shift
+        slots, mask = self.slots, self.mask
+        wanted = key + 1
+        while True:
+            slot = slots[index]
+            if not slot:
+                return None
+            if slot >> 8 == wanted:
+                return (slot & 0xFF) - 1
+            index = (index + 1) & mask
+
+    def close(self):
+        """Unmap the file.
+        """
+        if isinstance(self.slots, memoryview):
+            self.slots.release()
+        self.buffer.close()
+
+
+def write(path, config, actions):
+    """Write a table file.
+
+    Args:
+        path: File name.
+        config: (players, coins, remove, future).
+        actions: Dict of information() key: action.
+    """
+    bits = 4
+    while len(actions) > LOAD * (1 << bits):
+        bits += 1
+    slots = [0] * (1 << bits)
+    mask = (1 << bits) - 1
+    for key, action in actions.items():
+        index = (key * _HASH & _WORD) >> (64 - bits)
+        while slots[index]:
+            index = (index + 1) & mask
+        slots[index] = (key + 1) << 8 | (action + 1)
+    players, coins, remove, future = config
+    header = MAGIC + _HEADER.pack(players, coins, remove, bool(future),
+                                  bits, len(actions))
+    with open(path, 'wb') as out:
+        out.write(header.ljust(_HEADER_BYTES, b'\0'))
+        out.write(struct.pack(f'<{len(slots)}Q', *slots))
+
+
+_LOADED = {}  # path: PolicyTable, shared by the bots of a process
+
+
+def load(path):
+    """PolicyTable of a file, opened once per process.
+    """
+    table = _LOADED.get(path)
+    if table is None:
+        table = _LOADED[path] = PolicyTable(path)
+    return table
+
+
+@policies.register
+class TablePolicy(policies.Policy):
+    """Answers from a precomputed policy table; greedy where it has none.
+    """
+    name = 'table'
+    options = ('tables',)
+
+    def __init__(self, tables=TABLES):
+        """Create the bot.
+
+        Args:
+            tables: Directory of the table files, see file_name().
+        """
+        self.tables = tables
+        self.table = None
+        self.fallback = policies.GreedyPolicy()
+
+    def start(self, seat, state, rng):
+        """Open the table of the game's configuration.
+
+        Raises:
+            ValueError: there is no table for it.
+        """
+        super().start(seat, state, rng)
+        self.fallback.start(seat, state, rng)
+        path = os.path.join(self.tables, file_name(
+            state.players, state.hand_size, len(state.removed),
+            state.future))
+        if not os.path.exists(path):
+            raise ValueError(f'No policy table {path}; build it with'
+                             f' python tablebot.py build')
+        self.table = load(path)
+
+    def act(self, state):
+        actions = engine.legal_actions(state)
+        if len(actions) == 1:
+            return actions[0]
+        if state.pending[0] in TABULATED:
+            action = self.table.get(information(state))
+            if action in actions:
+                return action
+        return self.fallback.act(state)
+
+
+class _Playout(engine.Table):
+    """Table of a rollout: nobody reads its events, so skip them.
+    """
+    __slots__ = ()
+    trusted = True
+
+    def emit(self, kind, player, coin=NONE, target=NONE, other=NONE):
+        pass
+
+
+def collect(config, games, seed, keep=KEEP):
+    """Play greedy games and group their tabulated decisions.
+
+    Args:
+        config: (players, coins, remove, future).
+        games: Number of games.
+        seed: Seed of the games.
+        keep: Positions kept per information set (reservoir sampled).
+
+    Returns:
+        Dict of information() key: (times seen, list of engine.GameState).
+    """
+    rng = random.Random(seed)
+    seats = [policies.GreedyPolicy() for _ in range(config[0])]
+    found = {}
+    for _ in range(games):
+        table = engine.new_table(*config, seed=rng.getrandbits(64))
+        for seat, policy in enumerate(seats):
+            policy.start(seat, table, rng)
+        while table.pending[0] != engine.DONE:
+            if (table.pending[0] in TABULATED
+                    and len(table.legal_actions()) > 1):
+                key = information(table)
+                seen, positions = found.get(key, (0, []))
+                if len(positions) < keep:
+                    positions.append(table.freeze())
+                else:
+                    index = rng.randrange(seen + 1)
+                    if index < keep:
+                        positions[index] = table.freeze()
+                found[key] = (seen + 1, positions)
+            table.step(seats[table.current].act(table))
+    return found
+
+
+def playout(table, rng, depth):
+    """Play on with the greedy policy for every seat.
+
+    Args:
+        table: engine.Table, played in place.
+        rng: random.Random of the policies.
+        depth: Decisions to play before mcts.evaluate().
+
+    Returns:
+        List of rewards per seat.
+    """
+    seats = [policies.GreedyPolicy() for _ in range(table.players)]
+    for seat, policy in enumerate(seats):
+        policy.start(seat, table, rng)
+    for _ in range(depth):
+        if table.winner != NONE:
+            rewards = [0.0] * table.players
+            rewards[table.winner] = 1.0
+            return rewards
+        table.step(seats[table.current].act(table))
+    return mcts.evaluate(table)
+
+
+def choose(positions, rollouts, depth, seed):
+    """Action that plays clearly better than greedy from a set of positions.
+
+    Every action is tried from the same positions with the same winds and
+    policy choices (common random numbers), and compared rollout by
+    rollout with the action greedy takes there.  Play goes on greedily, as
+    in the games the positions come from, so the table is one step of
+    policy improvement over the greedy policy; an action is only kept
+    when its gain is beyond SIGNIFICANCE standard errors, since a wrong
+    entry costs more than a missing one.
+
+    Args:
+        positions: engine.GameState sharing one information() key.
+        rollouts: Rollouts per action, spread over the positions.
+        depth: Decisions per rollout before mcts.evaluate().
+        seed: Seed of the rollouts.
+
+    Returns:
+        Action, or None where greedy is as good as anything.
+    """
+    rng = random.Random(seed)
+    seeds = [rng.getrandbits(64) for _ in range(rollouts)]
+    seat = positions[0].current
+    rewards = {}
+    for action in engine.legal_actions(positions[0]):
+        rewards[action] = []
+        for index, world in enumerate(seeds):
+            table = _Playout(positions[index % len(positions)])
+            table.seed = world  # Other winds, other worlds
+            table.step(action)
+            rewards[action].append(
+                playout(table, random.Random(world), depth)[seat])
+    greedy = policies.GreedyPolicy()
+    base = []
+    for index, world in enumerate(seeds):
+        position = positions[index % len(positions)]
+        greedy.start(seat, position, random.Random(world))
+        base.append(rewards[greedy.act(position)][index])
+    best, best_gain = None, 0.0
+    for action, scores in rewards.items():
+        gains = [score - other for score, other in zip(scores, base)]
+        gain = statistics.fmean(gains)
+        error = statistics.stdev(gains) / math.sqrt(len(gains))
+        if gain > best_gain and gain > SIGNIFICANCE * error:
+            best, best_gain = action, gain
+    return best
+
+
+def _choose_chunk(work, rollouts, depth):
+    """choose() for many information sets; executed by pool workers.
+
+    Returns:
+        List of (key, action or None).
+    """
+    return [(key, choose(positions, rollouts, depth, seed))
+            for key, positions, seed in work]
+
+
+def build(config, games=GAMES, rollouts=ROLLOUTS, depth=DEPTH, seed=0,
+          workers=None, progress=None):
+    """Compute the table of a configuration.
+
+    Args:
+        config: (players, coins, remove, future).
+        games: Games played to find the decisions.
+        rollouts: Rollouts per action of a decision.
+        depth: Decisions per rollout before mcts.evaluate().
+        seed: Seed of the build.
+        workers: Number of processes; 1 builds in this process.
+        progress: File to show progress on, or None.
+
+    Returns:
+        Dict of information() key: action, for the information sets where
+        an action beats greedy.
+    """
+    found = collect(config, games, seed)
+    rng = random.Random(seed)
+    work = [(key, positions, rng.getrandbits(64))
+            for key, (seen, positions) in sorted(found.items())
+            if seen >= MIN_SEEN]
+    workers = workers or os.cpu_count() or 1
+    size = max(1, len(work) // (workers * 20))
+    chunks = [work[start:start + size]
+              for start in range(0, len(work), size)]
+    actions = {}
+    checked = 0
+
+    def done(chosen):
+        nonlocal checked
+        checked += len(chosen)
+        actions.update((key, action) for key, action in chosen
+                       if action is not None)
+        if progress:
+            print(f'\r{checked}/{len(work)} information sets,'
+                  f' {len(actions)} better than greedy ',
+                  end='', file=progress, flush=True)
+
+    if workers == 1:
+        for chunk in chunks:
+            done(_choose_chunk(chunk, rollouts, depth))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(_choose_chunk, chunk, rollouts, depth)
+                       for chunk in chunks]
+            for future in concurrent.futures.as_completed(futures):
+                done(future.result())
+    if progress:
+        print(file=progress)
+    return actions
+
+
+def configs(args):
+    """Configurations asked for on the command line.
+    """
+    if not args.all:
+        return [(args.players, args.coins, args.remove, args.future)]
+    return [(players, coins, args.remove, args.future)
+            for players in range(engine.PLAYER_MIN, engine.PLAYER_MAX + 1)
+            for coins in range(engine.HAND_MIN, engine.HAND_MAX + 1)]
+
+
+def main(argv=None):
+    """Build policy tables or describe one.
+
+    Args:
+        argv: Command line arguments; sys.argv if None.
+    """
+    parser = argparse.ArgumentParser(
+        description='Precomputed policy tables for the Grackle table bot')
+    commands = parser.add_subparsers(dest='command', required=True)
+    make = commands.add_parser('build', help='Build tables.')
+    make.add_argument('-p', '--players', default=engine.PLAYER_MIN,
+                      type=int, help='Number of players.')
+    make.add_argument('-c', '--coins', default=engine.HAND_MIN, type=int,
+                      help='Number of coins in each hand.')
+    make.add_argument('-r', '--remove', default=0, type=int,
+                      help='Number of coins removed before the game.')
+    make.add_argument('-f', '--future', action='store_true',
+                      help='Hand padding.')
+    make.add_argument('--all', action='store_true',
+                      help='Build every number of players and coins.')
+    make.add_argument('--games', default=GAMES, type=int,
+                      help=f'Games played to find the decisions'
+                           f' (default: {GAMES}).')
+    make.add_argument('--rollouts', default=ROLLOUTS, type=int,
+                      help=f'Rollouts per action (default: {ROLLOUTS}).')
+    make.add_argument('--depth', default=DEPTH, type=int,
+                      help=f'Decisions per rollout (default: {DEPTH}).')
+    make.add_argument('--seed', default=0, type=int,
+                      help='Seed of the build.')
+    make.add_argument('--workers', default=os.cpu_count(), type=int,
+                      help='Number of processes.')
+    make.add_argument('--tables', default=TABLES, metavar='DIR',
+                      help='Directory to write the tables to.')
+    info = commands.add_parser('info', help='Describe a table file.')
+    info.add_argument('path')
+    args = parser.parse_args(argv)
+    if args.command == 'info':
+        table = PolicyTable(args.path)
+        print(f'-p {table.players} -c {table.coins} -r {table.remove}'
+              f'{" -f" if table.future else ""}: {table.entries}'
+              f' information sets in {len(table.slots)} slots,'
+              f' {len(table.buffer):,} bytes')
+        table.close()
+        return 0
+    os.makedirs(args.tables, exist_ok=True)
+    for config in configs(args):
+        began = time.perf_counter()
+        actions = build(config, args.games, args.rollouts, args.depth,
+                        args.seed, args.workers, sys.stderr)
+        path = os.path.join(args.tables, file_name(*config))
+        write(path, config, actions)
+        print(f'{path}: {len(actions)} information sets'
+              f' in {time.perf_counter() - began:.1f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,496 @@
+"""Round-robin tournaments between computer players, with ratings.
+
+Every lineup of the policies plays the same number of games over a process
+pool: each order of them over the seats, so that no policy keeps the seats
+that move first.  With fewer policies than seats, lineups repeat policies.
+
+Results go to an SQLite database as they come in, a batch of games per
+transaction.  A stopped tournament goes on where it was when run again on
+the same database, and more games can be asked for later.  Every game has
+its own seed, derived from the tournament seed, lineup and round, so the
+games played do not depend on the workers or on interruptions.
+
+Ratings are Elo points from a Bradley-Terry fit of the games, each game
+counting as the winner beating every other policy at the table (a draw
+against each when it hit the turn limit), with 95% confidence intervals
+from the curvature of the likelihood.  The progress lines show them
+settling as the games come in.
+
+    python tournament.py run cup.db random,greedy,ismcts -p 3 --games 200
+    python tournament.py report cup.db
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+
+import engine
+import policies
+import simulate
+
+
+GAMES = 100  # Default games per lineup
+CHUNK_MAX = 100  # Most games of a lineup handed to a worker at once
+BATCH = 500  # Games saved per transaction, at most
+COMMIT_INTERVAL = 5.0  # Seconds between transactions, at most
+REPORT_INTERVAL = 10.0  # Seconds between progress lines
+ELO = 400 / math.log(10)  # Elo points per unit of log odds
+PRIOR = 1000 / ELO  # Spread of ratings assumed before any game, log odds
+Z95 = 1.96  # Half width of a 95% interval, in standard deviations
+ITERATIONS = 50  # Most Newton steps of the rating fit
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS games (
+    lineup INTEGER, round INTEGER, winner INTEGER, turns INTEGER,
+    PRIMARY KEY (lineup, round)) WITHOUT ROWID;
+"""
+
+
+def lineups(names, players):
+    """Seatings of a tournament, in a fixed order.
+
+    Args:
+        names: Distinct policy names.
+        players: Number of seats.
+
+    Returns:
+        List of tuples of policy name per seat.
+    """
+    if len(names) >= players:
+        return list(itertools.permutations(names, players))
+    return [lineup for lineup in itertools.product(names, repeat=players)
+            if len(set(lineup)) > 1]
+
+
+class Results:
+    """Tournament database: its settings and the games played so far.
+    """
+    def __init__(self, path):
+        """Open or create a database.
+
+        Args:
+            path: File name.
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+
+    def settings(self, settings=None):
+        """Settings of the tournament, set on first use.
+
+        Args:
+            settings: Dict of settings to start the tournament with, or
+                None to read them.
+
+        Returns:
+            Dict of settings; None if the tournament was never started.
+
+        Raises:
+            ValueError: the database holds a different tournament.
+        """
+        row = self.connection.execute(
+            "SELECT value FROM settings WHERE key = 'tournament'").fetchone()
+        saved = json.loads(row[0]) if row else None
+        if settings is None or saved == settings:
+            return saved
+        if saved is not None:
+            raise ValueError(f'The database holds another tournament:'
+                             f' {saved}')
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO settings VALUES ('tournament', ?)",
+                (json.dumps(settings),))
+        return settings
+
+    def games(self):
+        """Games played so far.
+
+        Returns:
+            List of (lineup, round, winner, turns).
+        """
+        return self.connection.execute(
+            'SELECT lineup, round, winner, turns FROM games').fetchall()
+
+    def add(self, games):
+        """Save games in one transaction.
+
+        Args:
+            games: List of (lineup, round, winner, turns).
+        """
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?)', games)
+
+    def close(self):
+        """Close the database.
+        """
+        self.connection.close()
+
+
+class Ratings:
+    """Pairwise scores between policies, and the ratings they give.
+    """
+    def __init__(self, names, seatings):
+        """No games yet.
+
+        Args:
+            names: Policy names.
+            seatings: lineups() of the tournament.
+        """
+        self.names = list(names)
+        self.seatings = [[self.names.index(name) for name in seating]
+                         for seating in seatings]
+        count = len(self.names)
+        self.scores = [[0.0] * count for _ in range(count)]  # a beat b
+        self.games = [0] * count
+        self.wins = [0] * count
+
+    def add(self, lineup, winner):
+        """Count one game.
+
+        Args:
+            lineup: Index into the seatings.
+            winner: Seat of the winner, or engine.NONE.
+        """
+        seating = self.seatings[lineup]
+        for policy in set(seating):
+            self.games[policy] += 1
+        scores = self.scores
+        if winner == engine.NONE:
+            for first, second in itertools.combinations(set(seating), 2):
+                scores[first][second] += 0.5
+                scores[second][first] += 0.5
+            return
+        best = seating[winner]
+        self.wins[best] += 1
+        for other in set(seating) - {best}:
+            scores[best][other] += 1
+
+    def fit(self):
+        """Ratings of the games so far.
+
+        Returns:
+            List of (Elo rating, half width of its 95% interval) by policy;
+            the ratings are centred on 0.
+        """
+        count = len(self.names)
+        ratings = [0.0] * count
+        for _ in range(ITERATIONS):
+            gradient, hessian = self._derivatives(ratings)
+            step = _solve(hessian, gradient)
+            ratings = [rating - change
+                       for rating, change in zip(ratings, step)]
+            if max(map(abs, step)) < 1e-9:
+                break
+        _, hessian = self._derivatives(ratings)
+        mean = sum(ratings) / count
+        result = []
+        for policy in range(count):  # Variance of rating - mean
+            contrast = [-1 / count] * count
+            contrast[policy] += 1
+            covariance = _solve(hessian, [-value for value in contrast])
+            variance = sum(map(float.__mul__, contrast, covariance))
+            result.append(((ratings[policy] - mean) * ELO,
+                           Z95 * math.sqrt(max(variance, 0.0)) * ELO))
+        return result
+
+    def _derivatives(self, ratings):
+        """Gradient and Hessian of the log posterior of ratings.
+        """
+        count = len(ratings)
+        gradient = [-rating / PRIOR ** 2 for rating in ratings]
+        hessian = [[0.0] * count for _ in range(count)]
+        for first in range(count):
+            hessian[first][first] = -1 / PRIOR ** 2
+            for second in range(count):
+                games = (self.scores[first][second]
+                         + self.scores[second][first])
+                if first == second or not games:
+                    continue
+                chance = 1 / (1 + math.exp(ratings[second]
+                                           - ratings[first]))
+                gradient[first] += self.scores[first][second] - games * chance
+                weight = games * chance * (1 - chance)
+                hessian[first][first] -= weight
+                hessian[first][second] += weight
+        return gradient, hessian
+
+    def report(self, out=sys.stdout):
+        """Print the ratings, best first.
+        """
+        ratings = self.fit()
+        print('Policy           Rating      95%    Games   Win rate', file=out)
+        for policy in sorted(range(len(self.names)),
+                             key=lambda policy: -ratings[policy][0]):
+            rating, width = ratings[policy]
+            games = self.games[policy]
+            rate = self.wins[policy] / games if games else 0.0
+            print(f'{self.names[policy]:<14} {rating:+8.0f}  {width:7.0f}'
+                  f' {games:8}  {rate:8.2%}', file=out)
+
+    def summary(self):
+        """One line of ratings, for progress reports.
+        """
+        return ', '.join(f'{name} {rating:+.0f}±{width:.0f}'
+                         for name, (rating, width)
+                         in zip(self.names, self.fit()))
+
+
+def _solve(matrix, vector):
+    """Solve a small dense linear system by Gaussian elimination.
+
+    Args:
+        matrix: Square list of lists, invertible.
+        vector: Right hand side.
+
+    Returns:
+        List x with matrix x = vector.
+    """
+    count = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for column in range(count):
+        pivot = max(range(column, count),
+                    key=lambda row: abs(rows[row][column]))
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        lead = rows[column]
+        for row in rows[column + 1:]:
+            factor = row[column] / lead[column]
+            for index in range(column, count + 1):
+                row[index] -= factor * lead[index]
+    solution = [0.0] * count
+    for column in reversed(range(count)):
+        row = rows[column]
+        total = row[count] - sum(row[index] * solution[index]
+                                 for index in range(column + 1, count))
+        solution[column] = total / row[column]
+    return solution
+
+
+def play_chunk(config, seating, lineup, rounds, seed, options):
+    """Play some rounds of one lineup; executed by pool workers.
+
+    Args:
+        config: simulate.Config of the games.
+        seating: Policy name per seat.
+        lineup: Index of the seating in the tournament.
+        rounds: List of round numbers to play.
+        seed: Seed of the tournament.
+        options: Dict of policy settings, see policies.seat_policies().
+
+    Returns:
+        List of (lineup, round, winner, turns).
+    """
+    seats = policies.seat_policies(','.join(seating), config.players,
+                                   **options)
+    games = []
+    for number in rounds:
+        result = simulate.play_game(
+            config, seats, simulate.derive(seed, 'lineup', lineup, number))
+        games.append((lineup, number, result.winner, result.turns))
+    for policy in seats:
+        policy.close()
+    return games
+
+
+def run(path, names, config, games=GAMES, seed=0, workers=None,
+        options=None, progress=None):
+    """Play the games of a tournament that are not in its database yet.
+
+    Args:
+        path: Database file name; created if needed.
+        names: Distinct policy names.
+        config: simulate.Config of the games.
+        games: Games per lineup.
+        seed: Seed of the tournament.
+        workers: Number of processes; 1 plays in this process.
+        options: Dict of policy settings, see policies.seat_policies().
+        progress: File to show progress and ratings on, or None.
+
+    Returns:
+        Ratings of every game in the database.
+
+    Raises:
+        ValueError: unknown policy, or the database holds another
+            tournament.
+    """
+    for name in names:
+        if name not in policies.POLICIES:
+            raise ValueError(f'Unknown policy {name!r}')
+    if len(set(names)) != len(names) or len(names) < 2:
+        raise ValueError('A tournament needs at least two distinct policies')
+    options = options or {}
+    results = Results(path)
+    try:
+        results.settings({'policies': list(names), 'config': list(config),
+                          'seed': seed, 'options': options})
+        seatings = lineups(names, config.players)
+        ratings = Ratings(names, seatings)
+        played = set()
+        for lineup, number, winner, _ in results.games():
+            ratings.add(lineup, winner)
+            played.add((lineup, number))
+        missing = [[number for number in range(games)
+                    if (lineup, number) not in played]
+                   for lineup in range(len(seatings))]
+        size = max(1, min(CHUNK_MAX, games // 10))
+        chunks = [(lineup, rounds[start:start + size])
+                  for start in range(0, games, size)
+                  for lineup, rounds in enumerate(missing)
+                  if rounds[start:start + size]]  # Lineups take turns
+        _play(results, ratings, config, seatings, chunks, seed, workers,
+              options, progress)
+    finally:
+        results.close()
+    return ratings
+
+
+def _play(results, ratings, config, seatings, chunks, seed, workers,
+          options, progress):
+    """Play chunks of games, saving and rating them as they end.
+    """
+    total = sum(len(rounds) for _, rounds in chunks)
+    workers = workers or os.cpu_count() or 1
+    began = reported = committed = time.perf_counter()
+    batch = []
+    done = 0
+
+    def finished(games):
+        nonlocal done, reported, committed
+        for lineup, _, winner, _ in games:
+            ratings.add(lineup, winner)
+        batch.extend(games)
+        done += len(games)
+        now = time.perf_counter()
+        if len(batch) >= BATCH or now - committed >= COMMIT_INTERVAL:
+            results.add(batch)
+            batch.clear()
+            committed = now
+        if progress and (now - reported >= REPORT_INTERVAL or done == total):
+            reported = now
+            print(f'{done}/{total} games, {done/(now - began):,.1f} games/s;'
+                  f' {ratings.summary()}', file=progress, flush=True)
+
+    try:
+        if workers == 1:
+            for lineup, rounds in chunks:
+                finished(play_chunk(config, seatings[lineup], lineup, rounds,
+                                    seed, options))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                futures = [pool.submit(play_chunk, config, seatings[lineup],
+                                       lineup, rounds, seed, options)
+                           for lineup, rounds in chunks]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        finished(future.result())
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+    finally:
+        if batch:
+            results.add(batch)
+
+
+def report(path, out=sys.stdout):
+    """Ratings of the games in a tournament database.
+
+    Args:
+        path: Database file name.
+        out: Text file to print on.
+
+    Returns:
+        Ratings, or None if the database holds no tournament.
+    """
+    results = Results(path)
+    try:
+        settings = results.settings()
+        if settings is None:
+            return None
+        config = simulate.Config(*settings['config'])
+        seatings = lineups(settings['policies'], config.players)
+        ratings = Ratings(settings['policies'], seatings)
+        games = results.games()
+        for lineup, _, winner, _ in games:
+            ratings.add(lineup, winner)
+    finally:
+        results.close()
+    print(f'{len(games)} games ({config}) in {len(seatings)} lineups,'
+          f' seed {settings["seed"]}', file=out)
+    ratings.report(out)
+    return ratings
+
+
+def main(argv=None):
+    """Run a tournament or show its ratings.
+
+    Args:
+        argv: Command line arguments; sys.argv if None.
+
+    Returns:
+        Exit status.
+    """
+    parser = argparse.ArgumentParser(
+        description='Round-robin tournaments between Grackle policies')
+    commands = parser.add_subparsers(dest='command', required=True)
+    play = commands.add_parser(
+        'run', help='Play a tournament, or the rest of one.')
+    play.add_argument('path', help='Database file of the results.')
+    play.add_argument('policies',
+                      help='Comma separated policies; choose from'
+                           f' {", ".join(sorted(policies.POLICIES))}.')
+    play.add_argument('-p', '--players', default=engine.PLAYER_MIN,
+                      type=int, help='Number of players.')
+    play.add_argument('-c', '--coins', default=engine.HAND_MIN, type=int,
+                      help='Number of coins in each hand.')
+    play.add_argument('-r', '--remove', default=0, type=int,
+                      help='Number of coins removed before the game.')
+    play.add_argument('-f', '--future', action='store_true',
+                      help='Hand padding.')
+    play.add_argument('--games', default=GAMES, type=int,
+                      help=f'Games per lineup (default: {GAMES}).')
+    play.add_argument('--seed', default=0, type=int,
+                      help='Seed of the tournament.')
+    play.add_argument('--workers', default=os.cpu_count(), type=int,
+                      help='Number of processes.')
+    play.add_argument('--think', default=None, type=float,
+                      metavar='SECONDS',
+                      help='Search time per decision of the ismcts policy.')
+    play.add_argument('--tables', default=None, metavar='DIR',
+                      help='Directory of the policy tables of the table'
+                           ' policy.')
+    show = commands.add_parser('report', help='Show the ratings.')
+    show.add_argument('path', help='Database file of the results.')
+    args = parser.parse_args(argv)
+    if args.command == 'report':
+        if not os.path.exists(args.path) or report(args.path) is None:
+            parser.error(f'{args.path} holds no tournament')
+        return 0
+    names = [name.strip() for name in args.policies.split(',')]
+    config = simulate.Config(args.players, args.coins, args.remove,
+                             args.future)
+    options = {key: value for key, value in (('budget', args.think),
+                                             ('tables', args.tables))
+               if value is not None}
+    began = time.perf_counter()
+    try:
+        ratings = run(args.path, names, config, args.games, args.seed,
+                      args.workers, options, sys.stderr)
+    except ValueError as error:
+        parser.error(str(error))
+    except KeyboardInterrupt:
+        print('Stopped; run again to play the remaining games.',
+              file=sys.stderr)
+        return 130
+    print(f'Done in {time.perf_counter() - began:.1f}s')
+    ratings.report()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
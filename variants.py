@@ -0,0 +1,116 @@
+"""Variant rules: coins playing other or custom effects.
+
+A variant file is a JSON object giving some coins the effect they play
+(a name from engine.EFFECT_TYPES, or "module:Class" for an engine.Effect
+subclass of your own) and settings of that effect; the other coins keep
+their usual effect:
+
+    {
+        "[key]": {"effect": "raven"},
+        "[boots]": {"plays": 2, "description": "Play the top two coins"},
+        "[arrow]": {"shieldable": false},
+        "[wind]": {"effect": "gusts:Gale"}
+    }
+
+The coins themselves are always the ones of engine.COINS: game records,
+the search, the batch simulator and the server protocol all number them
+by id, so only what they do can change.  Games of a variant are played
+on the Table subclass returned by table_class().
+"""
+import functools
+import importlib
+import json
+
+import engine
+
+
+def effect_type(name):
+    """Find an effect class.
+
+    Args:
+        name: Registered effect name, or "module:Class".
+
+    Returns:
+        engine.Effect subclass.
+
+    Raises:
+        ValueError: no such effect.
+    """
+    if ':' not in name:
+        try:
+            return engine.EFFECT_TYPES[name]
+        except KeyError:
+            raise ValueError(
+                f'Unknown effect {name!r}; choose from'
+                f' {", ".join(sorted(engine.EFFECT_TYPES))}') from None
+    module, _, attribute = name.partition(':')
+    try:
+        cls = getattr(importlib.import_module(module), attribute, None)
+    except ImportError as error:
+        raise ValueError(f'Cannot import {module!r} of {name}: {error}'
+                         ) from error
+    if not (isinstance(cls, type) and issubclass(cls, engine.Effect)):
+        raise ValueError(f'{name} is not an engine.Effect subclass')
+    return cls
+
+
+def parse(variant):
+    """Build the effects of a variant.
+
+    Args:
+        variant: Dict of coin name to dict of "effect" and settings.
+
+    Returns:
+        Tuple of engine.Effect by coin id, like engine.EFFECTS.
+
+    Raises:
+        ValueError: not a dict of dicts, or unknown coin, effect or
+            setting.
+    """
+    if not isinstance(variant, dict):
+        raise ValueError('A variant is an object of coin names')
+    effects = list(engine.EFFECTS)
+    for name, spec in variant.items():
+        if name not in engine.COIN_IDS:
+            raise ValueError(f'Unknown coin {name!r}')
+        if not isinstance(spec, dict):
+            raise ValueError(f'The effect of {name} is not an object')
+        coin = engine.COIN_IDS[name]
+        options = dict(spec)
+        cls = (effect_type(str(options.pop('effect'))) if 'effect' in options
+               else type(engine.EFFECTS[coin]))
+        effects[coin] = cls(coin, **options)
+    return tuple(effects)
+
+
+def load(path):
+    """Read the effects of a variant file.
+
+    Args:
+        path: Name of the JSON variant file.
+
+    Returns:
+        Tuple of engine.Effect by coin id, like engine.EFFECTS.
+
+    Raises:
+        ValueError: the file is not a valid variant.
+    """
+    with open(path) as variant:
+        return parse(json.load(variant))
+
+
+@functools.lru_cache(maxsize=None)
+def table_class(effects, base=engine.Table):
+    """Table class playing a variant.
+
+    Args:
+        effects: Tuple of engine.Effect by coin id, e.g. from load().
+        base: Table class to extend, e.g. instrument.ProfiledTable.
+
+    Returns:
+        Subclass of base; the same one for the same arguments.
+    """
+    if effects == base.effects:
+        return base
+    return type(base.__name__, (base,), {'__slots__': (),
+                                          'effects': effects})
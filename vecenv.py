@@ -0,0 +1,589 @@
+"""Vectorized environment for training agents, in the style of Gymnasium.
+
+VectorEnv plays a batch of games at once.  In each game the agent answers
+the decisions of one seat and registered policies (see policies.py) play
+the others; a game that ends is dealt again at once, so every step has an
+observation and a decision in every game.
+
+Actions are one flat encoding for all decisions (see ACTIONS): a coin id
+for the coins to play, give, put back, copy or bury, PASS to play nothing,
+opponents by how many seats they sit after the agent, an index into the
+opponent's hand, KEEP or SWAP for the lantern and STAY or MOVE for the
+rope.  The action mask says which ones are legal.
+
+Observations are uint8 arrays, one row per game, seen from the agent's
+seat, with seats counted from the agent's (0); see FIELDS and fields():
+
+- decision: the decision asked, one-hot in engine.DECISIONS order
+- playing: the coin whose effect asks it (target, opponent coin, give)
+- opponent: the opponent it is aimed at (opponent coin, give)
+- hand, larder, field: the agent's coins and the coins in play
+- hands, larders, shields: coins in hand, larder held and shield per seat
+- pile: coins left in the pile
+- peeks: coins the agent saw since its last decision, per seat's hand and
+  at the top, second and bottom of the pile
+
+The agent has to remember what it saw before then itself.  A game that
+ends before the agent's first decision in it is dealt again unseen.
+
+The Python engine makes one process good for some tens of thousands of
+steps per second; with workers, processes step slices of the batch in
+lockstep and write their rows straight into shared memory.
+
+    env = VectorEnv(1024, players=3, opponents='greedy')
+    observations, infos = env.reset(seed=1)
+    observations, rewards, terminated, truncated, infos = env.step(actions)
+
+Requires NumPy.
+"""
+import multiprocessing
+import random
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np
+except ImportError:  # Only needed when actually stepping
+    np = None
+
+import engine
+import policies
+import simulate
+from engine import NONE, DONE, ROPE
+
+
+COINS = len(engine.COIN_NAMES)
+OFFSETS = engine.PLAYER_MAX - 1  # Opponents, by seats after the agent
+OPP_COINS = engine.HAND_MAX  # Coins an opponent can be hit in
+
+# Flat actions
+PASS = COINS  # Play nothing: the hand is empty
+TARGET = PASS + 1  # + offset - 1: the opponent offset seats on
+OPP_COIN = TARGET + OFFSETS  # + index: that coin of the opponent's hand
+KEEP = OPP_COIN + OPP_COINS  # Lantern: the top coin stays on top
+SWAP = KEEP + 1  # Lantern: the second coin goes on top
+STAY = SWAP + 1  # Rope: leave the pile
+MOVE = STAY + 1  # Rope: move the bottom coin to the top
+ACTIONS = MOVE + 1
+
+ASKED = engine.DECISIONS[:-1]  # Decisions, without DONE
+PEEKS = OFFSETS + 4  # Peek rows: hands by offset, top, second, bottom
+FIELDS = (  # name, shape of a row
+    ('decision', (len(ASKED),)),
+    ('playing', (COINS,)),
+    ('opponent', (engine.PLAYER_MAX,)),
+    ('hand', (COINS,)),
+    ('larder', (COINS,)),
+    ('field', (COINS,)),
+    ('hands', (engine.PLAYER_MAX,)),
+    ('larders', (engine.PLAYER_MAX,)),
+    ('shields', (engine.PLAYER_MAX,)),
+    ('pile', (1,)),
+    ('peeks', (PEEKS, COINS)),
+    )
+
+
+def _layout():
+    """Offsets of FIELDS in a row, and the size of a row.
+    """
+    starts = {}
+    size = 0
+    for name, shape in FIELDS:
+        starts[name] = size
+        count = 1
+        for length in shape:
+            count *= length
+        size += count
+    return starts, size
+
+
+STARTS, SIZE = _layout()
+_DECISION = {decision: STARTS['decision'] + index
+             for index, decision in enumerate(ASKED)}
+_COIN_DECISIONS = frozenset((engine.PLAY, engine.GIVE, engine.PURSE,
+                             engine.MIRROR_PICK, engine.SHOVEL_PICK))
+_TOP, _BOTTOM = OFFSETS + 1, OFFSETS + 3  # Peek rows of the pile
+_PLAYING, _OPPONENT = STARTS['playing'], STARTS['opponent']
+_HAND, _LARDER, _FIELD = STARTS['hand'], STARTS['larder'], STARTS['field']
+_HANDS, _LARDERS = STARTS['hands'], STARTS['larders']
+_SHIELDS, _PILE, _PEEKS = STARTS['shields'], STARTS['pile'], STARTS['peeks']
+
+
+_SHARED = (  # name, dtype, shape of a row: arrays shared with workers
+    ('observations', 'u1', (SIZE,)),
+    ('action_mask', '?', (ACTIONS,)),
+    ('actions', 'i8', ()),
+    ('rewards', 'f4', ()),
+    ('terminated', '?', ()),
+    ('truncated', '?', ()),
+    ('seat', 'i1', ()),
+    ('winner', 'i1', ()),
+    )
+
+
+def _require_numpy():
+    """Fail clearly without NumPy.
+    """
+    if np is None:
+        raise RuntimeError('The vectorized environment requires NumPy')
+
+
+def fields(observations):
+    """Split observations into named views.
+
+    Args:
+        observations: Array of shape (games, SIZE), as returned by step().
+
+    Returns:
+        Dict of field name: array view of shape (games,) + field shape.
+    """
+    views = {}
+    for name, shape in FIELDS:
+        start = STARTS[name]
+        count = 1
+        for length in shape:
+            count *= length
+        views[name] = observations[:, start:start + count].reshape(
+            (len(observations),) + shape)
+    return views
+
+
+def decode(table, action):
+    """Engine action of a flat action, for the seat to move.
+
+    Args:
+        table: engine.Table.
+        action: Flat action.
+
+    Returns:
+        Engine action, or None if the action does not fit the decision.
+    """
+    decision = table.pending[0]
+    if decision in _COIN_DECISIONS:
+        if action == PASS and decision == engine.PLAY:
+            return NONE
+        return action if 0 <= action < COINS else None
+    if decision == engine.TARGET:
+        if TARGET <= action < OPP_COIN:
+            return (table.current + action - TARGET + 1) % table.players
+    elif decision == engine.OPP_COIN:
+        if OPP_COIN <= action < KEEP:
+            return action - OPP_COIN
+    elif decision == engine.LANTERN_ORDER:
+        if action in (KEEP, SWAP):
+            return table.pile[action - KEEP]
+    elif decision == engine.ROPE_MOVE:
+        if action in (STAY, MOVE):
+            return action - STAY
+    return None
+
+
+def encode(table, action):
+    """Flat action of an engine action, for the seat to move.
+    """
+    decision = table.pending[0]
+    if decision in _COIN_DECISIONS:
+        return PASS if action == NONE else action
+    if decision == engine.TARGET:
+        return TARGET + (action - table.current) % table.players - 1
+    if decision == engine.OPP_COIN:
+        return OPP_COIN + action
+    if decision == engine.LANTERN_ORDER:
+        return KEEP if action == table.pile[0] else SWAP
+    return STAY + action  # ROPE_MOVE
+
+
+def _views(buffer, games):
+    """The _SHARED arrays of a batch, laid out one after the other.
+
+    Args:
+        buffer: Buffer of at least _views(None, games) bytes, or None to
+            only count them.
+        games: Number of games.
+
+    Returns:
+        Dict of name: array, or the number of bytes if buffer is None.
+    """
+    views = {}
+    offset = 0
+    for name, dtype, shape in _SHARED:
+        dtype = np.dtype(dtype)
+        size = games * dtype.itemsize
+        for length in shape:
+            size *= length
+        if buffer is not None:
+            views[name] = np.ndarray((games,) + shape, dtype, buffer, offset)
+        offset += size
+    return views if buffer is not None else offset
+
+
+def _serve(connection, name, start, stop, games, settings):
+    """Worker process: steps games start to stop of a shared batch.
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    views = {key: array[start:stop]
+             for key, array in _views(memory.buf, games).items()}
+    env = VectorEnv(stop - start, **settings)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        if request[0] == 'reset':
+            observations, infos = env.reset(request[1])
+            results = {'observations': observations, 'rewards': 0,
+                       'terminated': False, 'truncated': False}
+        else:
+            observations, rewards, terminated, truncated, infos = env.step(
+                views['actions'])
+            results = {'observations': observations, 'rewards': rewards,
+                       'terminated': terminated, 'truncated': truncated}
+        results.update(infos)
+        for key, value in results.items():
+            views[key][...] = value
+        connection.send(True)
+    env.close()
+    del views
+    memory.close()
+    connection.close()
+
+
+class _Table(engine.Table):
+    """Table of the environment; step() checks actions against the mask.
+    """
+    __slots__ = ()
+    trusted = True
+
+
+class _Game:
+    """One game of the batch, with its other seats and what the agent saw.
+    """
+    __slots__ = ('table', 'seat', 'others', 'seats', 'peeks', 'legal',
+                 'seed')
+
+    def __init__(self, others):
+        self.table = None
+        self.seat = 0  # Seat of the agent
+        self.others = others  # Policies of the seats after the agent's
+        self.seats = []  # Policy per seat, None for the agent
+        self.peeks = []  # (row, coin) seen since the agent's last decision
+        self.legal = {}  # Flat action: engine action, for the agent
+        self.seed = None
+
+
+class VectorEnv:
+    """A batch of games, each waiting on a decision of the agent.
+    """
+    def __init__(self, games, players=engine.PLAYER_MIN,
+                 coins=engine.HAND_MIN, remove=0, future=False,
+                 opponents='greedy', seat=None, max_turns=simulate.MAX_TURNS,
+                 workers=1, **options):
+        """Create the environment; reset() deals the games.
+
+        Args:
+            games: Number of games played at once.
+            players: Number of seats.
+            coins: Number of coins in each hand.
+            remove: Number of coins removed before each game.
+            future: Pad hands as in --future.
+            opponents: Policy name for the other seats, or comma separated
+                names, in seat order after the agent.
+            seat: Seat of the agent, or None for a random seat per game.
+            max_turns: Turns after which a game is cut short (truncated).
+            workers: Processes stepping slices of the batch; games are
+                seeded per slice, so results depend on the number.
+            options: Settings of the opponent policies, as for
+                policies.seat_policies().
+
+        Raises:
+            ValueError: unknown policy or seat.
+        """
+        _require_numpy()
+        if seat is not None and not 0 <= seat < players:
+            raise ValueError(f'No seat {seat} among {players} players')
+        self.config = simulate.Config(players, coins, remove, future)
+        self.seat = seat
+        self.max_turns = max_turns
+        self.size = games
+        self.rng = random.Random()
+        self.seed = None
+        self.dealt = 0  # Games dealt so far, to seed the next one
+        self.mask = None  # Action mask of the decisions waiting
+        self.pool = []  # (process, connection) per worker
+        self.memory = self.views = None
+        if workers > 1:
+            self.games = []
+            policies.seat_policies(opponents, players - 1,
+                                   **options)  # Unknown names fail here
+            settings = dict(players=players, coins=coins, remove=remove,
+                            future=future, opponents=opponents, seat=seat,
+                            max_turns=max_turns, **options)
+            self.memory = shared_memory.SharedMemory(
+                create=True, size=max(1, _views(None, games)))
+            self.views = _views(self.memory.buf, games)
+            for worker in range(workers):
+                mine, theirs = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=_serve, daemon=True,
+                    args=(theirs, self.memory.name,
+                          games * worker // workers,
+                          games * (worker + 1) // workers, games, settings))
+                process.start()
+                self.pool.append((process, mine))
+        else:
+            self.games = [
+                _Game(policies.seat_policies(opponents, players - 1,
+                                             **options))
+                for _ in range(games)]
+
+    def __len__(self):
+        return self.size
+
+    def reset(self, seed=None):
+        """Deal every game again.
+
+        Args:
+            seed: Seed of the games and policies; random if None.
+
+        Returns:
+            observations, infos: as returned by step().
+        """
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        if self.pool:
+            for worker, (_, connection) in enumerate(self.pool):
+                connection.send(
+                    ('reset', simulate.derive(self.seed, 'slice', worker)))
+            observations, _, _, _, infos = self.gather()
+            return observations, infos
+        self.rng = random.Random(simulate.derive(self.seed, 'seats'))
+        self.dealt = 0
+        rows, masks = [], []
+        for game in self.games:
+            self.deal(game)
+            rows.append(self.observe(game, masks))
+        return self.arrays(rows, masks, [NONE] * len(self.games))
+
+    def step(self, actions):
+        """Answer the decision of the agent in every game.
+
+        Args:
+            actions: Sequence or array of flat actions, one per game.
+
+        Returns:
+            observations: uint8 array (games, SIZE) for the next decisions.
+            rewards: float32 array (games,): 1 when the agent won, -1 when
+                another seat did, else 0.
+            terminated: bool array (games,): the game was won; the
+                observation is of the next game.
+            truncated: bool array (games,): the game hit max_turns.
+            infos: dict with 'action_mask', bool array (games, ACTIONS),
+                'seat', int8 array (games,) of the agent's seat in the
+                game observed, and 'winner', int8 array (games,) of the
+                seats after the agent the winner sat (0 for the agent),
+                -1 if the game did not end.
+
+        Raises:
+            ValueError: an action is not legal in its game.
+        """
+        actions = np.asarray(actions)
+        if actions.shape != (self.size,):
+            raise ValueError(f'{len(actions)} actions for {self.size} games')
+        legal = (0 <= actions) & (actions < ACTIONS)
+        legal[legal] = self.mask[legal.nonzero()[0], actions[legal]]
+        if not legal.all():
+            index = int((~legal).nonzero()[0][0])
+            raise ValueError(
+                f'Illegal action {actions[index]} in game {index}; legal:'
+                f' {self.mask[index].nonzero()[0].tolist()}')
+        if self.pool:
+            self.views['actions'][...] = actions
+            for _, connection in self.pool:
+                connection.send(('step',))
+            return self.gather()
+        games = self.games
+        rewards = [0.0] * len(games)
+        ended = [False] * len(games)
+        cut = [False] * len(games)
+        winners = [NONE] * len(games)
+        rows, masks = [], []
+        for index, game in enumerate(games):
+            game.peeks = []
+            self.play(game, game.legal[int(actions[index])])
+            self.advance(game)
+            table = game.table
+            if table.winner != NONE:
+                winners[index] = (table.winner - game.seat) % table.players
+                rewards[index] = 1.0 if winners[index] == 0 else -1.0
+                ended[index] = True
+            elif table.turn > self.max_turns:
+                cut[index] = True
+            if ended[index] or cut[index]:
+                self.deal(game)
+            rows.append(self.observe(game, masks))
+        observations, infos = self.arrays(rows, masks, winners)
+        return (observations, np.array(rewards, dtype=np.float32),
+                np.array(ended), np.array(cut), infos)
+
+    def deal(self, game):
+        """Start the next game in a slot, up to the agent's decision.
+        """
+        players = self.config.players
+        table = None
+        while table is None or table.pending[0] == DONE or (
+                table.turn > self.max_turns):
+            game.seed = simulate.derive(self.seed, 'game', self.dealt)
+            self.dealt += 1
+            seat = game.seat = self.rng.randrange(players) if (
+                self.seat is None) else self.seat
+            seats = game.seats = [None] * players
+            for offset, policy in enumerate(game.others, 1):
+                seats[(seat + offset) % players] = policy
+            table = game.table = engine.new_table(
+                *self.config, seed=game.seed, table_class=_Table)
+            game.peeks = []
+            for other, policy in enumerate(seats):
+                if policy is not None:
+                    policy.start(other, table, random.Random(
+                        simulate.derive(game.seed, 'seat', other)))
+                    policy.observe(table.events)
+            self.saw(game, table.events)
+            self.advance(game)
+
+    def play(self, game, action):
+        """Step a game and tell everyone what happened.
+        """
+        events = game.table.step(action)
+        for policy in game.seats:
+            if policy is not None:
+                policy.observe(events)
+        self.saw(game, events)
+
+    def advance(self, game):
+        """Let the other seats play until the agent has to decide.
+        """
+        table = game.table
+        seats = game.seats
+        while (table.pending[0] != DONE and table.current != game.seat
+               and table.turn <= self.max_turns):
+            self.play(game, seats[table.current].act(table))
+
+    def saw(self, game, events):
+        """Note the coins the agent saw, by peek row.
+        """
+        seat = game.seat
+        table = game.table
+        peeks = game.peeks
+        players = table.players
+        previous = NONE
+        for event in events:
+            kind = event.kind
+            if kind == engine.PLAYED:
+                previous = event.coin
+            elif kind == engine.SAW and event.player == seat:
+                if event.target != NONE:
+                    row = (event.target - seat) % players - 1
+                elif previous == ROPE:
+                    row = _BOTTOM
+                else:
+                    row = _TOP + event.other
+                peeks.append((row, event.coin))
+            elif kind == engine.TRADED and seat == event.player:
+                if event.coin != NONE:
+                    peeks.append(((event.target - seat) % players - 1,
+                                  event.coin))
+            elif kind == engine.TRADED and seat == event.target:
+                if event.other != NONE:
+                    peeks.append(((event.player - seat) % players - 1,
+                                  event.other))
+            elif kind == engine.BURIED and event.target in (NONE, seat):
+                peeks.append((_BOTTOM, event.coin))
+            elif kind == engine.PUT_BACK and event.player == seat:
+                peeks.append((_TOP, event.coin))
+
+    def observe(self, game, masks):
+        """Observation row of a game, adding its action mask to masks.
+
+        Returns:
+            bytes of the row.
+        """
+        table = game.table
+        seat = game.seat
+        players = table.players
+        row = bytearray(SIZE)
+        pending = table.pending
+        decision = pending[0]
+        row[_DECISION[decision]] = 1
+        if decision == engine.TARGET:
+            row[_PLAYING + pending[1]] = 1
+        elif decision == engine.OPP_COIN:
+            row[_PLAYING + pending[1]] = 1
+            row[_OPPONENT + (pending[2] - seat) % players] = 1
+        elif decision == engine.GIVE:
+            row[_PLAYING + engine.KNIFE] = 1
+            row[_OPPONENT + (pending[1] - seat) % players] = 1
+        for coin in table.hands[seat]:
+            row[_HAND + coin] = 1
+        larders = table.larders
+        if larders[seat] != NONE:
+            row[_LARDER + larders[seat]] = 1
+        for coin in table.in_play:
+            row[_FIELD + coin] = 1
+        hands, shields = table.hands, table.shields
+        for offset in range(players):
+            other = (seat + offset) % players
+            row[_HANDS + offset] = len(hands[other])
+            row[_LARDERS + offset] = larders[other] != NONE
+            row[_SHIELDS + offset] = shields[other]
+        row[_PILE] = len(table.pile)
+        for peek, coin in game.peeks:
+            row[_PEEKS + peek * COINS + coin] = 1
+        legal = game.legal = {}
+        mask = bytearray(ACTIONS)
+        if decision != DONE:
+            for action in table.legal_actions():
+                flat = encode(table, action)
+                legal[flat] = action
+                mask[flat] = 1
+        masks.append(bytes(mask))
+        return bytes(row)
+
+    def arrays(self, rows, masks, winners):
+        """Observations and infos of a step, from the rows of the games.
+        """
+        observations = np.frombuffer(b''.join(rows), dtype=np.uint8)
+        mask = np.frombuffer(b''.join(masks), dtype=np.bool_)
+        self.mask = mask.reshape(len(masks), ACTIONS)
+        infos = {
+            'action_mask': self.mask,
+            'seat': np.array([game.seat for game in self.games],
+                             dtype=np.int8),
+            'winner': np.array(winners, dtype=np.int8),
+            }
+        return observations.reshape(len(rows), SIZE), infos
+
+    def gather(self):
+        """Wait for the workers and copy out the results of a step.
+        """
+        for _, connection in self.pool:
+            connection.recv()
+        views = self.views
+        self.mask = views['action_mask'].copy()
+        infos = {'action_mask': self.mask, 'seat': views['seat'].copy(),
+                 'winner': views['winner'].copy()}
+        return (views['observations'].copy(), views['rewards'].copy(),
+                views['terminated'].copy(), views['truncated'].copy(),
+                infos)
+
+    def close(self):
+        """Stop the workers and the opponent policies.
+        """
+        for process, connection in self.pool:
+            connection.send(None)
+            process.join()
+        self.pool = []
+        if self.memory is not None:
+            self.views = None
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+        for game in self.games:
+            for policy in game.others:
+                policy.close()